@@ -0,0 +1,222 @@
+# app/assets.py
+"""
+Pipeline de assets estáticos (roda na subida da aplicação, em memória).
+
+- JS/CSS de static/ são minificados (rjsmin/rcssmin, se instalados), ganham
+  hash de conteúdo no nome (`pricingLogic.3f9a1c2b7d.js`) e são
+  pré-comprimidos em gzip e brotli;
+- as páginas HTML têm as referências `/static/<arquivo>` reescritas para os
+  nomes com hash e ficam em memória (também pré-comprimidas);
+- `AssetStaticFiles` serve as versões com hash com cache `immutable` e
+  delega o resto (imagens etc.) ao StaticFiles padrão.
+
+Com `ASSETS_AUTO_RELOAD` (padrão: ligado quando DEBUG=true) o build é refeito
+quando algum arquivo de static/ muda — útil com o volume de hot-reload do
+docker-compose.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Receive, Scope, Send
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover - Brotli está no requirements.txt
+    brotli = None
+
+try:
+    import rjsmin  # type: ignore
+except ImportError:  # pragma: no cover
+    rjsmin = None
+
+try:
+    import rcssmin  # type: ignore
+except ImportError:  # pragma: no cover
+    rcssmin = None
+
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+STATIC_PREFIX = "/static/"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PAGE_CACHE_CONTROL = "private, no-cache"
+
+_TRUE = {"1", "true", "yes", "sim"}
+AUTO_RELOAD = (os.environ.get("ASSETS_AUTO_RELOAD") or os.environ.get("DEBUG") or "").strip().lower() in _TRUE
+# Intervalo mínimo (s) entre verificações de mudança em static/
+RELOAD_CHECK_SECONDS = 2.0
+
+_CONTENT_TYPES = {
+    ".js": "application/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".html": "text/html; charset=utf-8",
+}
+
+
+@dataclass(frozen=True)
+class Asset:
+    name: str
+    content_type: str
+    body: bytes
+    gzip: bytes
+    br: Optional[bytes]
+    etag: str
+
+    def variant(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        """Melhor variante aceita pelo cliente: (corpo, Content-Encoding)."""
+        accepted = {p.split(";")[0].strip().lower() for p in (accept_encoding or "").split(",")}
+        if self.br is not None and "br" in accepted:
+            return self.br, "br"
+        if "gzip" in accepted:
+            return self.gzip, "gzip"
+        return self.body, None
+
+
+# =============================================================================
+# Build
+# =============================================================================
+def _minify(suffix: str, text: str) -> str:
+    if suffix == ".js" and rjsmin is not None:
+        return rjsmin.jsmin(text)
+    if suffix == ".css" and rcssmin is not None:
+        return rcssmin.cssmin(text)
+    return text
+
+
+def _make_asset(name: str, content_type: str, body: bytes) -> Asset:
+    return Asset(
+        name=name,
+        content_type=content_type,
+        body=body,
+        gzip=gzip.compress(body, compresslevel=9, mtime=0),
+        br=brotli.compress(body, quality=11) if brotli is not None else None,
+        etag='"' + hashlib.sha256(body).hexdigest()[:32] + '"',
+    )
+
+
+def _hashed_name(path: Path, body: bytes) -> str:
+    digest = hashlib.sha256(body).hexdigest()[:10]
+    return f"{path.stem}.{digest}{path.suffix}"
+
+
+@dataclass
+class Manifest:
+    assets: Dict[str, Asset]          # nome com hash -> asset
+    mapping: Dict[str, str]           # nome original -> nome com hash
+    pages: Dict[str, Asset]           # nome do .html -> página reescrita
+    stamp: Tuple[Tuple[str, int], ...]
+
+
+def _source_stamp(static_dir: Path) -> Tuple[Tuple[str, int], ...]:
+    return tuple(
+        sorted((p.name, p.stat().st_mtime_ns) for p in static_dir.iterdir() if p.suffix in _CONTENT_TYPES)
+    )
+
+
+def build(static_dir: Path = STATIC_DIR) -> Manifest:
+    assets: Dict[str, Asset] = {}
+    mapping: Dict[str, str] = {}
+    for path in sorted(static_dir.iterdir()):
+        if path.suffix not in (".js", ".css") or not path.is_file():
+            continue
+        body = _minify(path.suffix, path.read_text(encoding="utf-8")).encode("utf-8")
+        hashed = _hashed_name(path, body)
+        assets[hashed] = _make_asset(hashed, _CONTENT_TYPES[path.suffix], body)
+        mapping[path.name] = hashed
+
+    # /static/<arquivo> (com ou sem ?query) -> /static/<arquivo com hash>
+    ref = re.compile(r"""(["'])/static/([^"'?#]+)(?:\?[^"'#]*)?\1""")
+
+    def rewrite(m: "re.Match[str]") -> str:
+        hashed = mapping.get(m.group(2))
+        return f"{m.group(1)}{STATIC_PREFIX}{hashed}{m.group(1)}" if hashed else m.group(0)
+
+    pages: Dict[str, Asset] = {}
+    for path in sorted(static_dir.glob("*.html")):
+        html = ref.sub(rewrite, path.read_text(encoding="utf-8"))
+        pages[path.name] = _make_asset(path.name, _CONTENT_TYPES[".html"], html.encode("utf-8"))
+
+    return Manifest(assets=assets, mapping=mapping, pages=pages, stamp=_source_stamp(static_dir))
+
+
+# =============================================================================
+# Manifesto corrente
+# =============================================================================
+_manifest: Optional[Manifest] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def manifest() -> Manifest:
+    global _manifest, _checked_at
+    current = _manifest
+    if current is not None and not AUTO_RELOAD:
+        return current
+    now = time.monotonic()
+    if current is not None and now - _checked_at < RELOAD_CHECK_SECONDS:
+        return current
+    with _lock:
+        _checked_at = now
+        if _manifest is None or _manifest.stamp != _source_stamp(STATIC_DIR):
+            _manifest = build(STATIC_DIR)
+        return _manifest
+
+
+def asset_url(name: str) -> str:
+    """URL versionada de um asset (ou a original, se não for JS/CSS)."""
+    return STATIC_PREFIX + manifest().mapping.get(name, name)
+
+
+def _page(name: str) -> Optional[Asset]:
+    pages = manifest().pages
+    if name in pages:
+        return pages[name]
+    # Compat: a rota /alertas pede "alertas.html", o arquivo é "Alertas.html"
+    lowered = name.lower()
+    return next((a for n, a in pages.items() if n.lower() == lowered), None)
+
+
+def _encoded_response(asset: Asset, headers: Headers, cache_control: str) -> Response:
+    if asset.etag in [v.strip() for v in (headers.get("if-none-match") or "").split(",")]:
+        return Response(status_code=304, headers={"ETag": asset.etag, "Cache-Control": cache_control})
+    body, encoding = asset.variant(headers.get("accept-encoding", ""))
+    out = {"ETag": asset.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if encoding:
+        out["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset.content_type, headers=out)
+
+
+def page_response(name: str, request_headers: Headers) -> Response:
+    """Página HTML em memória, com referências a assets versionados."""
+    asset = _page(name)
+    if asset is None:
+        return Response(status_code=404)
+    return _encoded_response(asset, request_headers, PAGE_CACHE_CONTROL)
+
+
+# =============================================================================
+# Static handler
+# =============================================================================
+class AssetStaticFiles(StaticFiles):
+    """StaticFiles que serve JS/CSS com hash (pré-comprimidos) da memória."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            name = self.get_path(scope).lstrip("/")
+            asset = manifest().assets.get(name)
+            if asset is not None:
+                response = _encoded_response(asset, Headers(scope=scope), IMMUTABLE_CACHE_CONTROL)
+                await response(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,367 @@
+# app/bulk_import.py
+"""
+Importação em massa de precificações (CSV/XLSX).
+
+Fluxo de um job:
+  1) a planilha é lida linha a linha (csv.reader / openpyxl read_only);
+  2) a cada lote de IMPORT_BATCH_SIZE linhas: validação pydantic em lote,
+     busca dos produtos de todos os SKUs numa consulta e cálculo dos campos
+     derivados com o motor de app/pricing.py;
+  3) as linhas válidas vão para um arquivo NDJSON temporário, gravado no
+     final com um único load job do BigQuery.
+
+O progresso e o relatório de erros por linha ficam no registro em memória
+(`get_job`) e podem ser acompanhados em streaming (`iter_progress`).
+"""
+from __future__ import annotations
+
+import csv
+import os
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, field_validator
+
+from .pricing import calcular_precificacao
+from .serialization import dumps
+
+IMPORT_BATCH_SIZE = 500
+MAX_ERROS_REPORTADOS = 10000
+MAX_JOBS_EM_MEMORIA = 50
+
+IMPORT_EXTENSIONS = (".csv", ".xlsx")
+
+
+# =============================================================================
+# Modelo da linha importada
+# =============================================================================
+class ImportRow(BaseModel):
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True)
+
+    marketplace: str = Field(..., min_length=1)
+    id_loja: str = Field(..., min_length=1)
+    sku: str = Field(..., min_length=1)
+    titulo: Optional[str] = None
+    categoria_precificacao: Optional[str] = None
+    id_sku_marketplace: Optional[str] = None
+    id_anuncio: Optional[str] = None
+
+    quantidade: int = Field(1, gt=0)
+    custo_unitario: Optional[float] = Field(None, ge=0)
+    parcelamento: float = 0.0
+    outros: float = 0.0
+    regra_comissao: Optional[str] = None
+    fulfillment: bool = False
+    catalogo_buybox: bool = False
+
+    venda_classico: Optional[float] = Field(None, ge=0)
+    venda_premium: Optional[float] = Field(None, ge=0)
+    margem_desejada_classico: Optional[float] = None
+    margem_desejada_premium: Optional[float] = None
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def _normaliza_celula(cls, v: Any, info) -> Any:
+        nome = info.field_name
+        if isinstance(v, str):
+            v = v.strip()
+            if v == "":
+                v = None
+            elif nome in _CAMPOS_NUMERICOS and "," in v:
+                if "." in v and v.rfind(",") < v.rfind("."):
+                    # "1,234.56": não dá para saber qual é o decimal
+                    raise ValueError(f"separadores ambíguos em '{v}' (use 1234.56 ou 1.234,56)")
+                if v.count(",") == 1:
+                    # "1.234,56" (pt-BR) -> "1234.56"
+                    v = v.replace(".", "").replace(",", ".")
+        if v is None:
+            return _PADROES_SE_VAZIO.get(nome)
+        if nome in _CAMPOS_BOOL and isinstance(v, str):
+            return v.lower() in {"1", "true", "t", "sim", "s", "yes", "y", "x"}
+        if nome in _CAMPOS_TEXTO and not isinstance(v, str):
+            # XLSX entrega SKUs numéricos como int/float
+            if isinstance(v, float) and v.is_integer():
+                v = int(v)
+            return str(v)
+        return v
+
+
+_CAMPOS_NUMERICOS = {
+    "quantidade", "custo_unitario", "parcelamento", "outros",
+    "venda_classico", "venda_premium", "margem_desejada_classico", "margem_desejada_premium",
+}
+_CAMPOS_BOOL = {"fulfillment", "catalogo_buybox"}
+_CAMPOS_TEXTO = {
+    "marketplace", "id_loja", "sku", "titulo", "categoria_precificacao",
+    "id_sku_marketplace", "id_anuncio", "regra_comissao",
+}
+_PADROES_SE_VAZIO = {"quantidade": 1, "parcelamento": 0.0, "outros": 0.0, "fulfillment": False, "catalogo_buybox": False}
+
+_ROWS = TypeAdapter(List[ImportRow])
+
+
+# =============================================================================
+# Job
+# =============================================================================
+@dataclass
+class ImportJob:
+    id: str
+    arquivo: str
+    usuario: str
+    status: str = "pendente"  # pendente | processando | gravando | concluido | erro
+    linhas_lidas: int = 0
+    linhas_validas: int = 0
+    linhas_gravadas: int = 0
+    erros: List[Dict[str, Any]] = field(default_factory=list)
+    mensagem: Optional[str] = None
+    iniciado_em: float = field(default_factory=time.time)
+    concluido_em: Optional[float] = None
+    _changed: threading.Condition = field(default_factory=threading.Condition, repr=False)
+
+    @property
+    def finalizado(self) -> bool:
+        return self.status in ("concluido", "erro")
+
+    def add_erro(self, linha: int, sku: Optional[str], erro: str):
+        if len(self.erros) < MAX_ERROS_REPORTADOS:
+            self.erros.append({"linha": linha, "sku": sku, "erro": erro})
+
+    def notify(self, **changes):
+        with self._changed:
+            for k, v in changes.items():
+                setattr(self, k, v)
+            self._changed.notify_all()
+
+    def snapshot(self, incluir_erros: bool = True) -> Dict[str, Any]:
+        out = {
+            "id": self.id,
+            "arquivo": self.arquivo,
+            "status": self.status,
+            "linhas_lidas": self.linhas_lidas,
+            "linhas_validas": self.linhas_validas,
+            "linhas_gravadas": self.linhas_gravadas,
+            "total_erros": len(self.erros),
+            "mensagem": self.mensagem,
+            "iniciado_em": datetime.utcfromtimestamp(self.iniciado_em).isoformat(),
+            "concluido_em": datetime.utcfromtimestamp(self.concluido_em).isoformat() if self.concluido_em else None,
+        }
+        if incluir_erros:
+            out["erros"] = sorted(self.erros, key=lambda e: e["linha"])
+        return out
+
+
+_jobs: "OrderedDict[str, ImportJob]" = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def get_job(job_id: str) -> Optional[ImportJob]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def start_import(path: str, filename: str, user_email: str) -> ImportJob:
+    """Registra o job e processa o arquivo (já salvo em disco) numa thread."""
+    job = ImportJob(id=str(uuid.uuid4()), arquivo=filename, usuario=user_email)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        while len(_jobs) > MAX_JOBS_EM_MEMORIA:
+            _jobs.popitem(last=False)
+    threading.Thread(target=_run, args=(job, path), name=f"import-{job.id[:8]}", daemon=True).start()
+    return job
+
+
+def iter_progress(job: ImportJob, intervalo: float = 1.0) -> Iterator[bytes]:
+    """NDJSON: um snapshot de progresso por mudança; o último traz os erros."""
+    ultimo = None
+    while True:
+        with job._changed:
+            if not job.finalizado:
+                job._changed.wait(timeout=intervalo)
+        if job.finalizado:
+            yield dumps(job.snapshot(incluir_erros=True)) + b"\n"
+            return
+        snap = job.snapshot(incluir_erros=False)
+        chave = (snap["status"], snap["linhas_lidas"], snap["linhas_validas"], snap["total_erros"])
+        if chave != ultimo:
+            ultimo = chave
+            yield dumps(snap) + b"\n"
+
+
+# =============================================================================
+# Leitura da planilha (streaming)
+# =============================================================================
+def _norm_header(h: Any) -> str:
+    return str(h or "").strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def _iter_csv_rows(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        amostra = f.readline()
+        f.seek(0)
+        delimitador = ";" if amostra.count(";") > amostra.count(",") else ","
+        reader = csv.reader(f, delimiter=delimitador)
+        header = [_norm_header(h) for h in next(reader, [])]
+        for n, values in enumerate(reader, start=2):
+            if not any((v or "").strip() for v in values):
+                continue
+            yield n, dict(zip(header, values))
+
+
+def _iter_xlsx_rows(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [_norm_header(h) for h in next(rows, ())]
+        for n, values in enumerate(rows, start=2):
+            if not any(v not in (None, "") for v in values):
+                continue
+            yield n, {h: v for h, v in zip(header, values) if h}
+    finally:
+        wb.close()
+
+
+def iter_rows(path: str, filename: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    if filename.lower().endswith(".xlsx"):
+        return _iter_xlsx_rows(path)
+    return _iter_csv_rows(path)
+
+
+def _batches(rows: Iterator[Tuple[int, Dict[str, Any]]], size: int):
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+    for item in rows:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# =============================================================================
+# Processamento
+# =============================================================================
+def _services():
+    from app import services  # type: ignore
+    return services
+
+
+def _load_context(services) -> Dict[str, Any]:
+    from .routers.regras import get_rules_payload
+
+    regras = get_rules_payload()
+    categorias: Dict[str, float] = {}
+    for fn in ("get_pricing_categories", "get_all_precificacao_categories"):
+        rows = getattr(services, fn, None)
+        if callable(rows):
+            for c in rows() or []:
+                if isinstance(c, dict) and c.get("nome"):
+                    categorias[str(c["nome"]).lower()] = float(c.get("margem_padrao") or c.get("margem") or 0)
+            break
+    return {
+        "regras_tarifa": [r.model_dump() for r in regras.REGRAS_TARIFA_FIXA_ML],
+        "regras_frete": [r.model_dump() for r in regras.REGRAS_FRETE_ML],
+        "categorias": categorias,
+        "lojas": {},
+    }
+
+
+def _loja_config(services, ctx: Dict[str, Any], marketplace: str, id_loja: str) -> Optional[Dict[str, Any]]:
+    key = (marketplace.lower(), id_loja.lower())
+    if key not in ctx["lojas"]:
+        loja_id = services.get_loja_id_by_marketplace_and_loja(marketplace, id_loja)
+        ctx["lojas"][key] = services.get_store_details(loja_id) if loja_id else None
+    return ctx["lojas"][key]
+
+
+def _validate_batch(job: ImportJob, batch: List[Tuple[int, Dict[str, Any]]]) -> List[Tuple[int, ImportRow]]:
+    raw = [r for _, r in batch]
+    try:
+        return list(zip((n for n, _ in batch), _ROWS.validate_python(raw)))
+    except ValidationError as e:
+        invalidos: Dict[int, List[str]] = {}
+        for err in e.errors():
+            idx = err["loc"][0]
+            campo = ".".join(str(p) for p in err["loc"][1:]) or "linha"
+            invalidos.setdefault(idx, []).append(f"{campo}: {err['msg']}")
+        for idx, msgs in invalidos.items():
+            n, r = batch[idx]
+            job.add_erro(n, r.get("sku"), "; ".join(msgs))
+        restantes = [(n, r) for i, (n, r) in enumerate(batch) if i not in invalidos]
+        if not restantes:
+            return []
+        return list(zip((n for n, _ in restantes), _ROWS.validate_python([r for _, r in restantes])))
+
+
+def _run(job: ImportJob, path: str):
+    spool = tempfile.TemporaryFile(mode="w+b")
+    try:
+        services = _services()
+        job.notify(status="processando")
+        ctx = _load_context(services)
+        agora = datetime.utcnow().isoformat()
+
+        for batch in _batches(iter_rows(path, job.arquivo), IMPORT_BATCH_SIZE):
+            validos = _validate_batch(job, batch)
+            produtos = services.fetch_products_batch([row.sku for _, row in validos])
+            gravaveis = 0
+            for n, row in validos:
+                produto = produtos.get(row.sku.lower())
+                if not produto:
+                    job.add_erro(n, row.sku, "SKU não encontrado no cadastro de produtos.")
+                    continue
+                loja = _loja_config(services, ctx, row.marketplace, row.id_loja)
+                if loja is None:
+                    job.add_erro(n, row.sku, f"Loja não cadastrada: {row.marketplace} / {row.id_loja}.")
+                    continue
+                margem_cat = ctx["categorias"].get((row.categoria_precificacao or "").lower())
+                try:
+                    record = calcular_precificacao(
+                        row.model_dump(), produto, loja, ctx["regras_tarifa"], ctx["regras_frete"], margem_cat
+                    )
+                except Exception as e:
+                    job.add_erro(n, row.sku, f"Falha no cálculo: {e}")
+                    continue
+                record.update(id=str(uuid.uuid4()), data_calculo=agora, calculado_por=job.usuario)
+                spool.write(dumps(record) + b"\n")
+                gravaveis += 1
+            job.notify(
+                linhas_lidas=job.linhas_lidas + len(batch),
+                linhas_validas=job.linhas_validas + gravaveis,
+            )
+
+        if job.linhas_validas:
+            job.notify(status="gravando")
+            job.linhas_gravadas = services.load_precificacoes_ndjson(spool)
+            services.log_action(
+                job.usuario,
+                "BULK_IMPORT_PRICING",
+                details={
+                    "arquivo": job.arquivo,
+                    "linhas_lidas": job.linhas_lidas,
+                    "linhas_gravadas": job.linhas_gravadas,
+                    "erros": len(job.erros),
+                },
+            )
+            if job.linhas_gravadas != job.linhas_validas:
+                raise RuntimeError(
+                    f"O BigQuery gravou {job.linhas_gravadas} de {job.linhas_validas} linhas válidas."
+                )
+        job.notify(status="concluido", concluido_em=time.time())
+    except Exception as e:
+        traceback.print_exc()
+        job.notify(status="erro", mensagem=str(e), concluido_em=time.time())
+    finally:
+        spool.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -1,5 +1,469 @@
 # app/cache.py
+"""
+Cache em memória organizado por namespace.
+
+Cada namespace tem tamanho/TTL próprios e um contador de versão. Escritas
+invalidam apenas os namespaces que afetam (`invalidate("campaigns")`), então
+editar uma campanha não derruba o cache de lojas, regras etc.
+
+A versão também protege contra gravação de valor velho: um carregamento que
+começou antes de uma invalidação não é gravado no cache ao terminar.
+
+Misses são "single-flight": com várias requisições pedindo a mesma chave ao
+mesmo tempo, só uma executa o carregamento (a consulta no BigQuery) e as
+demais aguardam o resultado dela — tanto em threads quanto em corrotinas.
+Falhas do carregamento ficam em cache por ERROR_BACKOFF_SECONDS para não
+martelar a fonte enquanto ela está com problema.
+
+Com vários workers, o cache tem dois níveis: o L1 em memória (este módulo) e
+o L2 compartilhado (ver shared_cache.py). Um miss no L1 consulta o L2 antes
+de ir ao BigQuery, e `invalidate()` incrementa a época compartilhada do
+namespace e avisa os demais workers pelo canal de invalidação — cada um
+descarta o próprio L1 assim que recebe a mensagem.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
 from cachetools import TTLCache
+from cachetools.keys import hashkey
+
+from . import shared_cache
+
+# namespace -> (maxsize, ttl em segundos)
+NAMESPACES: Dict[str, Tuple[int, int]] = {
+    "campaigns": (16, 600),
+    "lojas": (16, 600),
+    "rules": (16, 600),
+    # Muda só via save_loja_details, que descarta a chave da loja
+    "loja_details": (256, 21600),
+    "categories": (16, 600),
+    # Só versionamento: o índice vive em user_directory.py
+    "users": (1, 600),
+    # Só versionamento: snapshot (dashboard_snapshot.py) e cubo de lucro (rollups.py)
+    "dashboard": (1, 600),
+}
+
+# Trechos do nome da ação (log_action) -> namespaces afetados
+ACTION_NAMESPACES: Dict[str, Tuple[str, ...]] = {
+    "RULE": ("rules",),
+    "CAMPAIGN": ("campaigns",),
+    "STORE": ("lojas", "loja_details"),
+    "CATEGOR": ("categories",),
+    "USER": ("users",),
+}
+
+# Tempo (s) em que uma falha de carregamento é devolvida sem nova tentativa
+ERROR_BACKOFF_SECONDS = 5.0
+
+_MISSING = object()
+
+# Identifica as mensagens deste processo no canal de invalidação
+_ORIGIN_TOKEN = uuid.uuid4().hex
+
+
+def _origin() -> str:
+    return f"{_ORIGIN_TOKEN}:{os.getpid()}"
+
+
+def _digest(key: Hashable) -> str:
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """Carregamento síncrono em andamento para uma chave."""
+
+    __slots__ = ("version", "epoch", "seq", "event", "value", "error")
+
+    def __init__(self, version: int, epoch: int, seq: int):
+        self.version = version
+        self.epoch = epoch
+        self.seq = seq
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class CacheNamespace:
+    def __init__(self, name: str, maxsize: int, ttl: int):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.coalesced = 0
+        self._data: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._errors: Dict[Hashable, Tuple[BaseException, float]] = {}
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        # Chaves descartadas durante um carregamento: sequência do descarte,
+        # para o carregamento iniciado antes dele não gravar o valor antigo
+        # (poucas chaves; zerado a cada bump)
+        self._discard_seq = 0
+        self._discarded: Dict[Hashable, int] = {}
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, version: int) -> bool:
+        """Grava somente se nenhuma invalidação ocorreu desde `version`."""
+        with self._lock:
+            if version != self.version:
+                return False
+            self._data[key] = value
+            return True
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+            self._errors.pop(key, None)
+            if key in self._inflight or key in self._tasks:
+                # A carga em andamento pode ter lido o dado antigo: não grava,
+                # e os próximos chamadores começam uma carga nova
+                self._discard_seq += 1
+                self._discarded[key] = self._discard_seq
+                self._inflight.pop(key, None)
+                self._tasks.pop(key, None)
+
+    def discard_digest(self, digest: str):
+        """Remove a chave cujo digest veio de outro worker."""
+        with self._lock:
+            keys = set(self._data.keys()) | set(self._errors) | set(self._inflight) | set(self._tasks)
+            for key in [k for k in keys if _digest(k) == digest]:
+                self.discard(key)
+
+    def bump(self, epoch: Optional[int] = None) -> int:
+        with self._lock:
+            self.version += 1
+            if epoch is not None:
+                self.epoch = max(self.epoch, epoch)
+            self._data.clear()
+            self._errors.clear()
+            self._discarded.clear()
+            return self.version
+
+    def apply_epoch(self, epoch: int):
+        """Época recebida de outro worker: só invalida se for mais nova."""
+        with self._lock:
+            if epoch > self.epoch:
+                self.bump(epoch)
+
+    # ------------------------------------------------------------------
+    # Nível compartilhado (L2)
+    # ------------------------------------------------------------------
+    def _shared_get(self, key: Hashable, epoch: int) -> Any:
+        try:
+            raw = _backend().get(shared_cache.value_key(self.name, epoch, _digest(key)))
+            if raw is None:
+                return _MISSING
+            value = pickle.loads(raw)
+        except Exception as e:
+            print(f"ERRO AO LER CACHE COMPARTILHADO ({self.name}): {e}")
+            return _MISSING
+        with self._lock:
+            self.shared_hits += 1
+        return value
+
+    def _shared_set(self, key: Hashable, epoch: int, value: Any):
+        try:
+            raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            _backend().set(shared_cache.value_key(self.name, epoch, _digest(key)), raw, self.ttl)
+        except Exception as e:
+            print(f"ERRO AO GRAVAR CACHE COMPARTILHADO ({self.name}): {e}")
+
+    # ------------------------------------------------------------------
+    # Carregamento com single-flight
+    # ------------------------------------------------------------------
+    def _cached_or_error(self, key: Hashable) -> Any:
+        """Sob o lock: valor em cache, exceção em backoff ou _MISSING."""
+        value = self._data.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        err = self._errors.get(key)
+        if err is not None:
+            if err[1] > time.monotonic():
+                raise err[0]
+            del self._errors[key]
+        return _MISSING
+
+    def _current(self, key: Hashable, version: int, seq: int) -> bool:
+        """Nenhuma invalidação nem descarte da chave desde o início da carga."""
+        with self._lock:
+            return version == self.version and self._discarded.get(key, 0) <= seq
+
+    def _finish(self, key: Hashable, version: int, seq: int, value: Any, error: Optional[BaseException]):
+        """Sob o lock: grava valor/erro se a carga ainda for atual (ver `_current`)."""
+        if not self._current(key, version, seq):
+            return
+        if error is None:
+            self._data[key] = value
+        elif isinstance(error, Exception):
+            self._errors[key] = (error, time.monotonic() + ERROR_BACKOFF_SECONDS)
+
+    def load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        shared = _backend().shared
+        with self._lock:
+            value = self._cached_or_error(key)
+            if value is not _MISSING:
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = _Flight(self.version, self.epoch, self._discard_seq)
+                self._inflight[key] = flight
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = self._shared_get(key, flight.epoch) if shared else _MISSING
+            if value is _MISSING:
+                value = loader()
+                if shared and self._current(key, flight.version, flight.seq):
+                    self._shared_set(key, flight.epoch, value)
+            flight.value = value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._finish(key, flight.version, flight.seq, flight.value, flight.error)
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+            flight.event.set()
+        return flight.value
+
+    async def aload(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        shared = _backend().shared
+        with self._lock:
+            value = self._cached_or_error(key)
+            if value is not _MISSING:
+                return value
+            task = self._tasks.get(key)
+            if task is None or task.done() or task.get_loop() is not loop:
+                self.misses += 1
+                task = loop.create_task(
+                    self._run_async(key, loader, self.version, self.epoch, self._discard_seq, shared)
+                )
+                task.add_done_callback(_consume_exception)
+                self._tasks[key] = task
+            else:
+                self.coalesced += 1
+        # shield: o cancelamento de um chamador não cancela a carga dos demais
+        return await asyncio.shield(task)
+
+    async def _run_async(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        version: int,
+        epoch: int,
+        seq: int,
+        shared: bool,
+    ) -> Any:
+        value, error = None, None
+        try:
+            # O cliente do L2 é síncrono: roda fora do event loop
+            value = await asyncio.to_thread(self._shared_get, key, epoch) if shared else _MISSING
+            if value is _MISSING:
+                value = await loader()
+                if shared and self._current(key, version, seq):
+                    await asyncio.to_thread(self._shared_set, key, epoch, value)
+            return value
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            with self._lock:
+                self._finish(key, version, seq, value, error)
+                if self._tasks.get(key) is asyncio.current_task():
+                    del self._tasks[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "version": self.version,
+                "epoch": self.epoch,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_hits": self.shared_hits,
+                "coalesced": self.coalesced,
+                "errors": len(self._errors),
+            }
+
+
+_namespaces: Dict[str, CacheNamespace] = {
+    name: CacheNamespace(name, maxsize, ttl) for name, (maxsize, ttl) in NAMESPACES.items()
+}
+
+
+def namespace(name: str) -> CacheNamespace:
+    try:
+        return _namespaces[name]
+    except KeyError:
+        raise KeyError(f"Namespace de cache desconhecido: {name}") from None
+
+
+# =============================================================================
+# Integração com o nível compartilhado
+# =============================================================================
+_attached_pid: Optional[int] = None
+_attach_lock = threading.Lock()
+
+
+def _backend():
+    """
+    Backend L2 do processo. Na primeira chamada de cada processo assina o
+    canal de invalidação e sincroniza as épocas com as dos outros workers.
+    """
+    global _attached_pid
+    backend = shared_cache.get_backend()
+    if _attached_pid != os.getpid():
+        with _attach_lock:
+            if _attached_pid != os.getpid():
+                _attached_pid = os.getpid()
+                if backend.shared:
+                    backend.subscribe(_on_message, _resync)
+                    _resync(backend)
+    return backend
+
+
+def _resync(backend=None):
+    backend = backend or shared_cache.get_backend()
+    for name, ns in _namespaces.items():
+        try:
+            ns.apply_epoch(backend.get_int(shared_cache.epoch_key(name)))
+        except Exception as e:
+            print(f"ERRO AO SINCRONIZAR ÉPOCA DO CACHE ({name}): {e}")
+
+
+def _on_message(raw: bytes):
+    try:
+        msg = json.loads(raw)
+    except ValueError:
+        return
+    if msg.get("origin") == _origin():
+        return
+    ns = _namespaces.get(msg.get("ns"))
+    if ns is None:
+        return
+    if msg.get("op") == "bump":
+        ns.apply_epoch(int(msg.get("epoch") or 0))
+    elif msg.get("op") == "discard":
+        ns.discard_digest(str(msg.get("key")))
+
+
+def _publish(backend, **msg):
+    try:
+        backend.publish(json.dumps({**msg, "origin": _origin()}).encode("utf-8"))
+    except Exception as e:
+        print(f"ERRO AO PUBLICAR INVALIDAÇÃO DO CACHE: {e}")
+
+
+def invalidate(*names: str):
+    backend = _backend()
+    for name in names:
+        ns = namespace(name)
+        try:
+            epoch = backend.incr(shared_cache.epoch_key(name))
+        except Exception as e:
+            print(f"ERRO AO INCREMENTAR ÉPOCA DO CACHE ({name}): {e}")
+            epoch = None
+        ns.bump(epoch)
+        if epoch is not None:
+            _publish(backend, op="bump", ns=name, epoch=epoch)
+
+
+def discard(name: str, key: Hashable):
+    """Remove uma única chave do namespace em todos os workers."""
+    backend = _backend()
+    ns = namespace(name)
+    ns.discard(key)
+    digest = _digest(key)
+    if backend.shared:
+        try:
+            backend.delete(shared_cache.value_key(name, ns.epoch, digest))
+        except Exception as e:
+            print(f"ERRO AO REMOVER CHAVE DO CACHE COMPARTILHADO ({name}): {e}")
+    _publish(backend, op="discard", ns=name, key=digest)
+
+
+def invalidate_for_action(action: str):
+    """Invalida os namespaces ligados a uma ação auditada (ver ACTION_NAMESPACES)."""
+    affected = {ns for token, nss in ACTION_NAMESPACES.items() if token in action for ns in nss}
+    invalidate(*sorted(affected))
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {name: ns.stats() for name, ns in _namespaces.items()}
+
+
+def shared_enabled() -> bool:
+    return bool(_backend().shared)
+
+
+def _consume_exception(task: asyncio.Task):
+    # Evita "Task exception was never retrieved" quando todos os chamadores saíram
+    if not task.cancelled():
+        task.exception()
+
+
+def cached(name: str, key: Callable[..., Hashable] = hashkey):
+    """
+    Memoiza uma função (síncrona ou `async def`) no namespace `name`,
+    com single-flight por chave.
+        @cached("campaigns")
+        def get_all_campaigns(): ...
+    """
+    ns = namespace(name)
+
+    def decorator(fn: Callable):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                return await ns.aload(key(*args, **kwargs), lambda: fn(*args, **kwargs))
+
+            wrapper = async_wrapper
+        else:
+            @functools.wraps(fn)
+            def sync_wrapper(*args, **kwargs):
+                return ns.load(key(*args, **kwargs), lambda: fn(*args, **kwargs))
+
+            wrapper = sync_wrapper
+
+        wrapper.cache_namespace = ns
+        wrapper.cache_key = key
+        return wrapper
 
-# Cria um cache que armazena até 128 itens, e cada item expira após 600 segundos (10 minutos)
-cache = TTLCache(maxsize=128, ttl=600)
+    return decorator
@@ -0,0 +1,283 @@
+# app/campaign_batch.py
+"""
+Aplicação de uma campanha a muitas precificações de uma vez.
+
+O fluxo do campaignPricingLogic.js cria o vínculo SKU a SKU, com o preço
+promocional calculado no navegador. Aqui o lote inteiro é resolvido no
+servidor:
+
+  1) uma consulta traz todas as precificações base do filtro (com as
+     campanhas a que já estão vinculadas) e outra, os produtos de todos os
+     SKUs; regras de frete/tarifa e a configuração de cada loja são lidas
+     uma vez por lote;
+  2) uma passada calcula, para cada linha, o preço promocional (desconto,
+     piso/teto), o repasse com frete/tarifa/comissão no novo preço (motor
+     de app/pricing.py), descontados cupom e cashback custeados pelo
+     vendedor, e o lucro/margem resultantes;
+  3) `preview` devolve o lote calculado; `gravar` recalcula e grava as
+     linhas aceitas em precificacoes_campanha num único load job.
+
+Linhas abaixo da `margem_minima`, sem produto/loja, já vinculadas à
+campanha ou em outra campanha de período sobreposto (interval_index.py)
+vêm com `aceito: false` e o `motivo`.
+"""
+from __future__ import annotations
+
+import uuid
+from datetime import date, datetime
+from typing import Any, Dict, List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+from . import interval_index
+from .pricing import calcular_plano, peso_considerado
+
+# Limite de linhas de um lote (uma consulta / um load job)
+MAX_ITENS_LOTE = 10000
+
+
+# =============================================================================
+# Modelos
+# =============================================================================
+class CampanhaLoteFiltros(BaseModel):
+    # Mesmos filtros da lista de precificações
+    sku: str = ""
+    titulo: str = ""
+    categoria: str = ""
+    marketplace: str = ""
+    id_loja: str = ""
+
+
+class CampanhaLotePayload(BaseModel):
+    campanha_id: str = Field(..., min_length=1)
+    plano: Literal["classico", "premium"] = "classico"
+    # Sem desconto informado, vale o desconto_percentual da campanha
+    desconto_percentual: Optional[float] = Field(None, ge=0, lt=100)
+    cupom: float = Field(0.0, ge=0, description="Cupom por venda (R$), custeado pelo vendedor")
+    cashback_percentual: float = Field(0.0, ge=0, lt=100, description="Cashback (% do preço promocional), custeado pelo vendedor")
+    piso_preco: Optional[float] = Field(None, gt=0)
+    teto_preco: Optional[float] = Field(None, gt=0)
+    margem_minima: Optional[float] = None
+    filtros: CampanhaLoteFiltros = Field(default_factory=CampanhaLoteFiltros)
+    # Restringe o lote a essas precificações base
+    ids: Optional[List[str]] = None
+
+
+class CampanhaLoteGravarPayload(CampanhaLotePayload):
+    # Ids aceitos no preview; sem a lista, grava todas as linhas aceitas
+    aceitos: Optional[List[str]] = None
+
+
+# =============================================================================
+# Cálculo
+# =============================================================================
+def _services():
+    from app import services  # type: ignore
+    return services
+
+
+def _num(v: Any) -> float:
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _campanha(services, campanha_id: str) -> Dict[str, Any]:
+    campanha = next((c for c in services.get_all_campaigns() if str(c.get("id")) == campanha_id), None)
+    if campanha is None:
+        raise LookupError("Campanha não encontrada.")
+    fim = campanha.get("data_fim")
+    if isinstance(fim, date) and fim < date.today():
+        raise ValueError("A campanha já foi encerrada.")
+    return campanha
+
+
+def _contexto(services) -> Dict[str, Any]:
+    from .routers.regras import get_rules_payload
+
+    regras = get_rules_payload()
+    return {
+        "regras_tarifa": [r.model_dump() for r in regras.REGRAS_TARIFA_FIXA_ML],
+        "regras_frete": [r.model_dump() for r in regras.REGRAS_FRETE_ML],
+        "lojas": {},
+    }
+
+
+def _loja(services, ctx: Dict[str, Any], marketplace: str, id_loja: str) -> Optional[Dict[str, Any]]:
+    key = (marketplace.lower(), id_loja.lower())
+    if key not in ctx["lojas"]:
+        loja_id = services.get_loja_id_by_marketplace_and_loja(marketplace, id_loja)
+        ctx["lojas"][key] = services.get_store_details(loja_id) if loja_id else None
+    return ctx["lojas"][key]
+
+
+def _preco_promocional(venda: float, desconto: float, payload: CampanhaLotePayload) -> float:
+    preco = round(venda * (1 - desconto / 100), 2)
+    if payload.piso_preco:
+        preco = max(preco, payload.piso_preco)
+    if payload.teto_preco:
+        preco = min(preco, payload.teto_preco)
+    return preco
+
+
+def calcular(payload: CampanhaLotePayload) -> Dict[str, Any]:
+    """
+    Calcula o lote inteiro. Lança LookupError (campanha inexistente) ou
+    ValueError (campanha encerrada, lote grande demais).
+    """
+    services = _services()
+    campanha = _campanha(services, payload.campanha_id)
+    desconto = payload.desconto_percentual
+    if desconto is None:
+        desconto = _num(campanha.get("desconto_percentual"))
+
+    filtros = {**payload.filtros.model_dump(), "plano": payload.plano}
+    rows = services.fetch_pricings_for_campaign(filtros, payload.ids, limit=MAX_ITENS_LOTE + 1)
+    if len(rows) > MAX_ITENS_LOTE:
+        raise ValueError(f"O filtro seleciona mais de {MAX_ITENS_LOTE} precificações; refine a seleção.")
+
+    produtos = services.fetch_products_batch([r["sku"] for r in rows])
+    ctx = _contexto(services)
+    campanhas = interval_index.get()
+    plano = payload.plano
+    items: List[Dict[str, Any]] = []
+    for r in rows:
+        venda = _num(r.get(f"venda_{plano}"))
+        quantidade = int(r.get("quantidade") or 1)
+        custo_total = _num(r.get("custo_total")) or quantidade * _num(r.get("custo_unitario"))
+        lucro_base = _num(r.get(f"lucro_{plano}"))
+        item: Dict[str, Any] = {
+            "precificacao_base_id": r["id"],
+            "marketplace": r.get("marketplace"),
+            "id_loja": r.get("id_loja"),
+            "sku": r.get("sku"),
+            "titulo": r.get("titulo"),
+            "categoria_precificacao": r.get("categoria_precificacao"),
+            "venda_base": round(venda, 2),
+            "lucro_base": round(lucro_base, 2),
+            "margem_base": round(lucro_base / venda * 100, 2) if venda > 0 else 0.0,
+            "aceito": False,
+            "motivo": None,
+        }
+        items.append(item)
+
+        if payload.campanha_id in (r.get("campanhas_vinculadas") or []):
+            item["motivo"] = "Já vinculada à campanha."
+            continue
+        conflitos = campanhas.conflicts(
+            campanha.get("data_inicio"), campanha.get("data_fim"),
+            base_id=r["id"], ignorar_campanha=payload.campanha_id,
+        )
+        if conflitos:
+            nomes = ", ".join(sorted({str(c["nome_campanha"]) for c in conflitos}))
+            item["motivo"] = f"Período sobreposto a outra campanha: {nomes}."
+            continue
+        produto = produtos.get(str(r.get("sku") or "").lower())
+        if not produto:
+            item["motivo"] = "SKU não encontrado no cadastro de produtos."
+            continue
+        loja = _loja(services, ctx, str(r.get("marketplace") or ""), str(r.get("id_loja") or ""))
+        if loja is None:
+            item["motivo"] = f"Loja não cadastrada: {r.get('marketplace')} / {r.get('id_loja')}."
+            continue
+
+        comissoes = (loja.get("comissoes") or []) if isinstance(loja, dict) else []
+        regra = next((c for c in comissoes if c.get("chave") == r.get("regra_comissao")), None)
+        if regra is None and comissoes:
+            regra = comissoes[0]
+        preco = _preco_promocional(venda, desconto, payload)
+        res = calcular_plano(
+            custo_total=custo_total,
+            valor_venda=preco,
+            margem_desejada=None,
+            comissao_perc=_num(regra.get(plano)) if regra else 0.0,
+            aliquota=_num(r.get("aliquota")),
+            parcelamento=_num(r.get("parcelamento")),
+            outros=_num(r.get("outros")),
+            peso_kg=peso_considerado(produto),
+            regras_tarifa=ctx["regras_tarifa"],
+            regras_frete=ctx["regras_frete"],
+        )
+        repasse = res["repasse"] - payload.cupom - preco * (payload.cashback_percentual / 100)
+        lucro = repasse - custo_total
+        margem = lucro / preco * 100 if preco > 0 else 0.0
+        item.update(
+            preco_promocional=preco,
+            frete=res["frete"],
+            tarifa_fixa=res["tarifa_fixa"],
+            repasse=round(repasse, 2),
+            lucro=round(lucro, 2),
+            margem=round(margem, 2),
+            variacao_lucro=round(lucro - lucro_base, 2),
+        )
+        if payload.margem_minima is not None and margem < payload.margem_minima:
+            item["motivo"] = f"Margem abaixo do mínimo ({payload.margem_minima:g}%)."
+        else:
+            item["aceito"] = True
+
+    aceitos = [i for i in items if i["aceito"]]
+    return {
+        "campanha": {"id": payload.campanha_id, "nome": campanha.get("nome"), "desconto_percentual": desconto},
+        "plano": plano,
+        "total_items": len(items),
+        "aceitos": len(aceitos),
+        "rejeitados": len(items) - len(aceitos),
+        "lucro_base_total": round(sum(i["lucro_base"] for i in aceitos), 2),
+        "lucro_campanha_total": round(sum(i["lucro"] for i in aceitos), 2),
+        "items": items,
+    }
+
+
+def preview(payload: CampanhaLotePayload) -> Dict[str, Any]:
+    return calcular(payload)
+
+
+def gravar(payload: CampanhaLoteGravarPayload, user_email: str) -> Dict[str, Any]:
+    """
+    Recalcula o lote (os preços não vêm do cliente) e grava as linhas
+    aceitas — restritas a `aceitos`, se informado — num único load job.
+    """
+    services = _services()
+    lote = calcular(payload)
+    escolhidos = set(payload.aceitos) if payload.aceitos is not None else None
+    linhas = [
+        i for i in lote["items"]
+        if i["aceito"] and (escolhidos is None or i["precificacao_base_id"] in escolhidos)
+    ]
+    agora = datetime.utcnow().isoformat()
+    registros = [
+        {
+            "id": str(uuid.uuid4()),
+            "precificacao_base_id": i["precificacao_base_id"],
+            "campanha_id": payload.campanha_id,
+            "preco_promocional": i["preco_promocional"],
+            "data_criacao": agora,
+            "criado_por": user_email,
+            "plano": payload.plano,
+            "repasse": i["repasse"],
+            "lucro": i["lucro"],
+            "margem": i["margem"],
+        }
+        for i in linhas
+    ]
+    gravadas = services.load_precificacoes_campanha(registros)
+    if gravadas:
+        services.log_action(
+            user_email,
+            "BULK_CREATE_CAMPAIGN_PRICING",
+            details={
+                "campanha_id": payload.campanha_id,
+                "plano": payload.plano,
+                "desconto_percentual": lote["campanha"]["desconto_percentual"],
+                "cupom": payload.cupom,
+                "cashback_percentual": payload.cashback_percentual,
+                "item_count": gravadas,
+            },
+        )
+    return {
+        "campanha": lote["campanha"],
+        "gravadas": gravadas,
+        "ids": [r["id"] for r in registros],
+        "ignoradas": lote["total_items"] - len(registros),
+    }
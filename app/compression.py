@@ -0,0 +1,256 @@
+# app/compression.py
+"""
+Compressão das respostas (brotli/gzip) em middleware ASGI.
+
+- negocia `br` (se o pacote Brotli estiver instalado) ou `gzip` pelo
+  Accept-Encoding do cliente;
+- só comprime tipos textuais (JSON, NDJSON, HTML, CSV...) acima de
+  MIN_SIZE bytes; respostas que já têm Content-Encoding (assets
+  pré-comprimidos, exportação .gz) passam intactas;
+- StreamingResponse é comprimida bloco a bloco, com flush a cada bloco
+  para o cliente continuar recebendo progresso (ex.: NDJSON da importação);
+- blocos grandes são comprimidos em threadpool, fora do event loop;
+- `stats()` acumula bytes, razão e tempo de compressão por encoding.
+
+ETags fortes ganham sufixo por encoding (`"abc-br"`), e o sufixo é
+removido do If-None-Match antes de chegar às camadas internas; o 304 de
+um validador com sufixo volta com o sufixo do encoding negociado.
+"""
+from __future__ import annotations
+
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover - Brotli está no requirements.txt
+    brotli = None
+
+# Respostas menores que isso não compensam a compressão
+MIN_SIZE = 1024
+# Blocos a partir deste tamanho são comprimidos fora do event loop
+OFFLOAD_MIN_BYTES = 32 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+
+_ETAG_SUFFIX = {"br": "-br", "gzip": "-gz"}
+
+
+# =============================================================================
+# Negociação e encoders
+# =============================================================================
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """'br' | 'gzip' | None, respeitando q=0."""
+    accepted: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+class _Encoder:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._c.process(data) if data else b""
+            return out + (self._c.finish() if final else self._c.flush())
+        out = self._c.compress(data)
+        return out + (self._c.flush() if final else self._c.flush(zlib.Z_SYNC_FLUSH))
+
+
+# =============================================================================
+# Estatísticas
+# =============================================================================
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = {}
+
+
+def _record(encoding: str, bytes_in: int, bytes_out: int, seconds: float, streamed: bool):
+    with _stats_lock:
+        s = _stats.setdefault(
+            encoding, {"responses": 0, "streamed": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+        )
+        s["responses"] += 1
+        s["streamed"] += 1 if streamed else 0
+        s["bytes_in"] += bytes_in
+        s["bytes_out"] += bytes_out
+        s["seconds"] += seconds
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    with _stats_lock:
+        out = {}
+        for encoding, s in _stats.items():
+            out[encoding] = {
+                **s,
+                "seconds": round(s["seconds"], 6),
+                "ratio": round(s["bytes_out"] / s["bytes_in"], 4) if s["bytes_in"] else None,
+            }
+        return out
+
+
+# =============================================================================
+# Middleware
+# =============================================================================
+def _strip_etag_suffixes(scope: Scope) -> Scope:
+    headers: List[Tuple[bytes, bytes]] = []
+    changed = False
+    for k, v in scope["headers"]:
+        if k == b"if-none-match":
+            nv = v
+            for suffix in _ETAG_SUFFIX.values():
+                nv = nv.replace(f'{suffix}"'.encode(), b'"')
+            changed = changed or nv != v
+            v = nv
+        headers.append((k, v))
+    return {**scope, "headers": headers} if changed else scope
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stripped = _strip_etag_suffixes(scope)
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None or scope["method"] == "HEAD":
+            await self.app(stripped, receive, send)
+            return
+        # Validador com sufixo = o cliente guardou a versão comprimida: o 304
+        # precisa devolver o mesmo ETag (com sufixo) que o 200 devolveu
+        await _Responder(self.app, encoding, self.minimum_size, send, suffix_304=stripped is not scope)(stripped, receive)
+
+
+class _Responder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int, send: Send, suffix_304: bool = False):
+        self.app = app
+        self.encoding = encoding
+        self.suffix_304 = suffix_304
+        self.minimum_size = minimum_size
+        self.send = send
+        self.start: Optional[Message] = None
+        self.passthrough = False
+        self.encoder: Optional[_Encoder] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    async def __call__(self, scope: Scope, receive: Receive):
+        await self.app(scope, receive, self.send_wrapper)
+
+    def _eligible(self, message: Message) -> bool:
+        if message["status"] < 200 or message["status"] in (204, 206, 304):
+            return False
+        headers = Headers(raw=message.get("headers") or [])
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").lower()
+        return any(content_type.startswith(t) for t in COMPRESSIBLE_TYPES)
+
+    def _rewrite_headers(self, streaming: bool, length: Optional[int] = None):
+        headers = MutableHeaders(scope=self.start)
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if "content-length" in headers:
+            del headers["content-length"]
+        if not streaming and length is not None:
+            headers["Content-Length"] = str(length)
+        self._suffix_etag(headers)
+
+    def _suffix_etag(self, headers: MutableHeaders):
+        etag = headers.get("etag")
+        if etag and etag.endswith('"') and not etag.startswith("W/"):
+            headers["ETag"] = etag[:-1] + _ETAG_SUFFIX[self.encoding] + '"'
+
+    async def _compress(self, data: bytes, final: bool) -> bytes:
+        t0 = time.perf_counter()
+        if len(data) >= OFFLOAD_MIN_BYTES:
+            out = await anyio.to_thread.run_sync(self.encoder.compress, data, final)
+        else:
+            out = self.encoder.compress(data, final)
+        self.seconds += time.perf_counter() - t0
+        self.bytes_in += len(data)
+        self.bytes_out += len(out)
+        return out
+
+    async def send_wrapper(self, message: Message):
+        kind = message["type"]
+        if kind == "http.response.start":
+            self.start = message
+            self.passthrough = not self._eligible(message)
+            if message["status"] == 304 and self.suffix_304:
+                self._suffix_etag(MutableHeaders(scope=message))
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if kind != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+
+        if self.encoder is None:
+            if not more and len(body) < self.minimum_size:
+                # Resposta pequena e completa: segue sem compressão
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.encoder = _Encoder(self.encoding)
+            if not more:
+                out = await self._compress(body, final=True)
+                self._rewrite_headers(streaming=False, length=len(out))
+                await self.send(self.start)
+                await self.send({"type": "http.response.body", "body": out})
+                _record(self.encoding, self.bytes_in, self.bytes_out, self.seconds, streamed=False)
+                return
+            self._rewrite_headers(streaming=True)
+            await self.send(self.start)
+
+        out = await self._compress(body, final=not more)
+        if out or not more:
+            await self.send({"type": "http.response.body", "body": out, "more_body": more})
+        if not more:
+            _record(self.encoding, self.bytes_in, self.bytes_out, self.seconds, streamed=True)
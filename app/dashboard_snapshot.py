@@ -0,0 +1,73 @@
+# app/dashboard_snapshot.py
+"""
+Snapshot dos alertas do dashboard (/alertas), mantido em memória.
+
+Os três blocos — campanhas expirando, custos desatualizados e produtos
+estagnados — são iguais para todos os usuários e custam consultas pesadas
+no BigQuery. Aqui eles são calculados fora do caminho da requisição:
+
+- o snapshot é um conjunto de reference_data.py ("dashboard_alertas"):
+  recalculado em background a cada REFRESH_SECONDS (mesmo sem tráfego) e
+  logo após gravações que o afetam (namespaces "campaigns" e "dashboard");
+- cada bloco é isolado: se a consulta de um falhar, o snapshot mantém o
+  valor anterior daquele bloco e registra o erro em `erros`;
+- `gerado_em` diz quando o snapshot foi calculado.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Intervalo (s) do recálculo agendado
+REFRESH_SECONDS = 600
+CAMPANHAS_DIAS = 7
+ESTAGNADOS_DIAS = 90
+
+_previous: Optional[Dict[str, Any]] = None
+
+
+def _services():
+    from . import services
+    return services
+
+
+def _sections() -> Dict[str, Tuple[Callable[..., List[Dict[str, Any]]], tuple]]:
+    s = _services()
+    return {
+        "campanhas_expirando": (s.get_campaigns_expiring, (CAMPANHAS_DIAS,)),
+        "custos_desatualizados": (s.get_outdated_costs, ()),
+        "produtos_estagnados": (s.get_stagnant_products, (ESTAGNADOS_DIAS,)),
+    }
+
+
+def build() -> Dict[str, Any]:
+    """Calcula um novo snapshot (loader do conjunto "dashboard_alertas")."""
+    global _previous
+    previous = (_previous or {}).get("secoes", {})
+    secoes: Dict[str, List[Dict[str, Any]]] = {}
+    erros: Dict[str, str] = {}
+    for name, (fn, args) in _sections().items():
+        try:
+            secoes[name] = [dict(r) for r in (fn(*args) or [])]
+        except Exception as e:
+            print(f"AVISO: falha ao calcular '{name}' do dashboard: {e}")
+            erros[name] = f"{type(e).__name__}: {e}"
+            secoes[name] = previous.get(name, [])
+    snapshot = {
+        "secoes": secoes,
+        "erros": erros,
+        "gerado_em": datetime.now(timezone.utc).isoformat(),
+    }
+    _previous = snapshot
+    return snapshot
+
+
+def get() -> Dict[str, Any]:
+    from . import reference_data
+    return reference_data.get("dashboard_alertas")
+
+
+async def aget() -> Dict[str, Any]:
+    """`get` para rotas async: a reconstrução (se houver) roda no threadpool."""
+    from . import reference_data
+    return await reference_data.aget("dashboard_alertas")
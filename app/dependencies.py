@@ -1,12 +1,20 @@
 # app/dependencies.py
 from fastapi import Request, Depends, HTTPException, status
 
+from . import user_directory
+
 async def get_current_user(request: Request):
     """
     Lê o usuário da sessão e valida autorização.
     Aceita 'authorized' ou 'autorizado' por compatibilidade.
+    As flags são conferidas no diretório de usuários (memória), então
+    revogações/mudanças de papel feitas pelo admin valem na hora.
     """
     user = request.session.get('user') or {}
+    if user.get('email'):
+        overrides = user_directory.session_overrides(user)
+        if overrides is not None:
+            user = {**user, **overrides}
     autorizado = user.get('authorized')
     if autorizado is None:
         autorizado = user.get('autorizado')
@@ -0,0 +1,135 @@
+# app/export.py
+"""
+Geradores de exportação em streaming (CSV e Parquet).
+
+Os geradores recebem o RowIterator do BigQuery e produzem bytes em blocos:
+a memória fica limitada a uma página do iterador, independente do total de
+linhas exportadas.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import zlib
+from decimal import Decimal
+from typing import Any, Iterable, Iterator, List
+
+# Linhas acumuladas antes de emitir um bloco de CSV
+CSV_FLUSH_ROWS = 1000
+
+
+# =============================================================================
+# CSV
+# =============================================================================
+def _csv_value(v: Any) -> Any:
+    if v is None:
+        return ""
+    if isinstance(v, Decimal):
+        return str(v)
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    return v
+
+
+def iter_csv(columns: List[str], rows: Iterable[Any], gzip: bool = False) -> Iterator[bytes]:
+    """
+    CSV com BOM UTF-8 (o Excel reconhece acentos). Com `gzip=True` o fluxo
+    é comprimido incrementalmente (formato .gz).
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def drain() -> bytes:
+        data = buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+        return compressor.compress(data) if compressor else data
+
+    buf.write("\ufeff")
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow([_csv_value(row.get(c)) for c in columns])
+        pending += 1
+        if pending >= CSV_FLUSH_ROWS:
+            chunk = drain()
+            if chunk:
+                yield chunk
+            pending = 0
+
+    chunk = drain()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+
+# =============================================================================
+# Parquet
+# =============================================================================
+class _ChunkSink(io.RawIOBase):
+    """Destino 'file-like' para o ParquetWriter que é esvaziado a cada lote."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def iter_parquet(row_iterator) -> Iterator[bytes]:
+    """
+    Escreve um row group por lote Arrow vindo do BigQuery
+    (`RowIterator.to_arrow_iterable`) e emite os bytes de cada um.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = None
+    try:
+        for batch in row_iterator.to_arrow_iterable():
+            if writer is None:
+                writer = pq.ParquetWriter(sink, batch.schema, compression="snappy")
+            if batch.num_rows:
+                writer.write_table(pa.Table.from_batches([batch]))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+        if writer is None:
+            # Resultado vazio: gera um arquivo válido só com o schema
+            schema = pa.schema([pa.field(f.name, pa.string()) for f in (row_iterator.schema or [])])
+            writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    finally:
+        if writer is not None:
+            writer.close()
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
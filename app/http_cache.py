@@ -0,0 +1,110 @@
+# app/http_cache.py
+"""
+Respostas condicionais (ETag / If-None-Match) para os endpoints de dados de
+referência.
+
+O ETag vem do hash de conteúdo do conjunto em reference_data, então é
+calculado sem executar a rota. Com `If-None-Match` igual e usuário
+autorizado na sessão, a resposta é um 304 sem corpo; caso contrário a rota
+roda normalmente e recebe `ETag` + `Cache-Control`. Conjunto desatualizado
+por uma gravação (ou ainda não carregado) não tem ETag: a requisição segue
+para a rota, que recarrega, e o ETag do 200 é lido depois dela.
+
+Precisa rodar dentro do SessionMiddleware (ver main.py): o 304 só é dado a
+quem passaria pela autenticação da rota.
+"""
+from __future__ import annotations
+
+from typing import Callable, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import reference_data
+
+# Cliente guarda, mas sempre revalida (dados dependem da sessão)
+CACHE_CONTROL = "private, no-cache"
+
+# prefixo do path -> conjunto de reference_data que define a versão
+RESOURCES: Tuple[Tuple[str, str], ...] = (
+    ("/api/regras-negocio", "regras"),
+    ("/api/config/lojas", "lojas"),
+    ("/api/precificacao/categorias-precificacao", "categorias"),
+    ("/api/campanhas/ativas", "campanhas_ativas"),
+)
+
+
+def _dataset_for(path: str) -> Optional[str]:
+    path = path.rstrip("/") or "/"
+    for prefix, name in RESOURCES:
+        if path == prefix or (name == "regras" and path.startswith(prefix + "/")):
+            return name
+    return None
+
+
+def _etag_for(path: str) -> Optional[str]:
+    name = _dataset_for(path)
+    if not name:
+        return None
+    token = reference_data.etag(name)
+    if not token:
+        return None
+    return f'"{token}"'
+
+
+def parse_if_none_match(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    return [v.strip().removeprefix("W/") for v in value.split(",") if v.strip()]
+
+
+def _authorized(scope: Scope) -> bool:
+    user = (scope.get("session") or {}).get("user") or {}
+    autorizado = user.get("authorized")
+    if autorizado is None:
+        autorizado = user.get("autorizado")
+    return bool(autorizado)
+
+
+class ConditionalCacheMiddleware:
+    def __init__(self, app: ASGIApp, etag_for: Callable[[str], Optional[str]] = _etag_for):
+        self.app = app
+        self.etag_for = etag_for
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if _dataset_for(path) is None:
+            await self.app(scope, receive, send)
+            return
+
+        etag = self.etag_for(path)
+        candidates = parse_if_none_match(Headers(scope=scope).get("if-none-match"))
+        if etag is not None and (etag in candidates or "*" in candidates) and _authorized(scope):
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": [
+                        (b"etag", etag.encode("latin-1")),
+                        (b"cache-control", CACHE_CONTROL.encode("latin-1")),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_etag(message: Message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                # Depois da rota: o conjunto já foi (re)carregado por ela
+                current = self.etag_for(path)
+                if current is not None:
+                    headers = MutableHeaders(scope=message)
+                    headers.setdefault("etag", current)
+                    headers.setdefault("cache-control", CACHE_CONTROL)
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
@@ -0,0 +1,61 @@
+# app/http_client.py
+"""
+Cliente HTTP de saída compartilhado (OAuth do Google e integrações futuras).
+
+Um único `httpx.AsyncClient` por processo, aberto no lifespan da aplicação:
+conexões ficam vivas entre requisições (keep-alive) e, com o pacote `h2`
+instalado, usam HTTP/2 — o login deixa de pagar TCP + TLS a cada chamada.
+
+Use `get_client()` em vez de `async with httpx.AsyncClient()`.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+import httpx
+
+try:
+    import h2  # type: ignore  # noqa: F401
+    HTTP2 = True
+except ImportError:  # pragma: no cover - h2 está no requirements.txt
+    HTTP2 = False
+
+TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=10, keepalive_expiry=60.0)
+
+_client: Optional[httpx.AsyncClient] = None
+_lock = threading.Lock()
+
+
+def _create() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=TIMEOUT,
+        limits=LIMITS,
+        http2=HTTP2,
+        headers={"User-Agent": "ferramenta-precificacao"},
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """Cliente compartilhado (criado sob demanda se o lifespan não rodou)."""
+    global _client
+    client = _client
+    if client is None or client.is_closed:
+        with _lock:
+            if _client is None or _client.is_closed:
+                _client = _create()
+            client = _client
+    return client
+
+
+def start():
+    get_client()
+
+
+async def aclose():
+    global _client
+    with _lock:
+        client, _client = _client, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
@@ -0,0 +1,389 @@
+# app/incremental.py
+"""
+Índices em memória mantidos por carga incremental (marca d'água).
+
+Em vez de reagregar tabelas inteiras do BigQuery a cada consulta, cada
+índice guarda um mapa por SKU e, a cada atualização, busca só as linhas
+novas desde a última marca d'água (`watermark`), com uma pequena janela de
+sobreposição para pegar linhas que chegam atrasadas — a mesclagem é
+idempotente, então reler alguns dias não causa problema.
+
+- `LastSaleIndex`: SKU -> data da última venda (relatorio_vendas). A
+  primeira carga do processo agrega a base toda; as seguintes, só os
+  pedidos desde a marca d'água;
+- `ProductIndex`: cadastro enxuto dos produtos (titulo, status,
+  data_cadastro, valor_de_custo). Se a tabela tiver coluna de data de
+  atualização, a carga é incremental por ela; senão, recarrega por inteiro
+  a cada PRODUCTS_REFRESH_SECONDS. Em ambos os casos registra quando o
+  custo de cada SKU mudou;
+- `LatestPricingIndex`: SKU -> precificação mais recente, incremental por
+  `data_calculo`. Gravações deste processo e dos demais workers chegam pelo
+  namespace "dashboard"; exclusões locais são aplicadas por `forget`, e a
+  recarga completa periódica reconcilia as de outros workers.
+
+`stagnant_products(dias)` vira um filtro barato sobre os índices de venda e
+produtos, para qualquer limiar (30/60/90/180 dias), sem reler o histórico
+de vendas; `cost_drift()` cruza produtos e precificações e devolve a lista
+completa (paginada) de custos desatualizados com o impacto na margem.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import cache
+
+# Idade (s) a partir da qual a próxima leitura busca as vendas novas
+REFRESH_SECONDS = 300
+PRODUCTS_REFRESH_SECONDS = 3600
+# Dias relidos antes da marca d'água (pedidos lançados com atraso)
+LOOKBACK_DAYS = 3
+# Sobreposição das cargas por data de atualização/cálculo (gravações em voo)
+LOOKBACK_MINUTES = 10
+# Recarga completa dos índices incrementais que não veem exclusões
+FULL_RELOAD_SECONDS = 6 * 3600
+# Diferença mínima (R$) para considerar o custo desatualizado
+DRIFT_TOLERANCE = 0.005
+
+
+def _services():
+    from . import services
+    return services
+
+
+def _as_date(value: Any) -> Optional[date]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+# =============================================================================
+# Base
+# =============================================================================
+class WatermarkIndex(ABC):
+    """Mapa chave -> valor atualizado por cargas incrementais."""
+
+    name = "index"
+    refresh_seconds = REFRESH_SECONDS
+    # False: cada atualização recarrega e substitui o mapa inteiro
+    incremental = True
+    # Recarga completa periódica (None: só a primeira carga é completa)
+    full_reload_seconds: Optional[float] = None
+    # Namespace do cache cuja nova versão vence o índice (gravações)
+    namespace: Optional[str] = None
+
+    def __init__(self):
+        self.entries: Dict[str, Any] = {}
+        self.watermark: Any = None
+        self.loaded = False
+        self.version = -1
+        self.loaded_at: Optional[float] = None
+        self.full_loaded_at: Optional[float] = None
+        self.loaded_at_utc: Optional[datetime] = None
+        self.full_loads = 0
+        self.incremental_loads = 0
+        self.last_rows = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    # ---- a implementar ----
+    @abstractmethod
+    def fetch(self, watermark: Any) -> Iterable[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def merge(self, entries: Dict[str, Any], row: Dict[str, Any]) -> Any:
+        """Aplica uma linha ao mapa; devolve o valor de marca d'água da linha (ou None)."""
+
+    # ---- carga ----
+    def _namespace_version(self) -> int:
+        return cache.namespace(self.namespace).version if self.namespace else -1
+
+    def _expired(self) -> bool:
+        if self.namespace and self.version != self._namespace_version():
+            return True
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= self.refresh_seconds
+
+    def _needs_full(self) -> bool:
+        if not (self.incremental and self.loaded) or self.watermark is None:
+            return True
+        return (
+            self.full_reload_seconds is not None
+            and time.monotonic() - self.full_loaded_at >= self.full_reload_seconds
+        )
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            if not force and self.loaded and not self._expired():
+                return
+            full = self._needs_full()
+            watermark = None if full else self.watermark
+            version = self._namespace_version()
+            try:
+                rows = list(self.fetch(watermark))
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            # Cópia: leitores em outras threads continuam com o mapa anterior
+            entries: Dict[str, Any] = {} if full else dict(self.entries)
+            new_mark = watermark
+            for row in rows:
+                mark = self.merge(entries, row)
+                if mark is not None and (new_mark is None or mark > new_mark):
+                    new_mark = mark
+            self.entries = entries
+            self.watermark = new_mark
+            self.loaded = True
+            self.version = version
+            self.loaded_at = time.monotonic()
+            self.loaded_at_utc = datetime.now(timezone.utc)
+            self.last_rows = len(rows)
+            self.last_error = None
+            if full:
+                self.full_loaded_at = self.loaded_at
+                self.full_loads += 1
+            else:
+                self.incremental_loads += 1
+
+    def ensure_fresh(self) -> Dict[str, Any]:
+        """Mapa atual; busca as novidades se a última carga venceu."""
+        try:
+            self.refresh()
+        except Exception as e:
+            if not self.loaded:
+                raise
+            print(f"AVISO: falha ao atualizar o índice {self.name}; usando a última carga. Erro: {e}")
+        return self.entries
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "loaded": self.loaded,
+            "entries": len(self.entries),
+            "watermark": self.watermark.isoformat() if hasattr(self.watermark, "isoformat") else self.watermark,
+            "age_seconds": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at else None,
+            "loaded_at": self.loaded_at_utc.isoformat() if self.loaded_at_utc else None,
+            "full_loads": self.full_loads,
+            "incremental_loads": self.incremental_loads,
+            "last_rows": self.last_rows,
+            "last_error": self.last_error,
+        }
+
+
+# =============================================================================
+# Índices
+# =============================================================================
+class LastSaleIndex(WatermarkIndex):
+    name = "ultima_venda"
+
+    def fetch(self, watermark: Optional[date]) -> Iterable[Dict[str, Any]]:
+        desde = watermark - timedelta(days=LOOKBACK_DAYS) if watermark else None
+        return _services().fetch_last_sales(desde)
+
+    def merge(self, entries: Dict[str, Any], row: Dict[str, Any]) -> Optional[date]:
+        sku = str(row.get("sku") or "").strip()
+        venda = _as_date(row.get("ultima_venda"))
+        if not sku or venda is None:
+            return None
+        current = entries.get(sku)
+        if current is None or venda > current:
+            entries[sku] = venda
+        return venda
+
+
+class ProductIndex(WatermarkIndex):
+    """
+    Incremental quando fetch_products_for_index traz `atualizado_em` (coluna
+    de atualização da tabela); sem ela não há marca d'água e cada carga é
+    completa, a cada PRODUCTS_REFRESH_SECONDS.
+    """
+
+    name = "produtos"
+    full_reload_seconds = FULL_RELOAD_SECONDS
+
+    def __init__(self):
+        super().__init__()
+        self.cost_changes = 0
+
+    def _expired(self) -> bool:
+        if self.watermark is None and self.loaded_at is not None:
+            return time.monotonic() - self.loaded_at >= PRODUCTS_REFRESH_SECONDS
+        return super()._expired()
+
+    def fetch(self, watermark: Optional[datetime]) -> Iterable[Dict[str, Any]]:
+        desde = watermark - timedelta(minutes=LOOKBACK_MINUTES) if watermark else None
+        return _services().fetch_products_for_index(desde)
+
+    def merge(self, entries: Dict[str, Any], row: Dict[str, Any]) -> Optional[datetime]:
+        sku = str(row.get("sku") or "").strip()
+        if not sku:
+            return None
+        atualizado_em = row.get("atualizado_em")
+        custo = row.get("valor_de_custo")
+        custo = float(custo) if custo is not None else None
+        # Mapa anterior (numa carga completa `entries` começa vazio)
+        anterior = self.entries.get(sku)
+        if anterior is None:
+            custo_alterado_em = atualizado_em
+        elif anterior["custo"] != custo:
+            custo_alterado_em = atualizado_em or datetime.now(timezone.utc)
+            self.cost_changes += 1
+        else:
+            custo_alterado_em = anterior["custo_alterado_em"]
+        entries[sku] = {
+            "titulo": row.get("titulo"),
+            # Sem a coluna status, todos contam como ativos
+            "ativo": row.get("status", "ATIVO") == "ATIVO",
+            "data_cadastro": _as_date(row.get("data_cadastro")),
+            "custo": custo,
+            "custo_alterado_em": custo_alterado_em,
+        }
+        return atualizado_em
+
+    def status(self) -> Dict[str, Any]:
+        return {**super().status(), "cost_changes": self.cost_changes}
+
+
+class LatestPricingIndex(WatermarkIndex):
+    name = "ultima_precificacao"
+    namespace = "dashboard"
+    full_reload_seconds = FULL_RELOAD_SECONDS
+
+    def fetch(self, watermark: Optional[datetime]) -> Iterable[Dict[str, Any]]:
+        desde = watermark - timedelta(minutes=LOOKBACK_MINUTES) if watermark else None
+        return _services().fetch_latest_pricings(desde=desde)
+
+    def merge(self, entries: Dict[str, Any], row: Dict[str, Any]) -> Optional[datetime]:
+        sku = str(row.get("sku") or "").strip()
+        calculo = row.get("data_calculo")
+        if not sku or calculo is None:
+            return None
+        current = entries.get(sku)
+        if current is None or calculo >= current["data_calculo"]:
+            entries[sku] = dict(row)
+        return calculo
+
+    def forget(self, ids: Iterable[str]):
+        """
+        Tira do índice precificações excluídas por este processo; o SKU volta
+        a apontar para a precificação anterior (se houver).
+        """
+        ids = {str(i) for i in ids if i}
+        with self._lock:
+            skus = [sku for sku, e in self.entries.items() if str(e.get("id")) in ids]
+            if not skus:
+                return
+            entries = dict(self.entries)
+            for sku in skus:
+                entries.pop(sku, None)
+            try:
+                for row in _services().fetch_latest_pricings(skus=skus):
+                    self.merge(entries, row)
+            except Exception as e:
+                print(f"AVISO: falha ao recompor o índice {self.name}; a próxima leitura recarrega tudo. Erro: {e}")
+                self.watermark = None
+            self.entries = entries
+
+
+last_sales = LastSaleIndex()
+products = ProductIndex()
+latest_pricings = LatestPricingIndex()
+
+
+def stagnant_products(dias: int = 90, limit: Optional[int] = 50) -> List[Dict[str, Any]]:
+    """
+    Produtos ativos cuja última venda (ou, sem vendas, o cadastro) tem `dias`
+    dias ou mais, do mais parado para o menos parado.
+    """
+    vendas = last_sales.ensure_fresh()
+    catalogo = products.ensure_fresh()
+    hoje = date.today()
+    out: List[Dict[str, Any]] = []
+    for sku, p in catalogo.items():
+        if not p["ativo"]:
+            continue
+        ultima = vendas.get(sku) or p["data_cadastro"]
+        if ultima is None:
+            continue
+        parado = (hoje - ultima).days
+        if parado >= dias:
+            out.append({
+                "sku": sku,
+                "titulo": p["titulo"],
+                "ultima_venda": vendas.get(sku),
+                "dias_sem_vender": parado,
+            })
+    out.sort(key=lambda r: r["dias_sem_vender"], reverse=True)
+    return out[:limit] if limit else out
+
+
+def _margem(lucro: float, venda: float) -> Optional[float]:
+    return round(lucro / venda * 100, 2) if venda > 0 else None
+
+
+def cost_drift(page: int = 1, page_size: Optional[int] = 50) -> Dict[str, Any]:
+    """
+    SKUs cuja precificação mais recente usa um custo unitário diferente do
+    `valor_de_custo` atual do cadastro, com o efeito do custo novo no lucro
+    e na margem de cada plano. Ordenado pelo maior impacto no lucro.
+    Resposta: {"total_items": n, "items": [...]} (página `page`).
+    """
+    catalogo = products.ensure_fresh()
+    precificacoes = latest_pricings.ensure_fresh()
+    agora = datetime.now(timezone.utc)
+    out: List[Dict[str, Any]] = []
+    for sku, p in precificacoes.items():
+        produto = catalogo.get(sku)
+        if produto is None or produto["custo"] is None:
+            continue
+        custo_atual = float(p.get("custo_unitario") or 0)
+        diferenca = produto["custo"] - custo_atual
+        if abs(diferenca) < DRIFT_TOLERANCE:
+            continue
+        quantidade = int(p.get("quantidade") or 1)
+        impacto = -diferenca * quantidade
+        alterado_em = produto["custo_alterado_em"]
+        if isinstance(alterado_em, datetime) and alterado_em.tzinfo is None:
+            alterado_em = alterado_em.replace(tzinfo=timezone.utc)
+        item = {
+            "id_precificacao": p.get("id"),
+            "sku": sku,
+            "titulo": p.get("titulo") or produto["titulo"],
+            "marketplace": p.get("marketplace"),
+            "id_loja": p.get("id_loja"),
+            "data_calculo": p.get("data_calculo"),
+            "quantidade": quantidade,
+            "custo_unitario_atual": round(custo_atual, 2),
+            "custo_update": round(produto["custo"], 2),
+            "diferenca": round(diferenca, 2),
+            "variacao_pct": round(diferenca / custo_atual * 100, 2) if custo_atual else None,
+            "custo_alterado_em": alterado_em,
+            "dias_desde_atualizacao": (agora - alterado_em).days if isinstance(alterado_em, datetime) else None,
+            "impacto_lucro": round(impacto, 2),
+        }
+        for plano in ("classico", "premium"):
+            venda = float(p.get(f"venda_{plano}") or 0)
+            lucro = float(p.get(f"lucro_{plano}") or 0)
+            item[f"lucro_{plano}"] = round(lucro, 2)
+            item[f"lucro_{plano}_novo"] = round(lucro + impacto, 2)
+            item[f"margem_{plano}"] = _margem(lucro, venda)
+            item[f"margem_{plano}_nova"] = _margem(lucro + impacto, venda)
+        out.append(item)
+    out.sort(key=lambda r: (abs(r["impacto_lucro"]), r["sku"]), reverse=True)
+    if page_size:
+        inicio = (max(page, 1) - 1) * page_size
+        return {"total_items": len(out), "items": out[inicio:inicio + page_size]}
+    return {"total_items": len(out), "items": out}
+
+
+def status() -> Dict[str, Dict[str, Any]]:
+    return {idx.name: idx.status() for idx in (last_sales, products, latest_pricings)}
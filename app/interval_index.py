@@ -0,0 +1,371 @@
+# app/interval_index.py
+"""
+Índice de intervalos das campanhas e dos vínculos campanha × precificação.
+
+`get_active_campaigns` e o alerta de campanhas expirando eram consultas que
+varriam `campanhas_ml` filtrando `data_fim`, e nada impedia uma
+precificação base de entrar em duas campanhas com datas sobrepostas. Aqui
+as datas ficam em árvores de intervalos em memória:
+
+- `IntervalTree`: árvore centrada, imutável. "ativos na data D" e
+  "sobrepostos a [a, b]" custam O(log n + k);
+- `CampaignIndex`: uma árvore para as campanhas e uma por precificação
+  base e por SKU para os vínculos (precificacoes_campanha). O período de um
+  vínculo é o dele próprio (colunas inicio/fim, se existirem) ou o da
+  campanha;
+- o índice é recarregado na hora quando o namespace "campaigns" muda
+  (gravações neste ou em outro worker) e, fora isso, em background a cada
+  INDEX_TTL_SECONDS.
+
+`campaign_update_conflicts` valida um conjunto novo de campanhas (save do
+admin): aponta as precificações que ficariam com campanhas sobrepostas.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
+
+from . import cache
+
+# Idade (s) a partir da qual o índice é recarregado em background
+INDEX_TTL_SECONDS = 300
+
+T = TypeVar("T")
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="interval-index")
+
+
+def _services():
+    from . import services
+    return services
+
+
+def as_date(value: Any) -> Optional[date]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def _bounds(inicio: Any, fim: Any) -> Tuple[date, date]:
+    """Período fechado [inicio, fim]; sem início/fim, aberto naquele lado."""
+    return as_date(inicio) or date.min, as_date(fim) or date.max
+
+
+# =============================================================================
+# Árvore de intervalos
+# =============================================================================
+class _Node:
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+
+class IntervalTree(Generic[T]):
+    """
+    Intervalos fechados [inicio, fim] com um valor associado.
+    `at(p)`: todos que contêm p; `overlapping(a, b)`: todos que cruzam [a, b].
+    """
+
+    def __init__(self, items: Iterable[Tuple[Any, Any, T]]):
+        intervals = sorted((iv for iv in items if iv[0] <= iv[1]), key=lambda iv: (iv[0], iv[1]))
+        self._size = len(intervals)
+        self._starts = [iv[0] for iv in intervals]
+        self._by_start = intervals
+        self._root = self._build(intervals)
+
+    @staticmethod
+    def _build(intervals: List[Tuple[Any, Any, T]]) -> Optional[_Node]:
+        if not intervals:
+            return None
+        node = _Node()
+        # Início mediano: no máximo metade dos intervalos vai para cada lado
+        node.center = intervals[len(intervals) // 2][0]
+        left, here, right = [], [], []
+        for iv in intervals:
+            if iv[1] < node.center:
+                left.append(iv)
+            elif iv[0] > node.center:
+                right.append(iv)
+            else:
+                here.append(iv)
+        node.by_start = here
+        node.by_end = sorted(here, key=lambda iv: iv[1], reverse=True)
+        node.left = IntervalTree._build(left)
+        node.right = IntervalTree._build(right)
+        return node
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _stab(self, point: Any) -> List[Tuple[Any, Any, T]]:
+        out: List[Tuple[Any, Any, T]] = []
+        node = self._root
+        while node is not None:
+            if point < node.center:
+                for iv in node.by_start:
+                    if iv[0] > point:
+                        break
+                    out.append(iv)
+                node = node.left
+            elif point > node.center:
+                for iv in node.by_end:
+                    if iv[1] < point:
+                        break
+                    out.append(iv)
+                node = node.right
+            else:
+                out.extend(node.by_start)
+                break
+        return out
+
+    def at(self, point: Any) -> List[T]:
+        return [iv[2] for iv in self._stab(point)]
+
+    def overlapping(self, start: Any, end: Any) -> List[T]:
+        if end < start:
+            return []
+        # Contêm `start` + começam dentro de (start, end]: conjuntos disjuntos
+        out = [iv[2] for iv in self._stab(start)]
+        lo, hi = bisect_right(self._starts, start), bisect_right(self._starts, end)
+        out.extend(iv[2] for iv in self._by_start[lo:hi])
+        return out
+
+
+# =============================================================================
+# Campanhas e vínculos
+# =============================================================================
+class CampaignIndex:
+    def __init__(self, campanhas: List[Dict[str, Any]], vinculos: List[Dict[str, Any]]):
+        self.linhas_vinculos = vinculos
+        self.campanhas: Dict[str, Dict[str, Any]] = {str(c["id"]): c for c in campanhas if c.get("id")}
+        self.tree = IntervalTree(
+            (*_bounds(c.get("data_inicio"), c.get("data_fim")), c) for c in self.campanhas.values()
+        )
+        # Campanhas por data de fim (expirando em [hoje, hoje + dias])
+        finais = sorted(
+            ((as_date(c.get("data_fim")), c) for c in self.campanhas.values() if as_date(c.get("data_fim"))),
+            key=lambda fc: fc[0],
+        )
+        self._fins = [f for f, _ in finais]
+        self._por_fim = [c for _, c in finais]
+
+        self.vinculos: List[Dict[str, Any]] = []
+        por_base: Dict[str, list] = {}
+        por_sku: Dict[str, list] = {}
+        for v in vinculos:
+            campanha = self.campanhas.get(str(v.get("campanha_id")))
+            if campanha is None:
+                continue  # vínculo de campanha excluída
+            inicio, fim = _bounds(
+                v.get("inicio") or campanha.get("data_inicio"), v.get("fim") or campanha.get("data_fim")
+            )
+            entry = {
+                "id": v.get("id"),
+                "precificacao_base_id": v.get("precificacao_base_id"),
+                "sku": v.get("sku"),
+                "campanha_id": str(v.get("campanha_id")),
+                "nome_campanha": campanha.get("nome"),
+                "inicio": inicio,
+                "fim": fim,
+            }
+            self.vinculos.append(entry)
+            item = (inicio, fim, entry)
+            por_base.setdefault(str(entry["precificacao_base_id"]), []).append(item)
+            if entry["sku"]:
+                por_sku.setdefault(str(entry["sku"]).lower(), []).append(item)
+        self.por_base = {k: IntervalTree(v) for k, v in por_base.items()}
+        self.por_sku = {k: IntervalTree(v) for k, v in por_sku.items()}
+
+    @staticmethod
+    def _by_name(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return sorted(rows, key=lambda c: str(c.get("nome") or ""))
+
+    def active_at(self, dia: date) -> List[Dict[str, Any]]:
+        return self._by_name(self.tree.at(dia))
+
+    def overlapping(self, inicio: Any, fim: Any) -> List[Dict[str, Any]]:
+        return self._by_name(self.tree.overlapping(*_bounds(inicio, fim)))
+
+    def current(self, hoje: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Campanhas não encerradas (em andamento ou futuras)."""
+        return self.overlapping(hoje or date.today(), None)
+
+    def expiring(self, dias: int, hoje: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Campanhas com data_fim em [hoje, hoje + dias], da que termina antes para a depois."""
+        hoje = hoje or date.today()
+        lo, hi = bisect_left(self._fins, hoje), bisect_right(self._fins, hoje + timedelta(days=dias))
+        return self._por_fim[lo:hi]
+
+    def conflicts(
+        self,
+        inicio: Any,
+        fim: Any,
+        *,
+        base_id: Optional[str] = None,
+        sku: Optional[str] = None,
+        ignorar_campanha: Optional[str] = None,
+        ignorar_vinculo: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Vínculos da precificação base (ou do SKU) cujo período cruza [inicio, fim]."""
+        if base_id is not None:
+            tree = self.por_base.get(str(base_id))
+        else:
+            tree = self.por_sku.get(str(sku or "").lower())
+        if tree is None:
+            return []
+        return [
+            v for v in tree.overlapping(*_bounds(inicio, fim))
+            if v["campanha_id"] != ignorar_campanha and (ignorar_vinculo is None or v["id"] != ignorar_vinculo)
+        ]
+
+
+def campaign_update_conflicts(index: CampaignIndex, novas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Sobreposições que um novo conjunto de campanhas criaria: para cada
+    campanha nova ou com datas alteradas, os vínculos dela que cruzam outro
+    vínculo da mesma precificação base (já com as datas novas).
+    """
+    alteradas = set()
+    for c in novas:
+        cid = str(c.get("id") or "")
+        atual = index.campanhas.get(cid)
+        if atual is None or _bounds(atual.get("data_inicio"), atual.get("data_fim")) != _bounds(
+            c.get("data_inicio"), c.get("data_fim")
+        ):
+            alteradas.add(cid)
+    if not alteradas:
+        return []
+
+    proposto = CampaignIndex(novas, index.linhas_vinculos)
+    out: List[Dict[str, Any]] = []
+    vistos = set()
+    for v in proposto.vinculos:
+        if v["campanha_id"] not in alteradas:
+            continue
+        for outro in proposto.conflicts(
+            v["inicio"], v["fim"], base_id=v["precificacao_base_id"], ignorar_campanha=v["campanha_id"]
+        ):
+            par = (v["precificacao_base_id"], *sorted((v["campanha_id"], outro["campanha_id"])))
+            if par in vistos:
+                continue
+            vistos.add(par)
+            out.append({
+                "precificacao_base_id": v["precificacao_base_id"],
+                "sku": v["sku"],
+                "campanha": v["nome_campanha"],
+                "conflita_com": outro["nome_campanha"],
+                "campanha_id": v["campanha_id"],
+                "conflita_com_id": outro["campanha_id"],
+            })
+    return out
+
+
+# =============================================================================
+# Carga (por versão do namespace "campaigns")
+# =============================================================================
+class _Holder:
+    def __init__(self):
+        self.index: Optional[CampaignIndex] = None
+        self.version = -1
+        self.loaded_at = 0.0
+        self.refreshing = False
+        self.failed_at: Optional[float] = None
+        self.loads = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _namespace_version(self) -> int:
+        return cache.namespace("campaigns").version
+
+    def _expired(self) -> bool:
+        return time.monotonic() - self.loaded_at >= INDEX_TTL_SECONDS
+
+    def load(self):
+        with self._load_lock:
+            version = self._namespace_version()
+            if self.index is not None and version == self.version and not self._expired():
+                return
+            services = _services()
+            if self.index is not None and version == self.version:
+                # Recarga por idade: não reaproveita a lista memoizada
+                fn = services.get_all_campaigns
+                fn.cache_namespace.discard(fn.cache_key())
+            try:
+                campanhas = [dict(c) for c in services.get_all_campaigns() or []]
+                vinculos = services.fetch_campaign_links()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            index = CampaignIndex(campanhas, vinculos)
+            with self._lock:
+                self.index = index
+                self.version = version
+                self.loaded_at = time.monotonic()
+                self.loads += 1
+                self.last_error = None
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                print(f"ERRO AO ATUALIZAR O ÍNDICE DE CAMPANHAS: {e}")
+            finally:
+                with self._lock:
+                    self.refreshing = False
+
+        _executor.submit(run)
+
+    def get(self) -> CampaignIndex:
+        if self.index is None or self.version != self._namespace_version():
+            # Nunca carregado, ou houve gravação de campanhas: recarrega já
+            backoff = self.failed_at is not None and time.monotonic() - self.failed_at < cache.ERROR_BACKOFF_SECONDS
+            if not backoff:
+                try:
+                    self.load()
+                    self.failed_at = None
+                except Exception as e:
+                    self.failed_at = time.monotonic()
+                    if self.index is None:
+                        raise
+                    print(f"AVISO: falha ao recarregar o índice de campanhas; usando o anterior. Erro: {e}")
+            elif self.index is None:
+                raise RuntimeError(f"Índice de campanhas indisponível: {self.last_error}")
+        elif self._expired():
+            self._refresh_in_background()
+        return self.index
+
+
+_holder = _Holder()
+
+
+def get() -> CampaignIndex:
+    return _holder.get()
+
+
+def status() -> Dict[str, Any]:
+    h = _holder
+    idx = h.index
+    return {
+        "loaded": idx is not None,
+        "campanhas": len(idx.campanhas) if idx else 0,
+        "vinculos": len(idx.vinculos) if idx else 0,
+        "age_seconds": round(time.monotonic() - h.loaded_at, 1) if idx else None,
+        "loads": h.loads,
+        "refreshing": h.refreshing,
+        "last_error": h.last_error,
+    }
@@ -1,10 +1,9 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
-from fastapi.responses import FileResponse, RedirectResponse, HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
 from fastapi.exception_handlers import http_exception_handler
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.sessions import SessionMiddleware
 from pathlib import Path
+from contextlib import asynccontextmanager
 import os
 from functools import lru_cache
 
@@ -25,12 +24,45 @@ from .dependencies import (
     get_current_admin_user,
     get_historico_viewer_user,
 )
+from .serialization import FastJSONResponse
+from .http_cache import ConditionalCacheMiddleware
+from .compression import CompressionMiddleware
+from .assets import AssetStaticFiles
+from .sessions import ServerSessionMiddleware
+from .metrics import MetricsMiddleware
+from . import assets, http_client, metrics, oidc, reference_data, scheduler, user_directory
+
+# ==== Ciclo de vida ====
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build dos assets (minificação/hash/compressão) antes da primeira página
+    assets.manifest()
+    # Preload + revalidação em background dos dados de referência
+    reference_data.start()
+    # Diretório de usuários carregado antes das primeiras requisições autenticadas
+    user_directory.warm()
+    # Cliente HTTP de saída (keep-alive) + chaves do OAuth já em cache
+    http_client.start()
+    if auth.CLIENT_ID:
+        oidc.start()
+    # Jobs periódicos (virada de campanhas, índices, cubo de lucro)
+    scheduler.start()
+    # Medição do atraso do event loop (GET /api/admin/metrics)
+    metrics.start()
+    yield
+    metrics.stop()
+    oidc.stop()
+    scheduler.stop()
+    reference_data.stop()
+    await http_client.aclose()
 
 # ==== App ====
 app = FastAPI(
     title="Ferramenta de Precificação",
     description="API para a ferramenta de precificação de produtos.",
     version="1.0.0",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan,
 )
 
 # ==== Paths do projeto ====
@@ -38,10 +70,13 @@ BASE_DIR = Path(__file__).resolve().parent      # /app/app
 PROJECT_ROOT = BASE_DIR.parent                  # /app
 STATIC_DIR = PROJECT_ROOT / "static"            # /app/static
 
-# ==== Sessão ====
+# ==== ETag/304 dos dados de referência (adicionado antes = roda dentro da sessão) ====
+app.add_middleware(ConditionalCacheMiddleware)
+
+# ==== Sessão (no servidor; o cookie leva só o ID — ver sessions.py) ====
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-only-insecure-key")
 app.add_middleware(
-    SessionMiddleware,
+    ServerSessionMiddleware,
     secret_key=SECRET_KEY,
     same_site="lax",
     https_only=bool(os.environ.get("SESSIONS_HTTPS_ONLY", "")),
@@ -57,8 +92,14 @@ app.add_middleware(
     allow_credentials=True,
 )
 
+# ==== Compressão br/gzip (adicionado por último = camada mais externa) ====
+app.add_middleware(CompressionMiddleware)
+
+# ==== Métricas (por fora da compressão: mede a requisição inteira e os bytes no fio) ====
+app.add_middleware(MetricsMiddleware)
+
 # ==== Arquivos estáticos ====
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+app.mount("/static", AssetStaticFiles(directory=str(STATIC_DIR)), name="static")
 
 # ==== BigQuery: cliente e diagnóstico ====
 GCP_PROJECT = os.getenv("GCP_PROJECT")
@@ -114,64 +155,67 @@ async def custom_http_exception_handler(request: Request, exc: HTTPException):
         return RedirectResponse(url=f"/?error={detail}", status_code=303)
     return await http_exception_handler(request, exc)
 
-# ==== Páginas (HTML) — mantidas ====
+# ==== Páginas (HTML) — servidas da memória (ver assets.py) ====
+def _page(name: str, request: Request):
+    return assets.page_response(name, request.headers)
+
 @app.get("/", response_class=HTMLResponse, include_in_schema=False)
-async def serve_root_or_login():
-    return FileResponse(str(STATIC_DIR / "login.html"))
+async def serve_root_or_login(request: Request):
+    return _page("login.html", request)
 
 @app.get("/calculadora", response_class=HTMLResponse, include_in_schema=False)
-async def serve_calculator_page(user: dict = Depends(get_current_user)):
-    return FileResponse(str(STATIC_DIR / "calculadora.html"))
+async def serve_calculator_page(request: Request, user: dict = Depends(get_current_user)):
+    return _page("calculadora.html", request)
 
 @app.get("/lista", response_class=HTMLResponse, include_in_schema=False)
-async def serve_lista_page(user: dict = Depends(get_current_user)):
-    return FileResponse(str(STATIC_DIR / "lista.html"))
+async def serve_lista_page(request: Request, user: dict = Depends(get_current_user)):
+    return _page("lista.html", request)
 
 @app.get("/editar", response_class=HTMLResponse, include_in_schema=False)
-async def serve_edit_page(user: dict = Depends(get_current_user)):
-    return FileResponse(str(STATIC_DIR / "editar.html"))
+async def serve_edit_page(request: Request, user: dict = Depends(get_current_user)):
+    return _page("editar.html", request)
 
 @app.get("/configuracoes", response_class=HTMLResponse, include_in_schema=False)
-async def serve_config_page(user: dict = Depends(get_current_user)):
-    return FileResponse(str(STATIC_DIR / "configuracoes.html"))
+async def serve_config_page(request: Request, user: dict = Depends(get_current_user)):
+    return _page("configuracoes.html", request)
 
 @app.get("/perfil", response_class=HTMLResponse, include_in_schema=False)
-async def serve_perfil_page(user: dict = Depends(get_current_user)):
-    return FileResponse(str(STATIC_DIR / "perfil.html"))
+async def serve_perfil_page(request: Request, user: dict = Depends(get_current_user)):
+    return _page("perfil.html", request)
 
 @app.get("/admin", response_class=HTMLResponse, include_in_schema=False)
-async def serve_admin_page(user: dict = Depends(get_current_admin_user)):
-    return FileResponse(str(STATIC_DIR / "admin.html"))
+async def serve_admin_page(request: Request, user: dict = Depends(get_current_admin_user)):
+    return _page("admin.html", request)
 
 @app.get("/regras", response_class=HTMLResponse, include_in_schema=False)
-async def serve_regras_page(user: dict = Depends(get_current_user)):
-    return FileResponse(str(STATIC_DIR / "regras.html"))
+async def serve_regras_page(request: Request, user: dict = Depends(get_current_user)):
+    return _page("regras.html", request)
 
 @app.get("/campanhas", response_class=HTMLResponse, include_in_schema=False)
-async def serve_campanhas_page(user: dict = Depends(get_current_admin_user)):
-    return FileResponse(str(STATIC_DIR / "campanhas.html"))
+async def serve_campanhas_page(request: Request, user: dict = Depends(get_current_admin_user)):
+    return _page("campanhas.html", request)
 
 @app.get("/alertas", response_class=HTMLResponse, include_in_schema=False)
-async def serve_alertas_page(user: dict = Depends(get_current_user)):
-    return FileResponse(str(STATIC_DIR / "alertas.html"))
+async def serve_alertas_page(request: Request, user: dict = Depends(get_current_user)):
+    return _page("alertas.html", request)
 
 @app.get("/pendente", response_class=HTMLResponse, include_in_schema=False)
 async def serve_pending_page(request: Request):
     if request.session.get("user", {}).get("authorized"):
         return RedirectResponse(url="/calculadora")
-    return FileResponse(str(STATIC_DIR / "pendente.html"))
+    return _page("pendente.html", request)
 
 @app.get("/historico", response_class=HTMLResponse, include_in_schema=False)
-async def serve_historico_page(user: dict = Depends(get_historico_viewer_user)):
-    return FileResponse(str(STATIC_DIR / "historico.html"))
+async def serve_historico_page(request: Request, user: dict = Depends(get_historico_viewer_user)):
+    return _page("historico.html", request)
 
 @app.get("/editar-campanha", response_class=HTMLResponse, include_in_schema=False)
-async def serve_edit_campaign_page(user: dict = Depends(get_current_user)):
-    return FileResponse(str(STATIC_DIR / "editar-campanha.html"))
+async def serve_edit_campaign_page(request: Request, user: dict = Depends(get_current_user)):
+    return _page("editar-campanha.html", request)
 
 @app.get("/simulador", response_class=HTMLResponse, include_in_schema=False)
-async def serve_simulator_page(user: dict = Depends(get_current_user)):
-    return FileResponse(str(STATIC_DIR / "simulador.html"))
+async def serve_simulator_page(request: Request, user: dict = Depends(get_current_user)):
+    return _page("simulador.html", request)
 
 # ==== Health & Diagnóstico ====
 @app.get("/healthz", include_in_schema=False)
@@ -0,0 +1,402 @@
+# app/metrics.py
+"""
+Métricas da aplicação no formato texto do Prometheus (GET /api/admin/metrics).
+
+- `MetricsMiddleware` (camada ASGI mais externa): histogramas de latência
+  por método × rota × status, tamanho das respostas (bytes no fio, já
+  comprimidos) por método × rota e requisições em andamento. A rota é o
+  template (`/api/precificacao/{id}`), não o path, para a cardinalidade
+  ficar limitada;
+- consultas BigQuery: `instrument_bigquery(client)` embrulha `client.query`
+  e mede do envio até o fim do `result()` — quantidade, erros, duração e
+  bytes processados, atribuídos à rota da requisição que disparou a
+  consulta (contextvar; "background" para jobs e recargas fora de
+  requisição);
+- atraso do event loop: uma task mede quanto um `sleep` de
+  LAG_INTERVAL_SECONDS atrasa (código síncrono bloqueando o loop);
+- na leitura, também as estatísticas já mantidas por cache.py,
+  compression.py, scheduler.py e pelos índices em memória.
+
+Custo no caminho da requisição: buckets pré-alocados (lista de inteiros
+por série) e nenhum lock. As séries HTTP só são escritas no thread do event
+loop; as do BigQuery, que rodam no threadpool, ficam em um shard por
+thread, somados só na leitura.
+
+Com vários workers (gunicorn), cada processo expõe as próprias séries:
+`process_start_time_seconds` permite ao Prometheus detectar o reinício.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PREFIX = "precificacao"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Token para o coletor do Prometheus (Authorization: Bearer ...); sem ele, só admin
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+BIGQUERY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LAG_INTERVAL_SECONDS = 0.5
+
+UNMATCHED_ROUTE = "<sem rota>"
+BACKGROUND_ROUTE = "background"
+
+_START_TIME = time.time()
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        # Último bucket = +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def merge(self, other: "Histogram"):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.total += other.total
+
+
+# =============================================================================
+# Séries (HTTP: só o thread do event loop escreve)
+# =============================================================================
+_in_flight = 0
+_latency: Dict[Tuple[str, str, str], Histogram] = {}
+_sizes: Dict[Tuple[str, str], Histogram] = {}
+_loop_lag = Histogram(LAG_BUCKETS)
+_lag_task: Optional[asyncio.Task] = None
+
+
+class _BigQueryShard:
+    __slots__ = ("queries", "durations", "bytes_processed")
+
+    def __init__(self):
+        self.queries: Dict[Tuple[str, str], int] = {}
+        self.durations: Dict[str, Histogram] = {}
+        self.bytes_processed: Dict[str, int] = {}
+
+
+_local = threading.local()
+_shards: List[_BigQueryShard] = []
+_shards_lock = threading.Lock()
+
+
+def _shard() -> _BigQueryShard:
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _BigQueryShard()
+        with _shards_lock:  # uma vez por thread
+            _shards.append(shard)
+        _local.shard = shard
+    return shard
+
+
+# =============================================================================
+# Rota da requisição atual
+# =============================================================================
+class _RequestContext:
+    __slots__ = ("scope", "_route")
+
+    def __init__(self, scope: Scope):
+        self.scope = scope
+        self._route: Optional[str] = None
+
+    def route(self) -> str:
+        if self._route is None:
+            self._route = _route_label(self.scope)
+        return self._route
+
+
+_current: contextvars.ContextVar[Optional[_RequestContext]] = contextvars.ContextVar("metrics_request", default=None)
+
+
+def _route_label(scope: Scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", UNMATCHED_ROUTE)
+    # O router grava a rota no scope; se uma camada intermediária trocou o
+    # dict (ex.: compressão reescrevendo If-None-Match), resolve de novo aqui.
+    app = scope.get("app")
+    for candidate in getattr(getattr(app, "router", None), "routes", ()):
+        match, _ = candidate.matches(scope)
+        if match == Match.FULL:
+            return getattr(candidate, "path", UNMATCHED_ROUTE) or "/"
+    return UNMATCHED_ROUTE
+
+
+def current_route() -> str:
+    ctx = _current.get()
+    return ctx.route() if ctx is not None else BACKGROUND_ROUTE
+
+
+# =============================================================================
+# Middleware
+# =============================================================================
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global _in_flight
+        ctx = _RequestContext(scope)
+        token = _current.set(ctx)
+        status = "500"
+        size = 0
+
+        async def send_wrapper(message: Message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        _in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _in_flight -= 1
+            _current.reset(token)
+            method = scope["method"]
+            route = ctx.route()
+            key = (method, route, status)
+            hist = _latency.get(key)
+            if hist is None:
+                hist = _latency[key] = Histogram(LATENCY_BUCKETS)
+            hist.observe(elapsed)
+            hist = _sizes.get((method, route))
+            if hist is None:
+                hist = _sizes[(method, route)] = Histogram(SIZE_BUCKETS)
+            hist.observe(size)
+
+
+# =============================================================================
+# BigQuery
+# =============================================================================
+def _record_query(route: str, ok: bool, seconds: float, bytes_processed: Optional[int]):
+    shard = _shard()
+    key = (route, "ok" if ok else "erro")
+    shard.queries[key] = shard.queries.get(key, 0) + 1
+    hist = shard.durations.get(route)
+    if hist is None:
+        hist = shard.durations[route] = Histogram(BIGQUERY_BUCKETS)
+    hist.observe(seconds)
+    if bytes_processed:
+        shard.bytes_processed[route] = shard.bytes_processed.get(route, 0) + bytes_processed
+
+
+def instrument_bigquery(client):
+    """
+    Embrulha `client.query` para medir cada consulta até o fim do
+    `result()`. Jobs que nunca têm o resultado lido não entram na conta.
+    """
+    original_query = client.query
+
+    def query(*args, **kwargs):
+        route = current_route()
+        t0 = time.perf_counter()
+        try:
+            job = original_query(*args, **kwargs)
+        except Exception:
+            _record_query(route, False, time.perf_counter() - t0, None)
+            raise
+        original_result = job.result
+        recorded = False
+
+        def result(*r_args, **r_kwargs):
+            nonlocal recorded
+            ok = False
+            try:
+                rows = original_result(*r_args, **r_kwargs)
+                ok = True
+                return rows
+            finally:
+                if not recorded:
+                    recorded = True
+                    try:
+                        processed = job.total_bytes_processed if ok else None
+                    except Exception:
+                        processed = None
+                    _record_query(route, ok, time.perf_counter() - t0, processed)
+
+        job.result = result
+        return job
+
+    client.query = query
+    return client
+
+
+# =============================================================================
+# Atraso do event loop
+# =============================================================================
+async def _watch_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(LAG_INTERVAL_SECONDS)
+        _loop_lag.observe(max(0.0, loop.time() - t0 - LAG_INTERVAL_SECONDS))
+
+
+def start():
+    global _lag_task
+    if _lag_task is None or _lag_task.done():
+        _lag_task = asyncio.get_running_loop().create_task(_watch_loop_lag())
+
+
+def stop():
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        _lag_task = None
+
+
+# =============================================================================
+# Formato texto do Prometheus
+# =============================================================================
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Writer:
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def header(self, name: str, kind: str, help_text: str):
+        self.lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        self.lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+    def sample(self, name: str, label_names: Sequence[str], values: Sequence[Any], value: float):
+        self.lines.append(f"{PREFIX}_{name}{_labels(label_names, values)} {_fmt(value)}")
+
+    def metric(self, name: str, kind: str, help_text: str, label_names: Sequence[str], samples: Iterable[Tuple[Sequence[Any], float]]):
+        self.header(name, kind, help_text)
+        for values, value in samples:
+            self.sample(name, label_names, values, value)
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str], series: Iterable[Tuple[Sequence[Any], Histogram]]):
+        self.header(name, "histogram", help_text)
+        for values, hist in series:
+            cumulative = 0
+            for bound, count in zip(list(hist.bounds) + ["+Inf"], hist.counts):
+                cumulative += count
+                le = "+Inf" if bound == "+Inf" else _fmt(float(bound))
+                labels = _labels(label_names, values, 'le="' + le + '"')
+                self.lines.append(f"{PREFIX}_{name}_bucket{labels} {cumulative}")
+            self.lines.append(f"{PREFIX}_{name}_sum{_labels(label_names, values)} {_fmt(round(hist.total, 6))}")
+            self.lines.append(f"{PREFIX}_{name}_count{_labels(label_names, values)} {cumulative}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def _bigquery_totals():
+    queries: Dict[Tuple[str, str], int] = {}
+    durations: Dict[str, Histogram] = {}
+    processed: Dict[str, int] = {}
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        for key, n in list(shard.queries.items()):
+            queries[key] = queries.get(key, 0) + n
+        for route, hist in list(shard.durations.items()):
+            durations.setdefault(route, Histogram(BIGQUERY_BUCKETS)).merge(hist)
+        for route, n in list(shard.bytes_processed.items()):
+            processed[route] = processed.get(route, 0) + n
+    return queries, durations, processed
+
+
+def _index_statuses() -> Dict[str, Dict[str, Any]]:
+    from . import incremental, interval_index, rollups
+
+    return {**incremental.status(), "lucro_mensal": rollups.status(), "campanhas": interval_index.status()}
+
+
+def render() -> str:
+    from . import cache, compression, scheduler
+
+    w = _Writer()
+    w.metric("process_start_time_seconds", "gauge", "Início do processo (epoch).", (), [((), _START_TIME)])
+    w.metric("http_requests_in_flight", "gauge", "Requisições HTTP em andamento.", (), [((), _in_flight)])
+    w.histogram(
+        "http_request_duration_seconds", "Latência das requisições HTTP.",
+        ("method", "route", "status"), sorted(_latency.items()),
+    )
+    w.histogram(
+        "http_response_size_bytes", "Tamanho das respostas HTTP (após compressão).",
+        ("method", "route"), sorted(_sizes.items()),
+    )
+    w.histogram("event_loop_lag_seconds", "Atraso do event loop.", (), [((), _loop_lag)])
+
+    queries, durations, processed = _bigquery_totals()
+    w.metric("bigquery_queries_total", "counter", "Consultas BigQuery por rota.", ("route", "status"), sorted(queries.items()))
+    w.histogram("bigquery_query_duration_seconds", "Duração das consultas BigQuery.", ("route",), sorted(((r,), h) for r, h in durations.items()))
+    w.metric("bigquery_bytes_processed_total", "counter", "Bytes processados pelo BigQuery.", ("route",), sorted(((r,), n) for r, n in processed.items()))
+
+    cache_stats = sorted(cache.stats().items())
+    for field, kind, help_text in (
+        ("hits", "counter", "Acertos do cache local."),
+        ("misses", "counter", "Faltas do cache."),
+        ("shared_hits", "counter", "Acertos do cache compartilhado."),
+        ("coalesced", "counter", "Chamadas que esperaram um carregamento em andamento."),
+        ("size", "gauge", "Entradas no cache local."),
+    ):
+        name = f"cache_{field}_total" if kind == "counter" else f"cache_{field}"
+        w.metric(name, kind, help_text, ("namespace",), [((ns,), s.get(field, 0)) for ns, s in cache_stats])
+
+    comp = sorted(compression.stats().items())
+    for field, help_text in (
+        ("responses", "Respostas comprimidas."),
+        ("bytes_in", "Bytes antes da compressão."),
+        ("bytes_out", "Bytes após a compressão."),
+        ("seconds", "Tempo gasto comprimindo."),
+    ):
+        w.metric(f"compression_{field}_total", "counter", help_text, ("encoding",), [((enc,), s.get(field, 0)) for enc, s in comp])
+
+    jobs = scheduler.counters()
+    w.metric("job_runs_total", "counter", "Execuções de jobs neste worker.", ("job",), [((j["nome"],), j["execucoes"]) for j in jobs])
+    w.metric("job_skipped_total", "counter", "Execuções puladas (lease de outro worker ou ainda rodando).", ("job",), [((j["nome"],), j["puladas"]) for j in jobs])
+    w.metric("job_running", "gauge", "Job em execução neste worker.", ("job",), [((j["nome"],), int(j["executando"])) for j in jobs])
+
+    indexes = sorted(_index_statuses().items())
+    w.metric("index_loaded", "gauge", "Índice em memória carregado.", ("index",), [((n,), int(bool(s.get("loaded")))) for n, s in indexes])
+    w.metric(
+        "index_age_seconds", "gauge", "Idade da última carga do índice.", ("index",),
+        [((n,), s["age_seconds"]) for n, s in indexes if s.get("age_seconds") is not None],
+    )
+    return w.text()
@@ -0,0 +1,122 @@
+# app/oauth_stub.py
+"""
+Servidor OAuth/OpenID local que imita o Google — para testes e dev sem
+acesso à conta Google.
+
+Sobe com:
+    uvicorn app.oauth_stub:app --port 9000
+
+e aponte a aplicação para ele:
+    GOOGLE_AUTH_ENDPOINT=http://localhost:9000/authorize
+    GOOGLE_TOKEN_ENDPOINT=http://localhost:9000/token
+    GOOGLE_USERINFO_ENDPOINT=http://localhost:9000/userinfo
+    GOOGLE_JWKS_URI=http://localhost:9000/certs
+    GOOGLE_ISSUER=http://localhost:9000
+
+O /authorize não mostra tela: aprova na hora o e-mail de `login_hint` (ou
+OAUTH_STUB_EMAIL) e redireciona com o código. O /token devolve um id_token
+RS256 assinado com uma chave gerada na subida, publicada em /certs.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import secrets
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+
+from authlib.jose import JsonWebKey, jwt
+from fastapi import FastAPI, Form, Header, HTTPException
+from fastapi.responses import JSONResponse, RedirectResponse
+
+ISSUER = os.getenv("OAUTH_STUB_ISSUER", "http://localhost:9000")
+DEFAULT_EMAIL = os.getenv("OAUTH_STUB_EMAIL", "dev@example.com")
+TOKEN_TTL_SECONDS = 3600
+
+_key = JsonWebKey.generate_key("RSA", 2048, is_private=True, options={"kid": secrets.token_hex(8)})
+# código -> dados da autorização; access_token -> perfil
+_codes: Dict[str, Dict[str, Any]] = {}
+_access_tokens: Dict[str, Dict[str, Any]] = {}
+
+app = FastAPI(title="OAuth stub", docs_url=None, redoc_url=None)
+
+
+def _profile(email: str) -> Dict[str, Any]:
+    name = email.split("@")[0].replace(".", " ").title()
+    return {
+        "sub": hashlib.sha1(email.encode("utf-8")).hexdigest()[:21],
+        "email": email,
+        "email_verified": True,
+        "name": name,
+        "picture": None,
+    }
+
+
+@app.get("/authorize")
+async def authorize(
+    redirect_uri: str,
+    client_id: str,
+    state: Optional[str] = None,
+    nonce: Optional[str] = None,
+    login_hint: Optional[str] = None,
+):
+    code = secrets.token_urlsafe(16)
+    _codes[code] = {
+        "email": (login_hint or DEFAULT_EMAIL).strip().lower(),
+        "client_id": client_id,
+        "redirect_uri": redirect_uri,
+        "nonce": nonce,
+    }
+    params = {"code": code}
+    if state:
+        params["state"] = state
+    return RedirectResponse(url=f"{redirect_uri}?{urlencode(params)}", status_code=302)
+
+
+@app.post("/token")
+async def token(
+    code: str = Form(...),
+    client_id: str = Form(...),
+    redirect_uri: str = Form(...),
+    grant_type: str = Form(...),
+    client_secret: Optional[str] = Form(None),
+):
+    grant = _codes.pop(code, None)
+    if grant_type != "authorization_code" or grant is None:
+        return JSONResponse({"error": "invalid_grant"}, status_code=400)
+    if grant["client_id"] != client_id or grant["redirect_uri"] != redirect_uri:
+        return JSONResponse({"error": "invalid_grant"}, status_code=400)
+
+    now = int(time.time())
+    profile = _profile(grant["email"])
+    claims = {**profile, "iss": ISSUER, "aud": client_id, "iat": now, "exp": now + TOKEN_TTL_SECONDS}
+    if grant["nonce"]:
+        claims["nonce"] = grant["nonce"]
+    id_token = jwt.encode({"alg": "RS256", "kid": _key.kid}, claims, _key).decode("ascii")
+
+    access_token = secrets.token_urlsafe(24)
+    _access_tokens[access_token] = profile
+    return {
+        "access_token": access_token,
+        "id_token": id_token,
+        "token_type": "Bearer",
+        "expires_in": TOKEN_TTL_SECONDS,
+        "scope": "openid email profile",
+    }
+
+
+@app.get("/userinfo")
+async def userinfo(authorization: str = Header("")):
+    profile = _access_tokens.get(authorization.removeprefix("Bearer ").strip())
+    if profile is None:
+        raise HTTPException(status_code=401, detail="invalid_token")
+    return profile
+
+
+@app.get("/certs")
+async def certs():
+    return JSONResponse(
+        {"keys": [_key.as_dict(is_private=False, use="sig", alg="RS256")]},
+        headers={"Cache-Control": "public, max-age=3600"},
+    )
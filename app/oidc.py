@@ -0,0 +1,149 @@
+# app/oidc.py
+"""
+Verificação local do ID token (OpenID Connect) devolvido pelo Google.
+
+O perfil do usuário (email, email_verified, name, picture) vem nas claims
+do `id_token` da troca de código, então o login não precisa chamar o
+endpoint de userinfo: basta validar a assinatura com as chaves públicas do
+provedor (JWKS) e conferir iss/aud/exp/nonce.
+
+As chaves ficam em memória pelo tempo do Cache-Control da resposta (o
+Google publica por ~6h) e são rebuscadas quando aparece um `kid`
+desconhecido (rotação), no máximo uma vez a cada MIN_REFRESH_SECONDS.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+
+from authlib.jose import JsonWebKey, JsonWebToken
+from authlib.jose.errors import JoseError
+
+from . import http_client
+
+GOOGLE_JWKS_URI = os.getenv("GOOGLE_JWKS_URI", "https://www.googleapis.com/oauth2/v3/certs")
+# Emissores aceitos (CSV); o Google usa os dois formatos
+GOOGLE_ISSUERS = [
+    i.strip()
+    for i in os.getenv("GOOGLE_ISSUER", "https://accounts.google.com,accounts.google.com").split(",")
+    if i.strip()
+]
+
+# Validade das chaves quando a resposta não traz max-age
+DEFAULT_KEYS_TTL_SECONDS = 3600
+# Intervalo mínimo entre buscas forçadas (kid desconhecido)
+MIN_REFRESH_SECONDS = 60
+# Tolerância de relógio (s) para exp/iat
+LEEWAY_SECONDS = 60
+
+_jwt = JsonWebToken(["RS256"])
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class IdTokenError(ValueError):
+    """ID token inválido (assinatura, emissor, audiência, validade ou nonce)."""
+
+
+# =============================================================================
+# Chaves (JWKS)
+# =============================================================================
+class _KeyCache:
+    def __init__(self):
+        self.keys: Optional[Dict[str, Any]] = None
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _fetch(self):
+        res = await http_client.get_client().get(GOOGLE_JWKS_URI)
+        res.raise_for_status()
+        m = _MAX_AGE.search(res.headers.get("cache-control", ""))
+        ttl = int(m.group(1)) if m else DEFAULT_KEYS_TTL_SECONDS
+        self.keys = res.json()
+        self.fetched_at = time.monotonic()
+        self.expires_at = self.fetched_at + ttl
+
+    async def get(self, kid: Optional[str]) -> Dict[str, Any]:
+        """JWKS atual; rebusca se vencido ou se `kid` não estiver nele."""
+        if self._usable(kid):
+            return self.keys
+        async with self._lock:
+            if not self._usable(kid):
+                expired = self.keys is None or time.monotonic() >= self.expires_at
+                if expired or time.monotonic() - self.fetched_at >= MIN_REFRESH_SECONDS:
+                    await self._fetch()
+        return self.keys
+
+    def _usable(self, kid: Optional[str]) -> bool:
+        if self.keys is None or time.monotonic() >= self.expires_at:
+            return False
+        return kid is None or any(k.get("kid") == kid for k in self.keys.get("keys", []))
+
+
+_keys = _KeyCache()
+_warm_task: Optional[asyncio.Task] = None
+
+
+# =============================================================================
+# Verificação
+# =============================================================================
+def _header_kid(token: str) -> Optional[str]:
+    try:
+        segment = token.split(".", 1)[0]
+        header = json.loads(base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4)))
+        return header.get("kid")
+    except Exception:
+        raise IdTokenError("ID token malformado.") from None
+
+
+async def verify_id_token(token: str, audience: str, nonce: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Valida o ID token e devolve as claims.
+    Lança IdTokenError se o token for inválido; erros de rede ao buscar as
+    chaves (httpx.HTTPError) sobem como estão.
+    """
+    kid = _header_kid(token)
+    jwks = await _keys.get(kid)
+    try:
+        claims = _jwt.decode(
+            token,
+            JsonWebKey.import_key_set(jwks),
+            claims_options={
+                "iss": {"essential": True, "values": GOOGLE_ISSUERS},
+                "aud": {"essential": True, "value": audience},
+                "exp": {"essential": True},
+            },
+        )
+        claims.validate(leeway=LEEWAY_SECONDS)
+    except (JoseError, ValueError) as e:
+        raise IdTokenError(f"ID token inválido: {e}") from None
+    if nonce is not None and claims.get("nonce") != nonce:
+        raise IdTokenError("ID token inválido: nonce não confere.")
+    return dict(claims)
+
+
+async def warm():
+    """Busca as chaves antecipadamente (subida da aplicação); falhas são ignoradas."""
+    try:
+        await _keys.get(None)
+    except Exception as e:
+        print(f"AVISO: não foi possível pré-carregar as chaves do OAuth ({e}).")
+
+
+def start():
+    """Dispara `warm()` em background, guardando a task (cancelada em `stop()`)."""
+    global _warm_task
+    if _warm_task is None or _warm_task.done():
+        _warm_task = asyncio.get_running_loop().create_task(warm())
+
+
+def stop():
+    global _warm_task
+    if _warm_task is not None:
+        _warm_task.cancel()
+        _warm_task = None
@@ -0,0 +1,202 @@
+# app/pricing.py
+"""
+Motor de precificação no servidor.
+
+Porta fiel do `PricingCalculator` de static/pricingLogic.js, para que
+importações em massa (e outros fluxos sem navegador) gerem os mesmos
+valores que a calculadora.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+INF = float("inf")
+
+
+# =============================================================================
+# Normalização da configuração da loja
+# =============================================================================
+def normalize_loja_config(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Aceita os formatos antigos de `loja_config_detalhes.configuracoes`."""
+    raw = raw if isinstance(raw, dict) else {}
+    comissoes: List[Dict[str, Any]] = []
+    for c in raw.get("comissoes") or []:
+        if isinstance(c, dict):
+            comissoes.append(
+                {
+                    "chave": str(c.get("chave") or c.get("nome") or "padrao"),
+                    "classico": float(c.get("classico") or c.get("taxa_classico") or 0.0),
+                    "premium": float(c.get("premium") or c.get("taxa_premium") or 0.0),
+                }
+            )
+    return {
+        "aliquota_padrao": float(raw.get("aliquota_padrao") or raw.get("aliquota") or 0.0),
+        "aliquota_fulfillment": float(raw.get("aliquota_fulfillment") or raw.get("aliquota_ff") or 0.0),
+        "comissoes": comissoes,
+    }
+
+
+# =============================================================================
+# Regras (tarifa fixa / frete)
+# =============================================================================
+def _num(v: Any, default: float = 0.0) -> float:
+    try:
+        return float(v) if v is not None else default
+    except (TypeError, ValueError):
+        return default
+
+
+def tarifa_fixa_ml(valor_venda: float, regras: List[Dict[str, Any]]) -> float:
+    for r in regras:
+        if _num(r.get("min_venda")) <= valor_venda <= _num(r.get("max_venda"), INF):
+            return _num(r.get("taxa_fixa")) + valor_venda * _num(r.get("taxa_percentual")) / 100
+    return 0.0
+
+
+def frete_por_regra(valor_venda: float, peso_kg: float, regras: List[Dict[str, Any]]) -> float:
+    if not peso_kg or peso_kg <= 0:
+        return 0.0
+    g = peso_kg * 1000
+    for r in regras:
+        if (
+            _num(r.get("min_venda")) <= valor_venda <= _num(r.get("max_venda"), INF)
+            and _num(r.get("min_peso_g")) <= g <= _num(r.get("max_peso_g"), INF)
+        ):
+            return _num(r.get("custo_frete"))
+    return 0.0
+
+
+def peso_considerado(produto: Dict[str, Any]) -> float:
+    peso_real = _num(produto.get("peso_kg"))
+    peso_cubico = (
+        _num(produto.get("altura_cm")) * _num(produto.get("largura_cm")) * _num(produto.get("comprimento_cm"))
+    ) / 6000
+    return max(peso_real, peso_cubico)
+
+
+# =============================================================================
+# Cálculo por plano
+# =============================================================================
+def calcular_plano(
+    *,
+    custo_total: float,
+    valor_venda: Optional[float],
+    margem_desejada: Optional[float],
+    comissao_perc: float,
+    aliquota: float,
+    parcelamento: float,
+    outros: float,
+    peso_kg: float,
+    regras_tarifa: List[Dict[str, Any]],
+    regras_frete: List[Dict[str, Any]],
+) -> Dict[str, float]:
+    """
+    Mesmo algoritmo do `calcPlano` do front: sem preço informado e com margem
+    desejada, o preço é achado por ponto fixo (frete/tarifa dependem do preço).
+    """
+    custos_perc = aliquota + parcelamento + outros + comissao_perc
+    venda = _num(valor_venda)
+
+    if not venda and margem_desejada and margem_desejada > 0:
+        denom = 1 - ((custos_perc + margem_desejada) / 100)
+        if denom > 0.0001:
+            teste = custo_total * 1.5 if custo_total > 0 else 50.0
+            for _ in range(10):
+                frete_t = frete_por_regra(teste, peso_kg, regras_frete)
+                tarifa_t = tarifa_fixa_ml(teste, regras_tarifa)
+                novo = (custo_total + frete_t + tarifa_t) / denom
+                if abs(novo - teste) < 0.01:
+                    teste = novo
+                    break
+                teste = novo
+            venda = round(teste, 2)
+        else:
+            venda = 0.0
+
+    frete = frete_por_regra(venda, peso_kg, regras_frete)
+    tarifa = tarifa_fixa_ml(venda, regras_tarifa)
+    comissao_valor = venda * (comissao_perc / 100)
+    outros_custos = venda * ((aliquota + parcelamento + outros) / 100)
+    repasse = venda - comissao_valor - outros_custos - tarifa - frete
+    lucro = repasse - custo_total
+    margem = (lucro / venda) * 100 if venda > 0 else 0.0
+    return {
+        "venda": round(venda, 2),
+        "frete": round(frete, 2),
+        "tarifa_fixa": round(tarifa, 2),
+        "repasse": round(repasse, 2),
+        "lucro": round(lucro, 2),
+        "margem": round(margem, 2),
+    }
+
+
+def calcular_precificacao(
+    row: Dict[str, Any],
+    produto: Dict[str, Any],
+    loja_config: Dict[str, Any],
+    regras_tarifa: List[Dict[str, Any]],
+    regras_frete: List[Dict[str, Any]],
+    margem_categoria: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Monta o registro completo de precificação base (shape de PrecificacaoBaseItem)
+    a partir da linha informada + produto + configuração normalizada da loja.
+    """
+    quantidade = int(row.get("quantidade") or 1)
+    custo_unitario = row.get("custo_unitario")
+    if custo_unitario is None:
+        custo_unitario = _num(produto.get("custo_update"))
+    custo_unitario = _num(custo_unitario)
+    custo_total = quantidade * custo_unitario
+
+    fulfillment = bool(row.get("fulfillment") or False)
+    aliquota = loja_config["aliquota_fulfillment"] if fulfillment else loja_config["aliquota_padrao"]
+    parcelamento = _num(row.get("parcelamento"))
+    outros = _num(row.get("outros"))
+
+    comissoes = loja_config.get("comissoes") or []
+    regra_chave = row.get("regra_comissao") or (comissoes[0]["chave"] if comissoes else None)
+    regra = next((c for c in comissoes if c["chave"] == regra_chave), None)
+
+    peso = peso_considerado(produto)
+    out: Dict[str, Any] = {
+        "marketplace": row["marketplace"],
+        "id_loja": row["id_loja"],
+        "sku": row["sku"],
+        "titulo": row.get("titulo") or produto.get("titulo"),
+        "categoria_precificacao": row.get("categoria_precificacao"),
+        "id_sku_marketplace": row.get("id_sku_marketplace"),
+        "id_anuncio": row.get("id_anuncio"),
+        "quantidade": quantidade,
+        "custo_unitario": round(custo_unitario, 2),
+        "custo_total": round(custo_total, 2),
+        "aliquota": aliquota,
+        "parcelamento": parcelamento,
+        "outros": outros,
+        "regra_comissao": regra_chave,
+        "fulfillment": fulfillment,
+        "catalogo_buybox": bool(row.get("catalogo_buybox") or False),
+    }
+    for plano in ("classico", "premium"):
+        margem = row.get(f"margem_desejada_{plano}")
+        if margem is None:
+            margem = margem_categoria
+        res = calcular_plano(
+            custo_total=custo_total,
+            valor_venda=row.get(f"venda_{plano}"),
+            margem_desejada=_num(margem) if margem is not None else None,
+            comissao_perc=_num(regra.get(plano)) if regra else 0.0,
+            aliquota=aliquota,
+            parcelamento=parcelamento,
+            outros=outros,
+            peso_kg=peso,
+            regras_tarifa=regras_tarifa,
+            regras_frete=regras_frete,
+        )
+        out[f"venda_{plano}"] = res["venda"]
+        out[f"frete_{plano}"] = res["frete"]
+        out[f"tarifa_fixa_{plano}"] = res["tarifa_fixa"]
+        out[f"repasse_{plano}"] = res["repasse"]
+        out[f"lucro_{plano}"] = res["lucro"]
+        out[f"margem_{plano}"] = res["margem"]
+    return out
@@ -0,0 +1,303 @@
+# app/reference_data.py
+"""
+Dados de referência servidos com stale-while-revalidate.
+
+Lojas, campanhas ativas, regras de negócio e categorias de precificação
+mudam raramente, mas estão no caminho de toda abertura da calculadora. Aqui
+cada conjunto fica carregado em memória:
+
+- depois da expiração "suave" (por idade) o valor antigo continua sendo
+  servido e a recarga roda em background;
+- uma invalidação do namespace de cache correspondente (gravação de loja,
+  campanha, regra...) recarrega de forma síncrona, com single-flight: a
+  requisição seguinte a uma gravação já vê o dado novo. Se a recarga
+  falhar, o valor anterior segue servido e novas tentativas esperam
+  cache.ERROR_BACKOFF_SECONDS;
+- a primeira leitura de um processo (antes do preload terminar) também
+  carrega de forma síncrona;
+- `start()` (lifespan da aplicação) faz o preload e mantém uma thread que
+  revalida os conjuntos vencidos mesmo sem tráfego.
+
+`status()` expõe idade, geração e último erro de cada conjunto. `etag()` é
+um hash do conteúdo carregado — igual em todos os workers para os mesmos
+dados, usado nas respostas condicionais (ver http_cache.py).
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from . import cache, dashboard_snapshot
+from .serialization import dumps
+
+# Idade (s) a partir da qual um conjunto é revalidado em background
+SOFT_TTL_SECONDS = 300
+# Intervalo (s) da verificação periódica de conjuntos vencidos
+CHECK_INTERVAL_SECONDS = 30
+
+_MISSING = object()
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="reference-data")
+
+
+class Dataset:
+    def __init__(
+        self,
+        name: str,
+        loader: Callable[[], Any],
+        namespaces: Tuple[str, ...],
+        soft_ttl: int = SOFT_TTL_SECONDS,
+        drop_cached: Optional[Callable[[], None]] = None,
+        stamp: Optional[Callable[[], Any]] = None,
+    ):
+        self.name = name
+        self.loader = loader
+        self.namespaces = namespaces
+        self.soft_ttl = soft_ttl
+        # Descarta o valor memoizado antes de uma recarga por idade
+        self.drop_cached = drop_cached
+        # Marca extra de versão (ex.: mtime de um arquivo de origem)
+        self.stamp = stamp
+        self.value: Any = _MISSING
+        self.generation = 0
+        self.etag: Optional[str] = None
+        self.loaded_at: Optional[float] = None
+        self.loaded_at_utc: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.failed_at: Optional[float] = None
+        self._versions: Tuple[Any, ...] = ()
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _current_versions(self) -> Tuple[Any, ...]:
+        versions = tuple(cache.namespace(n).version for n in self.namespaces)
+        return versions + (self.stamp(),) if self.stamp else versions
+
+    def is_stale(self) -> bool:
+        if self.value is _MISSING:
+            return True
+        if self._versions != self._current_versions():
+            return True
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= self.soft_ttl
+
+    def _outdated(self) -> bool:
+        return self.value is _MISSING or self._versions != self._current_versions()
+
+    def _backoff(self) -> bool:
+        return self.failed_at is not None and time.monotonic() - self.failed_at < cache.ERROR_BACKOFF_SECONDS
+
+    def _load(self, only_if_outdated: bool = False):
+        with self._load_lock:
+            if only_if_outdated and not self._outdated():
+                # Outra thread já recarregou enquanto esta esperava
+                return
+            versions = self._current_versions()
+            expired = versions == self._versions and self.value is not _MISSING
+            if expired and self.drop_cached:
+                self.drop_cached()
+            try:
+                value = self.loader()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                self.failed_at = time.monotonic()
+                raise
+            etag = _content_hash(value)
+            with self._lock:
+                self.value = value
+                self.etag = etag
+                self._versions = versions
+                self.generation += 1
+                self.loaded_at = time.monotonic()
+                self.loaded_at_utc = datetime.now(timezone.utc)
+                self.last_error = None
+                self.failed_at = None
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or self._backoff():
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._load()
+            except Exception as e:
+                print(f"ERRO AO ATUALIZAR DADOS DE REFERÊNCIA ({self.name}): {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        _executor.submit(run)
+
+    def get(self) -> Any:
+        if self._outdated():
+            # Carga a frio ou gravação desde a última carga: recarrega já
+            if not self._backoff():
+                try:
+                    self._load(only_if_outdated=True)
+                except Exception as e:
+                    if self.value is _MISSING:
+                        raise
+                    print(f"AVISO: falha ao recarregar dados de referência ({self.name}); usando os anteriores. Erro: {e}")
+            elif self.value is _MISSING:
+                raise RuntimeError(f"Dados de referência indisponíveis ({self.name}): {self.last_error}")
+        elif self.is_stale():
+            self._refresh_in_background()
+        return self.value
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            loaded = self.value is not _MISSING
+            return {
+                "loaded": loaded,
+                "generation": self.generation,
+                "etag": self.etag,
+                "age_seconds": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at else None,
+                "loaded_at": self.loaded_at_utc.isoformat() if self.loaded_at_utc else None,
+                "stale": self.is_stale(),
+                "refreshing": self._refreshing,
+                "last_error": self.last_error,
+            }
+
+
+def _content_hash(value: Any) -> Optional[str]:
+    body = getattr(value, "body", None)
+    try:
+        data = body if isinstance(body, bytes) else dumps(value)
+    except Exception:
+        return None
+    return hashlib.sha1(data).hexdigest()
+
+
+# =============================================================================
+# Conjuntos
+# =============================================================================
+def _services():
+    from . import services
+    return services
+
+
+def _drop(fn_name: str) -> Callable[[], None]:
+    def drop():
+        fn = getattr(_services(), fn_name)
+        fn.cache_namespace.discard(fn.cache_key())
+    return drop
+
+
+def _load_lojas():
+    return _services().get_lojas_config()
+
+
+def _load_campanhas_ativas():
+    return _services().get_active_campaigns()
+
+
+def _load_regras():
+    from .routers import regras
+    return regras.compile_rules()
+
+
+def _regras_stamp():
+    from .routers import regras
+    return regras.rules_file_stamp()
+
+
+def _load_categorias():
+    return _services().get_all_precificacao_categories()
+
+
+_datasets: Dict[str, Dataset] = {
+    "lojas": Dataset("lojas", _load_lojas, ("lojas",), drop_cached=_drop("get_lojas_config")),
+    # Derivado do índice de intervalos (interval_index.py), que se recarrega sozinho
+    "campanhas_ativas": Dataset("campanhas_ativas", _load_campanhas_ativas, ("campaigns",)),
+    "regras": Dataset("regras", _load_regras, ("rules",), stamp=_regras_stamp),
+    "categorias": Dataset(
+        "categorias", _load_categorias, ("categories",), drop_cached=_drop("get_all_precificacao_categories")
+    ),
+    "dashboard_alertas": Dataset(
+        "dashboard_alertas",
+        dashboard_snapshot.build,
+        ("campaigns", "dashboard"),
+        soft_ttl=dashboard_snapshot.REFRESH_SECONDS,
+    ),
+}
+
+
+def dataset(name: str) -> Dataset:
+    try:
+        return _datasets[name]
+    except KeyError:
+        raise KeyError(f"Conjunto de dados de referência desconhecido: {name}") from None
+
+
+def get(name: str) -> Any:
+    return dataset(name).get()
+
+
+async def aget(name: str) -> Any:
+    """`get` para rotas async: a recarga síncrona (se houver) roda no threadpool."""
+    ds = dataset(name)
+    if ds._outdated():
+        return await run_in_threadpool(ds.get)
+    return ds.get()
+
+
+def generation(name: str) -> int:
+    return dataset(name).generation
+
+
+def etag(name: str) -> Optional[str]:
+    """
+    Hash do conteúdo atual; None se ainda não carregado ou desatualizado por
+    uma gravação (a rota recarrega antes de responder).
+    """
+    ds = dataset(name)
+    if ds._outdated():
+        return None
+    return ds.etag
+
+
+def status() -> Dict[str, Dict[str, Any]]:
+    return {name: ds.status() for name, ds in _datasets.items()}
+
+
+# =============================================================================
+# Preload e revalidação periódica
+# =============================================================================
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def preload():
+    for name, ds in _datasets.items():
+        try:
+            ds._load()
+        except Exception as e:
+            print(f"ERRO NO PRELOAD DE DADOS DE REFERÊNCIA ({name}): {e}")
+
+
+def _watch():
+    preload()
+    while not _stop.wait(CHECK_INTERVAL_SECONDS):
+        for ds in _datasets.values():
+            if ds.is_stale():
+                ds._refresh_in_background()
+
+
+def start():
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_watch, name="reference-data-watch", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
@@ -0,0 +1,255 @@
+# app/rollups.py
+"""
+Cubo de lucro mensal pré-agregado (mês × categoria × marketplace × loja).
+
+Os gráficos do dashboard somavam `lucro_classico + lucro_premium` sobre
+toda a `precificacoes_salvas` a cada carregamento. Aqui a soma fica num
+cubo em memória, pequeno (meses × categorias × lojas):
+
+- carga completa: um único GROUP BY no BigQuery, na primeira leitura do
+  processo e a cada FULL_REBUILD_SECONDS (reconciliação);
+- gravações feitas por este processo (importação, atualização em massa,
+  exclusão) aplicam o delta direto no cubo (`apply`) — sem reconsultar;
+- gravações de outros workers chegam pelo namespace "dashboard" do cache:
+  versão diferente da do cubo = recarga completa em background, servindo o
+  cubo atual enquanto isso.
+
+`query()` responde qualquer janela de meses, filtros e agrupamento
+(drill-down) somando as células do cubo.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import cache
+
+DIMENSIONS = ("mes", "categoria", "marketplace", "id_loja")
+# Reconciliação periódica com a tabela (gravações fora da aplicação)
+FULL_REBUILD_SECONDS = 6 * 3600
+
+Cell = Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rollups")
+
+
+def _services():
+    from . import services
+    return services
+
+
+def month_of(value: Any) -> Optional[str]:
+    """'YYYY-MM' de um datetime/date/ISO string."""
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return f"{value.year:04d}-{value.month:02d}"
+    text = str(value)
+    return text[:7] if len(text) >= 7 and text[4] == "-" else None
+
+
+def current_month() -> str:
+    return month_of(datetime.now(timezone.utc))
+
+
+def shift_month(mes: str, delta: int) -> str:
+    ano, m = int(mes[:4]), int(mes[5:7])
+    idx = ano * 12 + (m - 1) + delta
+    return f"{idx // 12:04d}-{idx % 12 + 1:02d}"
+
+
+def _num(v: Any) -> float:
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def cell_of(row: Dict[str, Any]) -> Optional[Cell]:
+    mes = row.get("mes") or month_of(row.get("data_calculo"))
+    if not mes:
+        return None
+    categoria = row.get("categoria", row.get("categoria_precificacao"))
+    return (mes, categoria or None, row.get("marketplace"), row.get("id_loja"))
+
+
+def profit_of(row: Dict[str, Any]) -> float:
+    if "lucro" in row:
+        return _num(row["lucro"])
+    return _num(row.get("lucro_classico")) + _num(row.get("lucro_premium"))
+
+
+# =============================================================================
+# Cubo
+# =============================================================================
+class _Cube:
+    def __init__(self):
+        self.cells: Optional[Dict[Cell, List[float]]] = None
+        self.version = -1
+        self.built_at: Optional[float] = None
+        self.built_at_utc: Optional[datetime] = None
+        self.deltas_applied = 0
+        self.rebuilds = 0
+        self.last_error: Optional[str] = None
+        self.refreshing = False
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def _namespace_version(self) -> int:
+        return cache.namespace("dashboard").version
+
+    def build(self, only_if_missing: bool = False):
+        with self._build_lock:
+            if only_if_missing and self.cells is not None:
+                return
+            version = self._namespace_version()
+            try:
+                rows = _services().fetch_profit_rollup()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            cells: Dict[Cell, List[float]] = {}
+            for r in rows:
+                cell = cell_of(r)
+                if cell is not None:
+                    acc = cells.setdefault(cell, [0.0, 0])
+                    acc[0] += _num(r.get("lucro"))
+                    acc[1] += int(r.get("registros") or 0)
+            with self._lock:
+                self.cells = cells
+                self.version = version
+                self.built_at = time.monotonic()
+                self.built_at_utc = datetime.now(timezone.utc)
+                self.rebuilds += 1
+                self.last_error = None
+
+    def _stale(self) -> bool:
+        if self.version != self._namespace_version():
+            return True
+        return self.built_at is None or time.monotonic() - self.built_at >= FULL_REBUILD_SECONDS
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.build()
+            except Exception as e:
+                print(f"ERRO AO RECALCULAR O CUBO DE LUCRO: {e}")
+            finally:
+                with self._lock:
+                    self.refreshing = False
+
+        _executor.submit(run)
+
+    def snapshot(self) -> Dict[Cell, List[float]]:
+        if self.cells is None:
+            # Carga a frio: leitores concorrentes esperam a mesma carga
+            self.build(only_if_missing=True)
+        elif self._stale():
+            self._rebuild_in_background()
+        return self.cells
+
+    def apply(self, rows: Iterable[Dict[str, Any]], sign: int):
+        with self._lock:
+            if self.cells is None:
+                return
+            cells = dict(self.cells)
+            for r in rows:
+                cell = cell_of(r)
+                if cell is None:
+                    continue
+                lucro, registros = cells.get(cell, (0.0, 0))
+                lucro += sign * profit_of(r)
+                registros += sign
+                if registros <= 0:
+                    cells.pop(cell, None)
+                else:
+                    cells[cell] = [lucro, registros]
+                self.deltas_applied += 1
+            self.cells = cells
+
+
+_cube = _Cube()
+
+
+# =============================================================================
+# API
+# =============================================================================
+def apply(added: Iterable[Dict[str, Any]] = (), removed: Iterable[Dict[str, Any]] = ()):
+    """
+    Aplica uma gravação deste processo ao cubo e avisa os demais workers
+    (namespace "dashboard"). As linhas precisam de data_calculo (ou mes),
+    categoria_precificacao, marketplace, id_loja e lucro_classico/premium.
+    """
+    was_current = _cube.cells is not None and _cube.version == _cube._namespace_version()
+    _cube.apply(removed, -1)
+    _cube.apply(added, +1)
+    cache.invalidate("dashboard")
+    if was_current:
+        # O cubo local já reflete a gravação: não precisa recarregar
+        with _cube._lock:
+            _cube.version = _cube._namespace_version()
+
+
+def query(
+    group_by: Sequence[str] = ("mes",),
+    inicio: Optional[str] = None,
+    fim: Optional[str] = None,
+    categoria: Optional[str] = None,
+    marketplace: Optional[str] = None,
+    id_loja: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Soma lucro e quantidade de precificações por `group_by` (subconjunto de
+    DIMENSIONS), na janela de meses [inicio, fim] ('YYYY-MM', inclusive).
+    """
+    unknown = [d for d in group_by if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Dimensões inválidas: {', '.join(unknown)}")
+    idx = [DIMENSIONS.index(d) for d in group_by]
+    filtros = {1: categoria, 2: marketplace, 3: id_loja}
+
+    totals: Dict[tuple, List[float]] = defaultdict(lambda: [0.0, 0])
+    for cell, (lucro, registros) in _cube.snapshot().items():
+        mes = cell[0]
+        if (inicio and mes < inicio) or (fim and mes > fim):
+            continue
+        if any(v is not None and (cell[i] or "").lower() != v.lower() for i, v in filtros.items()):
+            continue
+        acc = totals[tuple(cell[i] for i in idx)]
+        acc[0] += lucro
+        acc[1] += registros
+
+    out = [
+        {**dict(zip(group_by, key)), "lucro": round(lucro, 2), "registros": int(registros)}
+        for key, (lucro, registros) in totals.items()
+    ]
+    out.sort(key=lambda r: tuple("" if r[d] is None else str(r[d]) for d in group_by))
+    return out
+
+
+def warm():
+    """Carrega o cubo (ou dispara a recarga, se desatualizado) fora de uma requisição."""
+    _cube.snapshot()
+
+
+def status() -> Dict[str, Any]:
+    c = _cube
+    return {
+        "loaded": c.cells is not None,
+        "cells": len(c.cells or {}),
+        "age_seconds": round(time.monotonic() - c.built_at, 1) if c.built_at else None,
+        "built_at": c.built_at_utc.isoformat() if c.built_at_utc else None,
+        "rebuilds": c.rebuilds,
+        "deltas_applied": c.deltas_applied,
+        "refreshing": c.refreshing,
+        "last_error": c.last_error,
+    }
@@ -1,15 +1,17 @@
 # app/routers/admin.py
 from __future__ import annotations
 
+import hmac
 import os
 import platform
 import sys
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 
-from .. import dependencies
+from .. import cache, compression, dependencies, incremental, interval_index, metrics, reference_data, rollups, scheduler, sessions
 
 router = APIRouter(prefix="/api/admin", tags=["Admin"])
 
@@ -100,6 +102,10 @@ class SetRolePayload(BaseModel):
     is_admin: bool
 
 
+class RevokeSessionsPayload(BaseModel):
+    email: str
+
+
 class LogEntry(BaseModel):
     ts: Optional[str] = None
     level: Optional[str] = None
@@ -119,6 +125,12 @@ class HealthResponse(BaseModel):
     env: Optional[str] = os.getenv("APP_ENV")
 
 
+class ReferenceDataResponse(BaseModel):
+    datasets: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+    cache: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+    indexes: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+
+
 # =============================================================================
 # Endpoints (somente ADMIN)
 # =============================================================================
@@ -132,7 +144,7 @@ async def list_users(user: dict = Depends(dependencies.get_current_admin_user))
     """
     rows = []
     for fn in ("list_users", "get_all_users"):
-        res = _safe(fn)
+        res = await run_in_threadpool(_safe, fn)
         if isinstance(res, list):
             rows = res
             break
@@ -154,7 +166,7 @@ async def authorize_user(payload: AuthorizeUserPayload, user: dict = Depends(dep
     if not email:
         raise HTTPException(status_code=400, detail="E-mail inválido.")
 
-    ok = _safe("set_user_authorized", email, bool(payload.autorizado))
+    ok = await run_in_threadpool(_safe, "set_user_authorized", email, bool(payload.autorizado))
     if ok is False:
         raise HTTPException(status_code=400, detail="Falha ao atualizar autorização do usuário.")
     return {"ok": True}
@@ -170,19 +182,31 @@ async def set_user_role(payload: SetRolePayload, user: dict = Depends(dependenci
     if not email:
         raise HTTPException(status_code=400, detail="E-mail inválido.")
 
-    ok = _safe("set_admin", email, bool(payload.is_admin))
+    ok = await run_in_threadpool(_safe, "set_admin", email, bool(payload.is_admin))
     if ok is False:
         raise HTTPException(status_code=400, detail="Falha ao atualizar papel do usuário.")
     return {"ok": True}
 
 
+@router.post("/usuarios/revoke-sessions", summary="Encerra as sessões de um usuário")
+async def revoke_user_sessions(payload: RevokeSessionsPayload, user: dict = Depends(dependencies.get_current_admin_user)):
+    """
+    Derruba na hora todas as sessões abertas do usuário (ele precisa logar de novo).
+    Requer o cache compartilhado (Redis); sem ele as sessões ficam no cookie.
+    """
+    email = (payload.email or "").strip().lower()
+    if not email:
+        raise HTTPException(status_code=400, detail="E-mail inválido.")
+    return {"ok": True, "revoked": sessions.revoke_user(email)}
+
+
 @router.get("/logs", response_model=LogsResponse, summary="Últimos logs")
 async def get_logs(limit: int = 200, user: dict = Depends(dependencies.get_current_admin_user)) -> LogsResponse:
     """
     Retorna últimos logs (se o backend expuser). Fallback para vazio.
     Integra com services.get_recent_logs(limit) -> [ { ts, level, message, meta } ]
     """
-    rows = _safe("get_recent_logs", int(limit)) or []
+    rows = await run_in_threadpool(_safe, "get_recent_logs", int(limit)) or []
     items: List[LogEntry] = []
     if isinstance(rows, list):
         for r in rows:
@@ -204,3 +228,62 @@ async def health(user: dict = Depends(dependencies.get_current_admin_user)) -> H
     Health simples da aplicação (somente admin na API para evitar exposição).
     """
     return HealthResponse()
+
+
+@router.get("/reference-data", response_model=ReferenceDataResponse, summary="Idade dos dados de referência")
+async def reference_data_status(user: dict = Depends(dependencies.get_current_admin_user)) -> ReferenceDataResponse:
+    """
+    Idade/geração de cada conjunto de dados de referência, estatísticas dos
+    namespaces de cache e estado dos índices incrementais.
+    """
+    indexes = {**incremental.status(), "lucro_mensal": rollups.status(), "campanhas": interval_index.status()}
+    return ReferenceDataResponse(datasets=reference_data.status(), cache=cache.stats(), indexes=indexes)
+
+
+@router.get("/compression", summary="Estatísticas de compressão das respostas")
+async def compression_stats(user: dict = Depends(dependencies.get_current_admin_user)) -> Dict[str, Any]:
+    """
+    Bytes antes/depois, razão e tempo gasto comprimindo, por encoding.
+    """
+    return {"encodings": compression.stats()}
+
+
+async def _metrics_reader(request: Request) -> None:
+    # Coletor do Prometheus com METRICS_TOKEN; sem o token, sessão de admin
+    if metrics.METRICS_TOKEN:
+        expected = f"Bearer {metrics.METRICS_TOKEN}".encode()
+        if hmac.compare_digest(request.headers.get("authorization", "").encode(), expected):
+            return
+    user = await dependencies.get_current_user(request)
+    await dependencies.get_current_admin_user(user)
+
+
+@router.get("/metrics", summary="Métricas no formato Prometheus", dependencies=[Depends(_metrics_reader)])
+async def prometheus_metrics() -> Response:
+    """
+    Latência/tamanho por rota, requisições em andamento, atraso do event
+    loop, consultas BigQuery por rota, cache, compressão, jobs e índices.
+    """
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@router.get("/jobs", summary="Jobs agendados")
+async def jobs(user: dict = Depends(dependencies.get_current_admin_user)) -> Dict[str, Any]:
+    """
+    Jobs do agendador: gatilho, próxima execução e histórico das últimas
+    execuções (duração, status, erro).
+    """
+    return {"ativo": scheduler.SCHEDULER_ENABLED, "jobs": scheduler.status()}
+
+
+@router.post("/jobs/{nome}/executar", summary="Executa um job agora")
+async def run_job(nome: str, user: dict = Depends(dependencies.get_current_admin_user)) -> Dict[str, Any]:
+    """
+    Dispara o job fora do horário. Jobs exclusivos continuam respeitando o
+    lease: se outro worker estiver executando, esta execução é pulada.
+    """
+    try:
+        iniciado = scheduler.run_now(nome)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return {"job": nome, "iniciado": iniciado}
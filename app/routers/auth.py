@@ -6,21 +6,22 @@ import time
 from typing import Any, Dict, Optional, List
 from urllib.parse import urlencode
 
-import httpx
 from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, RedirectResponse
 from pydantic import BaseModel, Field
 
-from .. import dependencies
+from .. import dependencies, http_client, oidc, user_directory
 
 router = APIRouter(tags=["Auth"])
 
 # =============================================================================
 # Config / Constantes
 # =============================================================================
-GOOGLE_AUTH_ENDPOINT = "https://accounts.google.com/o/oauth2/v2/auth"
-GOOGLE_TOKEN_ENDPOINT = "https://oauth2.googleapis.com/token"
-GOOGLE_USERINFO_ENDPOINT = "https://www.googleapis.com/oauth2/v3/userinfo"
+# Endpoints sobrescrevíveis por ENV (ex.: servidor OAuth local, ver oauth_stub.py)
+GOOGLE_AUTH_ENDPOINT = os.getenv("GOOGLE_AUTH_ENDPOINT", "https://accounts.google.com/o/oauth2/v2/auth")
+GOOGLE_TOKEN_ENDPOINT = os.getenv("GOOGLE_TOKEN_ENDPOINT", "https://oauth2.googleapis.com/token")
+GOOGLE_USERINFO_ENDPOINT = os.getenv("GOOGLE_USERINFO_ENDPOINT", "https://www.googleapis.com/oauth2/v3/userinfo")
 
 # Leitura de ENV com defaults seguros
 CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
@@ -28,79 +29,23 @@ CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET", "")
 REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI", "") or os.getenv("OAUTH_REDIRECT_URI", "")
 DEFAULT_SUCCESS_REDIRECT = os.getenv("LOGIN_SUCCESS_REDIRECT", "/calculadora")
 
-# Domínios permitidos (CSV) para conceder "autorizado" por domínio
-ALLOWED_DOMAINS = [d.strip().lower() for d in os.getenv("AUTH_ALLOWED_DOMAINS", "").split(",") if d.strip()]
-# Lista de e-mails admin (CSV)
-ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+# Domínios permitidos / e-mails admin (CSV) — lidos em user_directory
+ALLOWED_DOMAINS = user_directory.ALLOWED_DOMAINS
+ADMIN_EMAILS = user_directory.ADMIN_EMAILS
 
 
 # =============================================================================
 # Helpers
 # =============================================================================
-def _services():
-    try:
-        from app import services  # type: ignore
-        return services
-    except Exception:
-        return None
-
-
-def _is_admin(email: str) -> bool:
-    s = _services()
-    email_l = (email or "").strip().lower()
-    if not email_l:
-        return False
-    # prioridade: services
-    try:
-        if s and hasattr(s, "is_admin"):
-            ret = s.is_admin(email_l)
-            if isinstance(ret, bool):
-                return ret
-    except Exception:
-        pass
-    # fallback: ADMIN_EMAILS
-    return email_l in ADMIN_EMAILS
-
-
-def _is_authorized(email: str) -> bool:
-    s = _services()
-    email_l = (email or "").strip().lower()
-    if not email_l:
-        return False
-    # prioridade: services
-    try:
-        if s and hasattr(s, "is_user_authorized"):
-            ret = s.is_user_authorized(email_l)
-            if isinstance(ret, bool):
-                return ret
-    except Exception:
-        pass
-    # fallback: domínio permitido
-    if ALLOWED_DOMAINS:
-        domain = email_l.split("@")[-1]
-        if domain in ALLOWED_DOMAINS:
-            return True
-    # admins sempre autorizados
-    if _is_admin(email_l):
-        return True
-    return False
-
-
-def _enrich_user(email: str, base_profile: Dict[str, Any]) -> Dict[str, Any]:
-    """Usa services.get_user_profile(email) (se existir) para enriquecer name/picture."""
-    s = _services()
+def _enrich_user(entry: Optional[user_directory.UserEntry], base_profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Usa o cadastro do usuário (se existir) para enriquecer name/picture e flags."""
     enriched = dict(base_profile)
-    try:
-        if s and hasattr(s, "get_user_profile"):
-            prof = s.get_user_profile(email) or {}
-            if isinstance(prof, dict):
-                enriched["name"] = prof.get("name") or enriched.get("name")
-                enriched["picture"] = prof.get("picture") or enriched.get("picture")
-                roles = prof.get("roles")
-                if isinstance(roles, list):
-                    enriched["roles"] = roles
-    except Exception:
-        pass
+    if entry is not None:
+        enriched["name"] = entry.nome or enriched.get("name")
+        enriched["picture"] = entry.foto_url or enriched.get("picture")
+        enriched["funcao"] = entry.funcao
+        enriched["role"] = entry.funcao
+        enriched["pode_ver_historico"] = entry.pode_ver_historico
     return enriched
 
 
@@ -112,19 +57,53 @@ def _require_oauth_config():
         )
 
 
+async def _fetch_userinfo(access_token: str) -> Dict[str, Any]:
+    try:
+        ui_res = await http_client.get_client().get(
+            GOOGLE_USERINFO_ENDPOINT,
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        if ui_res.status_code != 200:
+            raise HTTPException(status_code=400, detail=f"Falha ao buscar perfil: {ui_res.text}")
+        return ui_res.json()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Erro de rede/userinfo: {e}")
+
+
+async def _profile_from_tokens(token_data: Dict[str, Any], nonce: Optional[str]) -> Dict[str, Any]:
+    """
+    Perfil do usuário a partir do id_token, verificado localmente contra as
+    chaves do Google em cache. Só chama o endpoint de userinfo se não vier
+    id_token ou se as chaves não puderem ser obtidas.
+    """
+    id_token = token_data.get("id_token")
+    if id_token:
+        try:
+            return await oidc.verify_id_token(id_token, audience=CLIENT_ID, nonce=nonce)
+        except oidc.IdTokenError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            print(f"AVISO: verificação local do id_token indisponível ({e}); usando userinfo.")
+    return await _fetch_userinfo(token_data["access_token"])
+
+
 def _session_user_from_google_info(info: Dict[str, Any]) -> Dict[str, Any]:
     email = info.get("email", "")
     name = info.get("name") or info.get("given_name") or email.split("@")[0]
     picture = info.get("picture")
     profile = {"email": email, "name": name, "picture": picture}
 
-    # enriquecer / decidir flags
-    profile = _enrich_user(email, profile)
-    profile["is_admin"] = _is_admin(email)
-    profile["autorizado"] = _is_authorized(email)
+    # Um único registro do usuário decide tudo (ver user_directory)
+    entry = user_directory.load_user(email)
+    profile = _enrich_user(entry, profile)
+    profile["is_admin"] = user_directory.is_admin(email, entry)
+    profile["autorizado"] = user_directory.is_authorized(email, entry)
     profile["authorized"] = profile["autorizado"]  # compat
     if "roles" not in profile:
         profile["roles"] = ["admin"] if profile["is_admin"] else ["user"]
+    profile.setdefault("role", "admin" if profile["is_admin"] else "usuario")
     return profile
 
 
@@ -149,6 +128,10 @@ async def auth_status(request: Request) -> AuthStatus:
     user = request.session.get("user")
     if not user:
         return AuthStatus(authenticated=False, user=None)
+    # flags atuais do diretório (revogações/mudanças de papel)
+    overrides = user_directory.session_overrides(user)
+    if overrides is not None:
+        user = {**user, **overrides}
     # garante as chaves padronizadas
     user["autorizado"] = bool(user.get("autorizado") or user.get("authorized") or False)
     user["authorized"] = user["autorizado"]
@@ -184,7 +167,9 @@ async def login(request: Request, action: Optional[str] = None):
 
     # CSRF 'state'
     state = os.urandom(12).hex()
+    nonce = os.urandom(12).hex()
     request.session["oauth_state"] = state
+    request.session["oauth_nonce"] = nonce
     request.session["post_login_redirect"] = request.query_params.get("next") or DEFAULT_SUCCESS_REDIRECT
 
     scopes = [
@@ -203,6 +188,7 @@ async def login(request: Request, action: Optional[str] = None):
         "include_granted_scopes": "true",
         "prompt": "consent",
         "state": state,
+        "nonce": nonce,
     }
     auth_url = f"{GOOGLE_AUTH_ENDPOINT}?{urlencode(params)}"
     return RedirectResponse(url=auth_url, status_code=302)
@@ -224,24 +210,23 @@ async def oauth_callback(request: Request, code: Optional[str] = None, state: Op
     if not code:
         raise HTTPException(status_code=400, detail="Código OAuth ausente.")
 
-    # Troca 'code' por tokens
+    # Troca 'code' por tokens (cliente HTTP compartilhado: conexão já aberta)
     token_data: Dict[str, Any]
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            token_res = await client.post(
-                GOOGLE_TOKEN_ENDPOINT,
-                data={
-                    "code": code,
-                    "client_id": CLIENT_ID,
-                    "client_secret": CLIENT_SECRET,
-                    "redirect_uri": REDIRECT_URI,
-                    "grant_type": "authorization_code",
-                },
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-            )
-            if token_res.status_code != 200:
-                raise HTTPException(status_code=400, detail=f"Falha ao obter token: {token_res.text}")
-            token_data = token_res.json()
+        token_res = await http_client.get_client().post(
+            GOOGLE_TOKEN_ENDPOINT,
+            data={
+                "code": code,
+                "client_id": CLIENT_ID,
+                "client_secret": CLIENT_SECRET,
+                "redirect_uri": REDIRECT_URI,
+                "grant_type": "authorization_code",
+            },
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        if token_res.status_code != 200:
+            raise HTTPException(status_code=400, detail=f"Falha ao obter token: {token_res.text}")
+        token_data = token_res.json()
     except HTTPException:
         raise
     except Exception as e:
@@ -251,26 +236,13 @@ async def oauth_callback(request: Request, code: Optional[str] = None, state: Op
     if not access_token:
         raise HTTPException(status_code=400, detail="Token inválido recebido.")
 
-    # Busca userinfo
-    try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            ui_res = await client.get(
-                GOOGLE_USERINFO_ENDPOINT,
-                headers={"Authorization": f"Bearer {access_token}"},
-            )
-            if ui_res.status_code != 200:
-                raise HTTPException(status_code=400, detail=f"Falha ao buscar perfil: {ui_res.text}")
-            info = ui_res.json()
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro de rede/userinfo: {e}")
+    info = await _profile_from_tokens(token_data, request.session.pop("oauth_nonce", None))
 
     if not info.get("email_verified", True):
         raise HTTPException(status_code=403, detail="E-mail Google não verificado.")
 
     # Monta o usuário da sessão
-    session_user = _session_user_from_google_info(info)
+    session_user = await run_in_threadpool(_session_user_from_google_info, info)
     request.session["user"] = session_user
     # limpeza de estado
     request.session.pop("oauth_state", None)
@@ -1,11 +1,13 @@
 # app/routers/campanhas.py
 from __future__ import annotations
 
-from typing import List, Dict, Any
+from datetime import date
+from typing import List, Dict, Any, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 
-from .. import models, services, dependencies
+from .. import models, services, dependencies, interval_index, reference_data
+from ..serialization import json_response
 
 
 router = APIRouter(
@@ -46,7 +48,7 @@ async def get_campanhas(
     """
     try:
         rows = services.get_all_campaigns() or []
-        return [_coerce_campaign_row(r) for r in rows]
+        return json_response([_coerce_campaign_row(r) for r in rows])
     except Exception as e:
         services.logger.error(f"Erro ao listar campanhas: {e}", exc_info=True)
         # Evita 500, informa causa ao cliente
@@ -54,13 +56,29 @@ async def get_campanhas(
 
 
 @router.post("", summary="Salva/atualiza campanhas (admin)", status_code=200)
-async def save_campanhas(
+def save_campanhas(
     payload: List[models.CampanhaML],
     user: dict = Depends(dependencies.get_current_admin_user),
 ):
-    """Salva/atualiza todas as campanhas. Substitui o conjunto atual pelo enviado."""
+    """Salva/atualiza todas as campanhas. Substitui o conjunto atual pelo enviado.
+    Recusa (400) datas que deixariam uma precificação base em duas campanhas sobrepostas.
+    """
+    campaigns_list = [c.model_dump() for c in payload]
+    try:
+        conflitos = interval_index.campaign_update_conflicts(interval_index.get(), campaigns_list)
+    except Exception as e:
+        print(f"AVISO: não foi possível validar sobreposição de campanhas: {e}")
+        conflitos = []
+    if conflitos:
+        exemplos = "; ".join(
+            f"SKU {c['sku'] or c['precificacao_base_id']}: {c['campanha']} × {c['conflita_com']}" for c in conflitos[:5]
+        )
+        mais = f" (+{len(conflitos) - 5})" if len(conflitos) > 5 else ""
+        raise HTTPException(
+            status_code=400,
+            detail=f"As datas informadas sobrepõem campanhas na mesma precificação: {exemplos}{mais}.",
+        )
     try:
-        campaigns_list = [c.model_dump() for c in payload]
         services.save_all_campaigns(campaigns_list)
         services.log_action(user.get("email", "unknown@local"), "UPDATE_CAMPAIGNS")
         return {"message": "Campanhas atualizadas com sucesso."}
@@ -73,8 +91,42 @@ async def save_campanhas(
 async def get_active_campaigns_api(user: dict = Depends(dependencies.get_current_user)):
     """Recupera campanhas ativas para uso geral (não requer admin)."""
     try:
-        rows = services.get_active_campaigns() or []
-        return [_coerce_campaign_row(r) for r in rows]
+        rows = await reference_data.aget("campanhas_ativas") or []
+        return json_response([_coerce_campaign_row(r) for r in rows])
     except Exception as e:
         services.logger.error(f"Erro ao listar campanhas ativas: {e}", exc_info=True)
         raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/sobrepostas", summary="Campanhas que cruzam um período")
+def get_campanhas_no_periodo(
+    inicio: date = Query(...),
+    fim: Optional[date] = Query(None, description="Padrão: igual a `inicio` (campanhas ativas nessa data)"),
+    user: dict = Depends(dependencies.get_current_user),
+):
+    """Campanhas cujo período cruza [inicio, fim] — com só `inicio`, as ativas naquela data."""
+    if fim is not None and fim < inicio:
+        raise HTTPException(status_code=400, detail="'fim' deve ser igual ou posterior a 'inicio'.")
+    index = interval_index.get()
+    rows = index.active_at(inicio) if fim is None else index.overlapping(inicio, fim)
+    return json_response([_coerce_campaign_row(r) for r in rows])
+
+
+@router.get("/conflitos", summary="Vínculos de campanha de um SKU num período")
+def get_conflitos_campanha(
+    inicio: date = Query(...),
+    fim: date = Query(...),
+    sku: Optional[str] = None,
+    base_id: Optional[str] = None,
+    user: dict = Depends(dependencies.get_current_user),
+):
+    """
+    Vínculos campanha × precificação do SKU (ou da precificação base) cujo
+    período cruza [inicio, fim] — o que impediria um novo vínculo nessas datas.
+    """
+    if not (sku or base_id):
+        raise HTTPException(status_code=400, detail="Informe 'sku' ou 'base_id'.")
+    if fim < inicio:
+        raise HTTPException(status_code=400, detail="'fim' deve ser igual ou posterior a 'inicio'.")
+    rows = interval_index.get().conflicts(inicio, fim, base_id=base_id, sku=sku)
+    return json_response(rows)
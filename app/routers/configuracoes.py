@@ -5,9 +5,11 @@ from typing import List, Dict, Any, Optional
 from pathlib import Path
 
 from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 
-from .. import dependencies
+from .. import dependencies, reference_data
+from ..pricing import normalize_loja_config
+from ..serialization import raw_json_response
 
 router = APIRouter(prefix="/api/config", tags=["Configurações"])
 
@@ -37,6 +39,9 @@ class LojaDetalhes(BaseModel):
     comissoes: List[ComissaoRegra] = Field(default_factory=list)
 
 
+_LOJA_ITEMS = TypeAdapter(List[LojaItem])
+
+
 # =============================================================================
 # Helpers seguros (integração com services + fallbacks)
 # =============================================================================
@@ -48,20 +53,18 @@ def _try_import_services():
         return None
 
 
-def _safe_list_lojas() -> List[Dict[str, Any]]:
+async def _safe_list_lojas() -> List[Dict[str, Any]]:
     """
-    Busca lista de lojas via services.get_stores(), se existir.
+    Busca lista de lojas nos dados de referência (lojas_config em memória).
     Normaliza as chaves esperadas pelo front + validação pydantic.
     """
-    services = _try_import_services()
     raw_rows: List[Dict[str, Any]] = []
-    if services and hasattr(services, "get_stores"):
-        try:
-            rows = services.get_stores() or []
-            if isinstance(rows, list):
-                raw_rows = rows
-        except Exception:
-            raw_rows = []
+    try:
+        rows = await reference_data.aget("lojas") or []
+        if isinstance(rows, list):
+            raw_rows = rows
+    except Exception:
+        raw_rows = []
 
     # Se não houver fonte, devolve lista vazia (nunca 500)
     out: List[Dict[str, Any]] = []
@@ -94,8 +97,8 @@ def _safe_list_lojas() -> List[Dict[str, Any]]:
 
 def _safe_loja_detalhes(store_id: str) -> LojaDetalhes:
     """
-    Busca detalhes de loja via services.get_store_details(id), se existir.
-    Fallback seguro para defaults.
+    Busca detalhes de loja via services.get_store_details(id) (normalizados e
+    em cache). Fallback seguro para defaults.
     """
     services = _try_import_services()
     detalhe: Dict[str, Any] = {}
@@ -107,23 +110,8 @@ def _safe_loja_detalhes(store_id: str) -> LojaDetalhes:
         except Exception:
             detalhe = {}
 
-    # Normalização/compatibilidade
-    aliquota_padrao = float(detalhe.get("aliquota_padrao") or detalhe.get("aliquota") or 0.0)
-    aliquota_fulfillment = float(detalhe.get("aliquota_fulfillment") or detalhe.get("aliquota_ff") or 0.0)
-
-    comissoes_raw = detalhe.get("comissoes") or []
-    comissoes: List[Dict[str, Any]] = []
-    if isinstance(comissoes_raw, list):
-        for c in comissoes_raw:
-            if not isinstance(c, dict):
-                continue
-            comissoes.append(
-                {
-                    "chave": str(c.get("chave") or c.get("nome") or "padrao"),
-                    "classico": float(c.get("classico") or c.get("taxa_classico") or 0.0),
-                    "premium": float(c.get("premium") or c.get("taxa_premium") or 0.0),
-                }
-            )
+    # Normalização/compatibilidade (idempotente sobre o retorno de services)
+    config = normalize_loja_config(detalhe)
 
     # Alguns metadados úteis
     id_loja = detalhe.get("id_loja")
@@ -134,9 +122,9 @@ def _safe_loja_detalhes(store_id: str) -> LojaDetalhes:
         id=store_id,
         marketplace=marketplace,
         id_loja=id_loja,
-        aliquota_padrao=aliquota_padrao,
-        aliquota_fulfillment=aliquota_fulfillment,
-        comissoes=[ComissaoRegra(**c) for c in comissoes],
+        aliquota_padrao=config["aliquota_padrao"],
+        aliquota_fulfillment=config["aliquota_fulfillment"],
+        comissoes=[ComissaoRegra(**c) for c in config["comissoes"]],
     )
 
 
@@ -149,16 +137,16 @@ async def list_lojas(user: dict = Depends(dependencies.get_current_user)) -> Lis
     Lista de lojas. Inclui a chave `nome` (compatibilidade com validação/UI).
     """
     try:
-      lojas = _safe_list_lojas()
-      # Validação Pydantic aqui garante formato consistente
-      return [LojaItem(**x) for x in lojas]
+      lojas = await _safe_list_lojas()
+      # Validação Pydantic (em lote) garante formato consistente
+      return raw_json_response(_LOJA_ITEMS.dump_json(_LOJA_ITEMS.validate_python(lojas)))
     except Exception as e:
       # Nunca quebrar com 500 por formato inesperado
       raise HTTPException(status_code=400, detail=f"Falha ao listar lojas: {e}")
 
 
 @router.get("/lojas/{store_id}/detalhes", response_model=LojaDetalhes, summary="Detalhes de uma loja")
-async def loja_detalhes(store_id: str, user: dict = Depends(dependencies.get_current_user)) -> LojaDetalhes:
+def loja_detalhes(store_id: str, user: dict = Depends(dependencies.get_current_user)) -> LojaDetalhes:
     """
     Detalhes de loja (comissões e alíquotas). Estrutura compatível com o front.
     """
@@ -1,11 +1,15 @@
 # app/routers/dashboard.py
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 
-from .. import dependencies
+from .. import dashboard_snapshot, dependencies, incremental, rollups
+from ..serialization import json_response
 
 router = APIRouter(prefix="/api/dashboard", tags=["Dashboard"])
 
@@ -33,24 +37,6 @@ def _log_warning(msg: str):
     print(f"AVISO: {msg}")
 
 
-def _safe_call(fn_name: str, *args, **kwargs):
-    """
-    Chama uma função do app.services, se existir; caso contrário, retorna None.
-    Nunca propaga exceção (converte em None + warning).
-    """
-    services = _try_import_services()
-    if not services:
-        return None
-    fn = getattr(services, fn_name, None)
-    if not callable(fn):
-        return None
-    try:
-        return fn(*args, **kwargs)
-    except Exception as e:
-        _log_warning(f"Falha em services.{fn_name}: {e}")
-        return None
-
-
 # =============================================================================
 # Normalizadores – evitam quebraz na UI
 # =============================================================================
@@ -95,6 +81,73 @@ def _norm_chart_point(label: Any, value: Any) -> Dict[str, Any]:
     return {"label": str(label), "value": v}
 
 
+# =============================================================================
+# Montagem das seções (usadas pelos endpoints individuais e pelo /bundle)
+# =============================================================================
+_MES = r"^\d{4}-\d{2}$"
+_NOMES_MESES = ["Jan", "Fev", "Mar", "Abr", "Mai", "Jun", "Jul", "Ago", "Set", "Out", "Nov", "Dez"]
+
+
+def _pretty_month(mes: Optional[str]) -> str:
+    mes = str(mes or "")
+    if len(mes) == 7 and mes[4] == "-":  # YYYY-MM
+        ano, m = mes.split("-")
+        try:
+            idx = int(m) - 1
+            if 0 <= idx < 12:
+                return f"{_NOMES_MESES[idx]}/{ano}"
+        except Exception:
+            pass
+    return mes or "—"
+
+
+def _alertas_payload(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    secoes = snapshot.get("secoes") or {}
+
+    def rows(name: str) -> List[Dict[str, Any]]:
+        return [r for r in secoes.get(name) or [] if isinstance(r, dict)]
+
+    return {
+        "campanhas_expirando": [_norm_alert_campanha(r) for r in rows("campanhas_expirando")],
+        "custos_desatualizados": [_norm_alert_custo(r) for r in rows("custos_desatualizados")],
+        "produtos_estagnados": [_norm_alert_estagnado(r) for r in rows("produtos_estagnados")],
+        "gerado_em": snapshot.get("gerado_em"),
+        "erros": snapshot.get("erros") or {},
+    }
+
+
+def _rentabilidade_payload(**filtros) -> Dict[str, Any]:
+    rows = rollups.query(group_by=("categoria",), **filtros)
+    rows = sorted((r for r in rows if r["categoria"] is not None), key=lambda r: r["lucro"], reverse=True)
+    return {"data": [_norm_chart_point(r["categoria"], r["lucro"]) for r in rows]}
+
+
+def _evolucao_payload(meses: int, inicio: Optional[str], fim: Optional[str], **filtros) -> Dict[str, Any]:
+    if not inicio:
+        inicio = rollups.shift_month(fim or rollups.current_month(), -meses)
+    rows = rollups.query(group_by=("mes",), inicio=inicio, fim=fim, **filtros)
+    return {"data": [_norm_chart_point(_pretty_month(r["mes"]), r["lucro"]) for r in rows]}
+
+
+def _alertas_section() -> Dict[str, Any]:
+    return _alertas_payload(dashboard_snapshot.get() or {})
+
+
+def _lucro_payload(group_by: Tuple[str, ...], **filtros) -> Dict[str, Any]:
+    return {"data": rollups.query(group_by=group_by, **filtros)}
+
+
+def _soft(fn, *args, **kwargs) -> Dict[str, Any]:
+    """Endpoints individuais: erro de parâmetro vira 400; falha de dados vira lista vazia."""
+    try:
+        return fn(*args, **kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        _log_warning(f"Cubo de lucro indisponível: {e}")
+        return {"data": []}
+
+
 # =============================================================================
 # Endpoints – compatíveis com Alertas.html
 # =============================================================================
@@ -105,85 +158,165 @@ async def get_dashboard_alertas(user: dict = Depends(dependencies.get_current_us
       - campanhas_expirando (7 dias)
       - custos_desatualizados
       - produtos_estagnados (+90 dias)
-    Nunca retorna 500; no pior caso, devolve listas vazias.
+    Servidos do snapshot em memória (ver dashboard_snapshot.py), com a data
+    em que foi gerado. Nunca retorna 500; no pior caso, devolve listas vazias.
     """
-    # Campanhas expirando (7 dias)
-    rows_campanhas = _safe_call("get_campaigns_expiring", 7) or []
-    campanhas_expirando = [_norm_alert_campanha(r) for r in rows_campanhas if isinstance(r, dict)]
-
-    # Custos desatualizados
-    rows_custos = _safe_call("get_outdated_costs") or []
-    custos_desatualizados = [_norm_alert_custo(r) for r in rows_custos if isinstance(r, dict)]
-
-    # Produtos estagnados (+90 dias) – se a query/fonte não tiver 'data_cadastro', não quebrar
-    produtos_estagnados: List[Dict[str, Any]] = []
-    rows_estagnados = _safe_call("get_stagnant_products", 90)
-    if isinstance(rows_estagnados, list):
-        produtos_estagnados = [_norm_alert_estagnado(r) for r in rows_estagnados if isinstance(r, dict)]
-    else:
-        # manter compat com o seu log e não derrubar a rota
-        _log_warning(
-            "Não foi possível buscar produtos estagnados. "
-            "Verifique se a consulta possui as colunas esperadas (ex.: data_ultima_venda)."
-        )
+    try:
+        snapshot = await dashboard_snapshot.aget() or {}
+    except Exception as e:
+        _log_warning(f"Snapshot do dashboard indisponível: {e}")
+        snapshot = {}
+    return json_response(_alertas_payload(snapshot))
 
-    return {
-        "campanhas_expirando": campanhas_expirando,
-        "custos_desatualizados": custos_desatualizados,
-        "produtos_estagnados": produtos_estagnados,
-    }
+
+@router.get("/estagnados")
+def get_produtos_estagnados(
+    dias: int = Query(90, ge=1, le=3650),
+    limit: Optional[int] = Query(50, ge=1, le=10000),
+    user: dict = Depends(dependencies.get_current_user),
+):
+    """
+    Produtos ativos sem venda há `dias` dias ou mais (qualquer limiar),
+    filtrados do índice incremental de última venda (ver incremental.py).
+    """
+    try:
+        rows = incremental.stagnant_products(dias, limit)
+    except Exception as e:
+        _log_warning(f"Índice de última venda indisponível: {e}")
+        raise HTTPException(status_code=500, detail="Não foi possível calcular os produtos estagnados.")
+    return json_response({
+        "dias": dias,
+        "produtos_estagnados": [_norm_alert_estagnado(r) for r in rows],
+    })
+
+
+@router.get("/custos-desatualizados")
+def get_custos_desatualizados(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=1000),
+    user: dict = Depends(dependencies.get_current_user),
+):
+    """
+    Lista completa (paginada) de SKUs cuja última precificação usa custo
+    diferente do cadastro, com o impacto no lucro e na margem por plano.
+    Cruzamento dos índices incrementais de produtos e precificações.
+    """
+    try:
+        result = incremental.cost_drift(page, page_size)
+    except Exception as e:
+        _log_warning(f"Índices de custo indisponíveis: {e}")
+        raise HTTPException(status_code=500, detail="Não foi possível calcular os custos desatualizados.")
+    return json_response({"page": page, "page_size": page_size, **result})
 
 
 @router.get("/rentabilidade-categoria")
-async def get_rentabilidade_categoria(user: dict = Depends(dependencies.get_current_user)):
+def get_rentabilidade_categoria(
+    inicio: Optional[str] = Query(None, pattern=_MES),
+    fim: Optional[str] = Query(None, pattern=_MES),
+    marketplace: Optional[str] = None,
+    id_loja: Optional[str] = None,
+    user: dict = Depends(dependencies.get_current_user),
+):
     """
-    Dados para o gráfico de rosca (doughnut) em Alertas.html.
+    Dados para o gráfico de rosca (doughnut) em Alertas.html, do cubo de
+    lucro (ver rollups.py). Sem `inicio`/`fim`, considera todo o período.
     Resposta:
       { "data": [ { "label": "<categoria>", "value": <lucro_total> }, ... ] }
     """
-    rows = _safe_call("get_profit_by_category") or []
-    # Aceita formatos comuns: [{'categoria': 'A', 'lucro': 123.4}, ...]
-    data = []
-    for r in rows:
-        if not isinstance(r, dict):
-            continue
-        label = r.get("categoria") or r.get("label") or r.get("nome") or "—"
-        value = r.get("lucro") or r.get("valor") or r.get("value") or 0
-        data.append(_norm_chart_point(label, value))
-    return {"data": data}
+    return json_response(
+        _soft(_rentabilidade_payload, inicio=inicio, fim=fim, marketplace=marketplace, id_loja=id_loja)
+    )
 
 
 @router.get("/evolucao-lucro")
-async def get_evolucao_lucro(user: dict = Depends(dependencies.get_current_user)):
+def get_evolucao_lucro(
+    meses: int = Query(6, ge=1, le=120),
+    inicio: Optional[str] = Query(None, pattern=_MES),
+    fim: Optional[str] = Query(None, pattern=_MES),
+    categoria: Optional[str] = None,
+    marketplace: Optional[str] = None,
+    id_loja: Optional[str] = None,
+    user: dict = Depends(dependencies.get_current_user),
+):
     """
-    Dados para o gráfico de linha (evolução dos últimos meses) em Alertas.html.
+    Dados para o gráfico de linha (evolução mensal) em Alertas.html.
+    Janela: `inicio`..`fim` ('YYYY-MM') ou, sem `inicio`, os últimos `meses`.
     Resposta:
       { "data": [ { "label": "<MMM/AAAA>", "value": <lucro_mensal> }, ... ] }
     """
-    rows = _safe_call("get_profit_evolution") or []
-    # Aceita formatos: [{'mes': '2025-07', 'lucro': 1000.0}, {'label': 'Jul/2025', 'value': 1000.0}, ...]
-    def pretty_label(r: Dict[str, Any]) -> str:
-        if r.get("label"):
-            return str(r["label"])
-        if r.get("mes_formatado"):
-            return str(r["mes_formatado"])
-        mes = str(r.get("mes") or r.get("periodo") or "")
-        if len(mes) == 7 and mes[4] == "-":  # YYYY-MM
-            ano, m = mes.split("-")
-            nomes = ["Jan", "Fev", "Mar", "Abr", "Mai", "Jun", "Jul", "Ago", "Set", "Out", "Nov", "Dez"]
-            try:
-                idx = int(m) - 1
-                if 0 <= idx < 12:
-                    return f"{nomes[idx]}/{ano}"
-            except Exception:
-                pass
-        return mes or "—"
-
-    data = []
-    for r in rows:
-        if not isinstance(r, dict):
-            continue
-        label = pretty_label(r)
-        value = r.get("lucro") or r.get("valor") or r.get("value") or 0
-        data.append(_norm_chart_point(label, value))
-    return {"data": data}
+    return json_response(
+        _soft(
+            _evolucao_payload, meses, inicio, fim, categoria=categoria, marketplace=marketplace, id_loja=id_loja
+        )
+    )
+
+
+@router.get("/lucro")
+def get_lucro_drilldown(
+    group_by: str = Query("mes", description="Dimensões separadas por vírgula: mes, categoria, marketplace, id_loja"),
+    inicio: Optional[str] = Query(None, pattern=_MES),
+    fim: Optional[str] = Query(None, pattern=_MES),
+    categoria: Optional[str] = None,
+    marketplace: Optional[str] = None,
+    id_loja: Optional[str] = None,
+    user: dict = Depends(dependencies.get_current_user),
+):
+    """
+    Drill-down do lucro: soma e quantidade de precificações agrupadas pelas
+    dimensões pedidas, com filtros. Respondido do cubo em memória.
+    """
+    dims = tuple(d.strip() for d in group_by.split(",") if d.strip())
+    payload = _soft(
+        _lucro_payload, dims, inicio=inicio, fim=fim, categoria=categoria, marketplace=marketplace, id_loja=id_loja
+    )
+    return json_response({"group_by": list(dims), **payload})
+
+
+# =============================================================================
+# Bundle – a página de alertas inteira numa requisição
+# =============================================================================
+async def _timed_section(name: str, fn: Callable[..., Any], *args, **kwargs) -> Tuple[str, Any, Optional[str], float]:
+    t0 = time.perf_counter()
+    try:
+        data = await run_in_threadpool(fn, *args, **kwargs)
+        erro = None
+    except Exception as e:
+        _log_warning(f"Falha na seção '{name}' do bundle do dashboard: {e}")
+        data, erro = None, f"{type(e).__name__}: {e}"
+    return name, data, erro, round((time.perf_counter() - t0) * 1000, 2)
+
+
+@router.get("/bundle")
+async def get_dashboard_bundle(
+    meses: int = Query(6, ge=1, le=120),
+    inicio: Optional[str] = Query(None, pattern=_MES),
+    fim: Optional[str] = Query(None, pattern=_MES),
+    marketplace: Optional[str] = None,
+    id_loja: Optional[str] = None,
+    user: dict = Depends(dependencies.get_current_user),
+):
+    """
+    Alertas + rentabilidade por categoria + evolução do lucro numa única
+    resposta. As seções rodam em paralelo; os dois gráficos leem o mesmo
+    cubo de lucro. Cada seção tem seu tempo (também no header
+    Server-Timing) e, se falhar, vem como null com o erro em `erros` — as
+    demais seguem normalmente.
+    """
+    filtros = {"marketplace": marketplace, "id_loja": id_loja}
+    results = await asyncio.gather(
+        _timed_section("alertas", _alertas_section),
+        _timed_section("rentabilidade_categoria", _rentabilidade_payload, inicio=inicio, fim=fim, **filtros),
+        _timed_section("evolucao_lucro", _evolucao_payload, meses, inicio, fim, **filtros),
+    )
+    payload: Dict[str, Any] = {}
+    timings: Dict[str, float] = {}
+    erros: Dict[str, str] = {}
+    for name, data, erro, ms in results:
+        payload[name] = data
+        timings[name] = ms
+        if erro:
+            erros[name] = erro
+    payload["timings_ms"] = timings
+    payload["erros"] = erros
+    server_timing = ", ".join(f"{name};dur={ms}" for name, ms in timings.items())
+    return json_response(payload, headers={"Server-Timing": server_timing})
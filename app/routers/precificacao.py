@@ -1,12 +1,25 @@
 # app/routers/precificacao.py
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional, Tuple
-
-from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel, Field
-
-from .. import dependencies
+import os
+import tempfile
+from typing import Any, Dict, List, Literal, Optional, Tuple
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter
+
+from .. import bulk_import, campaign_batch, dependencies, interval_index, reference_data
+from ..export import iter_csv, iter_parquet, parquet_available
+from ..pricing import normalize_loja_config
+from ..serialization import (
+    NDJSON_MEDIA_TYPE,
+    json_response,
+    raw_json_response,
+    streaming_json_response,
+    wants_ndjson,
+)
 
 router = APIRouter(prefix="/api/precificacao", tags=["Precificação"])
 
@@ -192,68 +205,69 @@ def _norm_produto(row: Dict[str, Any]) -> ProdutoInfo:
 
 
 def _norm_loja_config(raw: Dict[str, Any]) -> LojaConfig:
-    comissoes: List[Dict[str, Any]] = []
-    for c in raw.get("comissoes") or []:
-        if isinstance(c, dict):
-            comissoes.append(
-                {
-                    "chave": str(c.get("chave") or c.get("nome") or "padrao"),
-                    "classico": float(c.get("classico") or c.get("taxa_classico") or 0.0),
-                    "premium": float(c.get("premium") or c.get("taxa_premium") or 0.0),
-                }
-            )
-    return LojaConfig(
-        aliquota_padrao=float(raw.get("aliquota_padrao") or raw.get("aliquota") or 0.0),
-        aliquota_fulfillment=float(raw.get("aliquota_fulfillment") or raw.get("aliquota_ff") or 0.0),
-        comissoes=comissoes,
-    )
+    return LojaConfig(**normalize_loja_config(raw))
 
 
-def _norm_base_item(row: Dict[str, Any]) -> PrecificacaoBaseItem:
-    # Normaliza para o shape esperado pelo front
+def _norm_base_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    # Normaliza para o shape esperado pelo front (a validação é feita em lote)
     def fnum(v, default=0.0):
         try:
             return float(v)
         except Exception:
             return default
 
-    return PrecificacaoBaseItem(
-        id=row.get("id"),
-        marketplace=str(row.get("marketplace") or ""),
-        id_loja=str(row.get("id_loja") or ""),
-        sku=str(row.get("sku") or ""),
-        titulo=row.get("titulo"),
-
-        categoria_precificacao=row.get("categoria_precificacao"),
-
-        quantidade=int(row.get("quantidade") or 1),
-        custo_unitario=fnum(row.get("custo_unitario")),
-        custo_total=fnum(row.get("custo_total")),
-
-        aliquota=fnum(row.get("aliquota")),
-        parcelamento=fnum(row.get("parcelamento")),
-        outros=fnum(row.get("outros")),
-        regra_comissao=row.get("regra_comissao"),
-        fulfillment=bool(row.get("fulfillment") or False),
-        catalogo_buybox=bool(row.get("catalogo_buybox") or False),
-
-        venda_classico=fnum(row.get("venda_classico")),
-        frete_classico=fnum(row.get("frete_classico")),
-        repasse_classico=fnum(row.get("repasse_classico")),
-        lucro_classico=fnum(row.get("lucro_classico")),
-        margem_classico=fnum(row.get("margem_classico")),
-        tarifa_fixa_classico=fnum(row.get("tarifa_fixa_classico")),
-
-        venda_premium=fnum(row.get("venda_premium")),
-        frete_premium=fnum(row.get("frete_premium")),
-        repasse_premium=fnum(row.get("repasse_premium")),
-        lucro_premium=fnum(row.get("lucro_premium")),
-        margem_premium=fnum(row.get("margem_premium")),
-        tarifa_fixa_premium=fnum(row.get("tarifa_fixa_premium")),
+    return {
+        "id": row.get("id"),
+        "marketplace": str(row.get("marketplace") or ""),
+        "id_loja": str(row.get("id_loja") or ""),
+        "sku": str(row.get("sku") or ""),
+        "titulo": row.get("titulo"),
+
+        "categoria_precificacao": row.get("categoria_precificacao"),
+
+        "quantidade": int(row.get("quantidade") or 1),
+        "custo_unitario": fnum(row.get("custo_unitario")),
+        "custo_total": fnum(row.get("custo_total")),
+
+        "aliquota": fnum(row.get("aliquota")),
+        "parcelamento": fnum(row.get("parcelamento")),
+        "outros": fnum(row.get("outros")),
+        "regra_comissao": row.get("regra_comissao"),
+        "fulfillment": bool(row.get("fulfillment") or False),
+        "catalogo_buybox": bool(row.get("catalogo_buybox") or False),
+
+        "venda_classico": fnum(row.get("venda_classico")),
+        "frete_classico": fnum(row.get("frete_classico")),
+        "repasse_classico": fnum(row.get("repasse_classico")),
+        "lucro_classico": fnum(row.get("lucro_classico")),
+        "margem_classico": fnum(row.get("margem_classico")),
+        "tarifa_fixa_classico": fnum(row.get("tarifa_fixa_classico")),
+
+        "venda_premium": fnum(row.get("venda_premium")),
+        "frete_premium": fnum(row.get("frete_premium")),
+        "repasse_premium": fnum(row.get("repasse_premium")),
+        "lucro_premium": fnum(row.get("lucro_premium")),
+        "margem_premium": fnum(row.get("margem_premium")),
+        "tarifa_fixa_premium": fnum(row.get("tarifa_fixa_premium")),
+
+        "id_sku_marketplace": row.get("id_sku_marketplace"),
+        "id_anuncio": row.get("id_anuncio"),
+    }
 
-        id_sku_marketplace=row.get("id_sku_marketplace"),
-        id_anuncio=row.get("id_anuncio"),
-    )
+
+def _norm_base_item(row: Dict[str, Any]) -> PrecificacaoBaseItem:
+    return PrecificacaoBaseItem.model_validate(_norm_base_row(row))
+
+
+# Validação/serialização em lote (uma chamada ao pydantic-core por página)
+_BASE_ITEMS = TypeAdapter(List[PrecificacaoBaseItem])
+_LIST_RESPONSE = TypeAdapter(PrecificacaoListResponse)
+# Expansões aceitas em `include` na lista
+_LIST_INCLUDES = {"campanhas"}
+
+
+def _norm_base_items(rows: List[Any]) -> List[PrecificacaoBaseItem]:
+    return _BASE_ITEMS.validate_python([_norm_base_row(r) for r in rows if isinstance(r, dict)])
 
 
 # =============================================================================
@@ -264,7 +278,10 @@ async def list_categorias_precificacao(user: dict = Depends(dependencies.get_cur
     """
     Lista categorias com sua margem padrão. Nunca retorna 500 (fallback: []).
     """
-    rows = _safe("get_pricing_categories") or []
+    try:
+        rows = await reference_data.aget("categorias") or []
+    except Exception:
+        rows = []
     out: List[CategoriaPrecificacao] = []
     if isinstance(rows, list):
         for r in rows:
@@ -318,34 +335,153 @@ async def get_dados_para_calculo(
 # =============================================================================
 @router.get("", response_model=PrecificacaoListResponse)
 async def list_precificacao(
+    request: Request,
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=200),
     sku: str = "",
     titulo: str = "",
     plano: str = "",
     categoria: str = "",
+    include: str = Query("", description="Expansões separadas por vírgula: campanhas"),
     user: dict = Depends(dependencies.get_current_user),
 ):
     """
     Lista paginada de precificações base, com filtros simples.
+    Com `Accept: application/x-ndjson`, devolve os itens em streaming (um por linha).
+    Com `include=campanhas`, cada item traz `campanhas` (vínculos da base),
+    buscadas numa única consulta para a página inteira.
+    """
+    includes = {p.strip().lower() for p in include.split(",") if p.strip()}
+    unknown = includes - _LIST_INCLUDES
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Expansão desconhecida: {', '.join(sorted(unknown))}.")
+
+    s = _services()
+    if not s or not hasattr(s, "get_filtered_precificacoes"):
+        raise HTTPException(status_code=500, detail="Lista indisponível: serviço de dados não configurado.")
+    filters = {"sku": sku, "titulo": titulo, "plano": plano, "categoria": categoria}
+    try:
+        result = await run_in_threadpool(s.get_filtered_precificacoes, filters, page, page_size)
+    except Exception as e:
+        _log_warn(f"Falha ao listar precificações: {e}")
+        raise HTTPException(status_code=400, detail=f"Falha ao listar precificações: {e}")
+    total = int(result.total_items or 0)
+    items = _norm_base_items(result.items or [])
+
+    if "campanhas" in includes:
+        rows = _BASE_ITEMS.dump_python(items, mode="json")
+        vinculos = await run_in_threadpool(_safe, "get_linked_campaigns_batch", [r["id"] for r in rows if r.get("id")]) or {}
+        for r in rows:
+            r["campanhas"] = vinculos.get(str(r.get("id")), [])
+        if wants_ndjson(request.headers.get("accept")):
+            return streaming_json_response(rows, ndjson=True, headers={"X-Total-Count": str(total)})
+        return json_response({"items": rows, "page": page, "page_size": page_size, "total": total})
+
+    if wants_ndjson(request.headers.get("accept")):
+        headers = {"X-Total-Count": str(total)}
+        return streaming_json_response(_BASE_ITEMS.dump_python(items, mode="json"), ndjson=True, headers=headers)
+
+    # Já validado acima: serializa direto (sem revalidar via response_model)
+    response = PrecificacaoListResponse.model_construct(items=items, page=page, page_size=page_size, total=total)
+    return raw_json_response(_LIST_RESPONSE.dump_json(response))
+
+
+# =============================================================================
+# Endpoints - Exportação (CSV / Parquet em streaming)
+# =============================================================================
+@router.get("/export")
+async def export_precificacao(
+    format: Literal["csv", "parquet"] = Query("csv"),
+    gzip: bool = Query(False, description="Comprime o CSV (.csv.gz)"),
+    sku: str = "",
+    titulo: str = "",
+    plano: str = "",
+    categoria: str = "",
+    marketplace: str = "",
+    id_loja: str = "",
+    user: dict = Depends(dependencies.get_current_user),
+):
+    """
+    Exporta as precificações com os mesmos filtros da lista.
+    Um único job no BigQuery; as linhas são lidas página a página do iterador
+    e enviadas ao cliente conforme chegam (memória constante).
     """
-    params = {
-        "page": page,
-        "page_size": page_size,
+    s = _services()
+    if not s or not hasattr(s, "query_precificacoes_for_export"):
+        raise HTTPException(status_code=500, detail="Exportação indisponível: serviço de dados não configurado.")
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=400, detail="Exportação Parquet indisponível (pyarrow não instalado).")
+
+    filters = {
         "sku": sku,
         "titulo": titulo,
         "plano": plano,
         "categoria": categoria,
+        "marketplace": marketplace,
+        "id_loja": id_loja,
     }
-    result = _safe("list_precificacao_base", params) or {}
-    items_raw = result.get("items") if isinstance(result, dict) else None
-    total = int(result.get("total") or 0) if isinstance(result, dict) else 0
+    try:
+        rows = await run_in_threadpool(s.query_precificacoes_for_export, filters)
+    except Exception as e:
+        _log_warn(f"Falha ao iniciar exportação: {e}")
+        raise HTTPException(status_code=400, detail=f"Falha ao exportar precificações: {e}")
 
-    items: List[PrecificacaoBaseItem] = []
-    if isinstance(items_raw, list):
-        items = [_norm_base_item(r) for r in items_raw if isinstance(r, dict)]
+    if format == "parquet":
+        headers = {"Content-Disposition": 'attachment; filename="precificacoes.parquet"'}
+        return StreamingResponse(iter_parquet(rows), media_type="application/vnd.apache.parquet", headers=headers)
 
-    return PrecificacaoListResponse(items=items, page=page, page_size=page_size, total=total)
+    columns = [f.name for f in (rows.schema or [])]
+    filename = "precificacoes.csv.gz" if gzip else "precificacoes.csv"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    media_type = "application/gzip" if gzip else "text/csv; charset=utf-8"
+    return StreamingResponse(iter_csv(columns, rows, gzip=gzip), media_type=media_type, headers=headers)
+
+
+# =============================================================================
+# Endpoints - Importação em massa (CSV / XLSX)
+# =============================================================================
+@router.post("/import")
+async def import_precificacao(
+    request: Request,
+    file: UploadFile = File(...),
+    user: dict = Depends(dependencies.get_current_user),
+):
+    """
+    Importa precificações de uma planilha (CSV ou XLSX, uma linha por SKU).
+    Colunas obrigatórias: marketplace, id_loja, sku. Opcionais: quantidade,
+    custo_unitario (padrão: custo do cadastro), categoria_precificacao,
+    venda_classico/venda_premium ou margem_desejada_classico/premium,
+    parcelamento, outros, regra_comissao, fulfillment, catalogo_buybox.
+
+    O processamento roda em segundo plano. Com `Accept: application/x-ndjson`
+    a resposta acompanha o progresso em streaming (a última linha traz o
+    relatório de erros); sem ele, devolve 202 com o id do job para consulta
+    em GET /api/precificacao/import/{job_id}.
+    """
+    filename = file.filename or ""
+    if not filename.lower().endswith(bulk_import.IMPORT_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Formato não suportado. Envie um arquivo .csv ou .xlsx.")
+
+    # Copia o upload para disco em blocos: o job roda depois que a request termina
+    suffix = os.path.splitext(filename)[1].lower()
+    fd, path = tempfile.mkstemp(prefix="import-", suffix=suffix)
+    with os.fdopen(fd, "wb") as out:
+        while chunk := await file.read(1024 * 1024):
+            out.write(chunk)
+
+    job = bulk_import.start_import(path, filename, user.get("email", "unknown@local"))
+    if wants_ndjson(request.headers.get("accept")):
+        return StreamingResponse(bulk_import.iter_progress(job), media_type=NDJSON_MEDIA_TYPE)
+    return json_response(job.snapshot(incluir_erros=False), status_code=202)
+
+
+@router.get("/import/{job_id}")
+async def get_import_status(job_id: str, user: dict = Depends(dependencies.get_current_user)):
+    """Progresso e relatório de erros (por linha) de uma importação."""
+    job = bulk_import.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Importação não encontrada.")
+    return json_response(job.snapshot())
 
 
 # =============================================================================
@@ -420,13 +556,24 @@ async def get_edit_data(precificacao_id: str, user: dict = Depends(dependencies.
 # Endpoints - Campanha (compat com /static/*Campaign*.js)
 # =============================================================================
 @router.post("/campanha", response_model=Dict[str, Any])
-async def create_or_update_campanha(payload: CampanhaPayload, user: dict = Depends(dependencies.get_current_user)):
+def create_or_update_campanha(payload: CampanhaPayload, user: dict = Depends(dependencies.get_current_user)):
     """
     Cria ou atualiza uma campanha:
       - se payload.id existir -> update
       - se não -> create
-    Retorna { id: "<uuid>" }.
+    Retorna { id: "<uuid>" }. Recusa (400) se a precificação base já estiver
+    em outra campanha com período sobreposto.
     """
+    try:
+        conflitos = interval_index.get().conflicts(
+            payload.inicio, payload.fim, base_id=payload.base_id, ignorar_vinculo=payload.id
+        )
+    except Exception as e:
+        _log_warn(f"Não foi possível validar sobreposição de campanhas: {e}")
+        conflitos = []
+    if conflitos:
+        nomes = ", ".join(sorted({str(c["nome_campanha"]) for c in conflitos}))
+        raise HTTPException(status_code=400, detail=f"Período sobreposto a outra campanha desta precificação: {nomes}.")
     data = payload.model_dump()
     if payload.id:
         ok = _safe("update_campaign", payload.id, data)
@@ -442,6 +589,42 @@ async def create_or_update_campanha(payload: CampanhaPayload, user: dict = Depen
         raise HTTPException(status_code=400, detail="Não foi possível criar a campanha.")
 
 
+def _campanha_lote(fn, *args):
+    try:
+        return fn(*args)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/campanha/lote/preview")
+def preview_campanha_lote(
+    payload: campaign_batch.CampanhaLotePayload,
+    user: dict = Depends(dependencies.get_current_user),
+):
+    """
+    Aplica uma campanha (desconto, cupom, cashback) a todas as precificações
+    do filtro e devolve, por SKU, preço promocional, repasse, lucro e margem,
+    sem gravar. Linhas que não podem entrar vêm com `aceito: false` e `motivo`.
+    """
+    return json_response(_campanha_lote(campaign_batch.preview, payload))
+
+
+@router.post("/campanha/lote")
+def gravar_campanha_lote(
+    payload: campaign_batch.CampanhaLoteGravarPayload,
+    user: dict = Depends(dependencies.get_current_user),
+):
+    """
+    Recalcula o lote do preview e grava as linhas aceitas (ou só as de
+    `aceitos`) numa única escrita. Retorna { gravadas, ids, ignoradas }.
+    """
+    return json_response(
+        _campanha_lote(campaign_batch.gravar, payload, user.get("email", "unknown@local"))
+    )
+
+
 @router.get("/campanha/{campanha_id}", response_model=CampanhaResponse)
 async def get_campanha(campanha_id: str, user: dict = Depends(dependencies.get_current_user)):
     """
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Optional, Any, Dict
 
 from fastapi import APIRouter
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
+
+from .. import reference_data
+from ..serialization import raw_json_response
 
 # -----------------------------------------------------------------------------
 # Modelos (Pydantic)
@@ -42,6 +46,8 @@ class RegrasNegocioPayload(BaseModel):
 # -----------------------------------------------------------------------------
 router = APIRouter(prefix="/api/regras-negocio", tags=["regras-negocio"])
 
+RULES_JSON_PATH = Path(__file__).resolve().parent.parent / "data" / "regras.json"
+
 # -----------------------------------------------------------------------------
 # Fontes de dados com fallback seguro
 # -----------------------------------------------------------------------------
@@ -103,8 +109,7 @@ def _load_from_json() -> Dict[str, Any]:
       "COMISSOES": [...]
     }
     """
-    base_dir = Path(__file__).resolve().parent.parent  # /app/app
-    data_path = base_dir / "data" / "regras.json"
+    data_path = RULES_JSON_PATH
     out: Dict[str, Any] = {
         "REGRAS_TARIFA_FIXA_ML": [],
         "REGRAS_FRETE_ML": [],
@@ -159,6 +164,60 @@ def _load_rules_payload() -> RegrasNegocioPayload:
     return payload
 
 
+# -----------------------------------------------------------------------------
+# Registro compilado (payload validado + JSON pré-serializado)
+# -----------------------------------------------------------------------------
+_PAYLOAD = TypeAdapter(RegrasNegocioPayload)
+_TARIFAS = TypeAdapter(List[TarifaFixaItem])
+_FRETES = TypeAdapter(List[FreteRegraItem])
+_COMISSOES = TypeAdapter(List[ComissaoItem])
+
+
+@dataclass(frozen=True)
+class CompiledRules:
+    payload: RegrasNegocioPayload
+    body: bytes
+    tarifa_fixa: bytes
+    frete: bytes
+    comissoes: bytes
+
+
+def rules_file_stamp() -> Optional[int]:
+    """mtime (ns) de app/data/regras.json; muda → o registro é recompilado."""
+    try:
+        return RULES_JSON_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def compile_rules() -> CompiledRules:
+    """
+    Mescla/valida as regras uma única vez e já guarda os bytes de cada
+    endpoint. Recompilado pelos dados de referência quando o namespace
+    "rules" é invalidado (escrita via services) ou o regras.json muda.
+    """
+    payload = _load_rules_payload()
+    return CompiledRules(
+        payload=payload,
+        body=_PAYLOAD.dump_json(payload),
+        tarifa_fixa=_TARIFAS.dump_json(payload.REGRAS_TARIFA_FIXA_ML),
+        frete=_FRETES.dump_json(payload.REGRAS_FRETE_ML),
+        comissoes=_COMISSOES.dump_json(payload.COMISSOES),
+    )
+
+
+def get_compiled_rules() -> CompiledRules:
+    return reference_data.get("regras")
+
+
+def get_rules_payload() -> RegrasNegocioPayload:
+    """
+    Acesso às regras mescladas para outros módulos (ex.: motor de precificação
+    da importação em massa). Servidas a partir dos dados de referência.
+    """
+    return get_compiled_rules().payload
+
+
 # -----------------------------------------------------------------------------
 # Endpoints
 # -----------------------------------------------------------------------------
@@ -168,7 +227,7 @@ async def get_regras_negocio() -> RegrasNegocioPayload:
     Pacote completo de regras de negócio.
     Compatível com o front que chama /api/regras-negocio.
     """
-    return _load_rules_payload()
+    return raw_json_response(get_compiled_rules().body)
 
 
 @router.get("/tarifa-fixa", response_model=List[TarifaFixaItem])
@@ -177,9 +236,8 @@ async def get_tarifa_fixa() -> List[TarifaFixaItem]:
     Regras de tarifa fixa (Mercado Livre) por faixa de valor.
     Compatível com telas de configuração/diagnóstico.
     """
-    payload = _load_rules_payload()
     # Nunca 500: se não houver dados, devolve lista vazia
-    return payload.REGRAS_TARIFA_FIXA_ML
+    return raw_json_response(get_compiled_rules().tarifa_fixa)
 
 
 @router.get("/frete", response_model=List[FreteRegraItem])
@@ -187,8 +245,7 @@ async def get_regras_frete() -> List[FreteRegraItem]:
     """
     Regras de estimativa de frete por faixa (valor x peso).
     """
-    payload = _load_rules_payload()
-    return payload.REGRAS_FRETE_ML
+    return raw_json_response(get_compiled_rules().frete)
 
 
 @router.get("/comissoes", response_model=List[ComissaoItem])
@@ -197,5 +254,4 @@ async def get_regras_comissoes() -> List[ComissaoItem]:
     Regras de comissão por 'chave' (ex.: categoria ML, ou tipo de anúncio).
     Útil para debug/admin.
     """
-    payload = _load_rules_payload()
-    return payload.COMISSOES
+    return raw_json_response(get_compiled_rules().comissoes)
@@ -0,0 +1,509 @@
+# app/scheduler.py
+"""
+Agendador de tarefas em processo (jobs periódicos fora do caminho da requisição).
+
+Cada job tem um gatilho — `Interval` (a cada N segundos, alinhado ao
+relógio, então todos os workers calculam os mesmos horários) ou `Cron`
+(expressão de 5 campos: minuto hora dia mês dia-da-semana) —, um `jitter`
+opcional (atraso aleatório para não disparar tudo no mesmo segundo) e um
+`timeout`.
+
+Dois tipos de job:
+- exclusivos (`exclusive=True`): efeitos compartilhados (gravações,
+  chamadas externas). Cada horário roda em um único worker: quem pegar o lease
+  executa, os demais pulam. Com o cache compartilhado (Redis), o lease é
+  uma chave SET NX; sem ele, um lock de arquivo (fcntl) por job em
+  SCHEDULER_LOCK_DIR — vale para os workers da mesma máquina;
+- por worker (`exclusive=False`): atuam no estado em memória de cada
+  processo (índices, cubo) e por isso rodam em todos.
+
+`expiracao_campanhas` só invalida o cache: com Redis a invalidação chega a
+todos os workers e o job é exclusivo; sem Redis ela só alcança o próprio
+processo e o job roda em cada worker.
+
+Os jobs rodam em threads; uma execução que passa do timeout é marcada como
+"timeout" no histórico (a thread não é interrompida) e o job não volta a
+rodar naquele worker até ela terminar. O histórico dos jobs exclusivos fica
+no armazenamento do lease (visível de qualquer worker); o dos demais, em
+memória. Ver GET /api/admin/jobs.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: sem lock entre processos
+    fcntl = None
+
+from . import cache, shared_cache
+
+try:
+    from zoneinfo import ZoneInfo
+
+    TIMEZONE = ZoneInfo(os.environ.get("SCHEDULER_TIMEZONE", "America/Sao_Paulo"))
+except Exception:  # pragma: no cover - sem base de fusos (tzdata)
+    print("AVISO: fuso do agendador indisponível; usando UTC.")
+    TIMEZONE = timezone.utc
+
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "true").strip().lower() not in ("0", "false", "no", "nao")
+LOCK_DIR = os.environ.get("SCHEDULER_LOCK_DIR", tempfile.gettempdir())
+
+# Execuções guardadas por job
+HISTORY_SIZE = 20
+# Espera máxima (s) do laço entre verificações
+MAX_SLEEP_SECONDS = 30
+# Folga (s) somada ao timeout na validade do lease
+LEASE_MARGIN_SECONDS = 60
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="scheduler")
+
+
+# =============================================================================
+# Gatilhos
+# =============================================================================
+class Interval:
+    def __init__(self, seconds: int):
+        if seconds <= 0:
+            raise ValueError("Intervalo deve ser positivo.")
+        self.seconds = seconds
+
+    def next_due(self, after: float) -> float:
+        # Alinhado à época: o mesmo horário em todos os workers
+        return (int(after // self.seconds) + 1) * self.seconds
+
+    def __str__(self) -> str:
+        return f"a cada {self.seconds}s"
+
+
+def _parse_field(text: str, lo: int, hi: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f"Passo inválido: {text}")
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = int(a), int(b)
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end:
+            raise ValueError(f"Valor fora do intervalo {lo}-{hi}: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    """Expressão cron de 5 campos, no fuso TIMEZONE (domingo = 0 ou 7)."""
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expressão cron deve ter 5 campos: {expr!r}")
+        self.expr = expr
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        self.weekdays = {d % 7 for d in _parse_field(fields[4], 0, 7)}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        dia = dt.day in self.days
+        semana = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return dia and semana
+        # Como no cron: com os dois restritos, basta um deles
+        return dia or semana
+
+    def next_after(self, dt: datetime) -> datetime:
+        dt = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        for _ in range(200000):
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"Expressão cron sem próxima ocorrência: {self.expr!r}")
+
+    def next_due(self, after: float) -> float:
+        return self.next_after(datetime.fromtimestamp(after, TIMEZONE)).timestamp()
+
+    def __str__(self) -> str:
+        return f"cron '{self.expr}'"
+
+
+# =============================================================================
+# Leases (um worker por horário)
+# =============================================================================
+class _FileLeases:
+    """
+    Um lock (fcntl) por job, mantido durante a execução, e um arquivo JSON
+    de estado (último horário executado + histórico) gravado atomicamente.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, job: str, ext: str) -> str:
+        prefix = shared_cache.KEY_PREFIX.replace(":", "-")
+        return os.path.join(self.directory, f"{prefix}-job-{job}.{ext}")
+
+    def _read(self, job: str) -> Dict[str, Any]:
+        try:
+            with open(self._path(job, "json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, job: str, state: Dict[str, Any]):
+        path = self._path(job, "json")
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".job-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    def acquire(self, job: str, due: Optional[float], ttl: int) -> Optional[Any]:
+        f = open(self._path(job, "lock"), "a+")
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return None
+        state = self._read(job)
+        if due is not None and due <= state.get("ultimo_horario", 0):
+            self._unlock(f)
+            return None
+        if due is not None:
+            state["ultimo_horario"] = due
+            self._write(job, state)
+        return f
+
+    def _unlock(self, f):
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+    def release(self, job: str, handle: Any, record: Dict[str, Any]):
+        try:
+            state = self._read(job)
+            state["historico"] = ([record] + state.get("historico", []))[:HISTORY_SIZE]
+            self._write(job, state)
+        finally:
+            self._unlock(handle)
+
+    def history(self, job: str) -> List[Dict[str, Any]]:
+        return self._read(job).get("historico", [])
+
+
+class _SharedLeases:
+    """Leases e histórico no backend compartilhado do cache (Redis)."""
+
+    HISTORY_TTL_SECONDS = 30 * 24 * 3600
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _key(self, job: str, *parts: Any) -> str:
+        return ":".join([shared_cache.KEY_PREFIX, "job", job, *map(str, parts)])
+
+    def acquire(self, job: str, due: Optional[float], ttl: int) -> Optional[Any]:
+        token = f"{os.getpid()}:{random.getrandbits(32):08x}".encode("ascii")
+        if not self.backend.set_nx(self._key(job, "executando"), token, ttl):
+            return None
+        if due is not None and not self.backend.set_nx(self._key(job, "horario", int(due)), token, 24 * 3600):
+            self.backend.delete(self._key(job, "executando"))
+            return None
+        return token
+
+    def release(self, job: str, handle: Any, record: Dict[str, Any]):
+        key = self._key(job, "historico")
+        try:
+            historico = json.loads(self.backend.get(key) or b"[]")
+        except ValueError:
+            historico = []
+        self.backend.set(key, json.dumps(([record] + historico)[:HISTORY_SIZE]).encode("utf-8"), self.HISTORY_TTL_SECONDS)
+        # Só apaga o lease se ainda for o nosso (pode ter vencido durante a execução)
+        if self.backend.get(self._key(job, "executando")) == handle:
+            self.backend.delete(self._key(job, "executando"))
+
+    def history(self, job: str) -> List[Dict[str, Any]]:
+        try:
+            return json.loads(self.backend.get(self._key(job, "historico")) or b"[]")
+        except ValueError:
+            return []
+
+
+def _leases():
+    backend = shared_cache.get_backend()
+    if backend.shared:
+        return _SharedLeases(backend)
+    return _FileLeases(LOCK_DIR)
+
+
+# =============================================================================
+# Jobs
+# =============================================================================
+@dataclass
+class Job:
+    name: str
+    fn: Callable[[], Any]
+    trigger: Any
+    description: str = ""
+    timeout: int = 300
+    jitter: int = 0
+    exclusive: bool = True
+    # estado local (por worker)
+    next_due: Optional[float] = None
+    next_run_at: Optional[float] = None
+    running: bool = False
+    runs: int = 0
+    skipped: int = 0
+    history: Deque[Dict[str, Any]] = field(default_factory=lambda: deque(maxlen=HISTORY_SIZE))
+
+    def schedule(self, after: float):
+        self.next_due = self.trigger.next_due(after)
+        self.next_run_at = self.next_due + (random.uniform(0, self.jitter) if self.jitter else 0)
+
+
+_jobs: Dict[str, Job] = {}
+_lock = threading.Lock()
+_wake = threading.Event()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def register(
+    name: str,
+    fn: Callable[[], Any],
+    trigger: Any,
+    *,
+    description: str = "",
+    timeout: int = 300,
+    jitter: int = 0,
+    exclusive: bool = True,
+) -> Job:
+    job = Job(name, fn, trigger, description, timeout, jitter, exclusive)
+    job.schedule(time.time())
+    with _lock:
+        _jobs[name] = job
+    _wake.set()
+    return job
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts else None
+
+
+def _execute(job: Job, due: Optional[float], manual: bool = False):
+    leases = _leases() if job.exclusive else None
+    handle = None
+    if leases is not None:
+        handle = leases.acquire(job.name, due, job.timeout + LEASE_MARGIN_SECONDS)
+        if handle is None:
+            with _lock:
+                job.running = False
+                job.skipped += 1
+            return
+
+    record: Dict[str, Any] = {
+        "inicio": _iso(time.time()),
+        "horario": _iso(due),
+        "manual": manual,
+        "pid": os.getpid(),
+        "status": "executando",
+    }
+    t0 = time.monotonic()
+    done = threading.Event()
+
+    def run():
+        try:
+            job.fn()
+            if record["status"] == "executando":
+                record["status"] = "ok"
+        except Exception as e:
+            record["status"] = "erro" if record["status"] == "executando" else record["status"]
+            record["erro"] = f"{type(e).__name__}: {e}"
+            print(f"ERRO NO JOB '{job.name}': {e}")
+        finally:
+            record["fim"] = _iso(time.time())
+            record["duracao_ms"] = round((time.monotonic() - t0) * 1000, 1)
+            if leases is not None:
+                try:
+                    leases.release(job.name, handle, record)
+                except Exception as e:
+                    print(f"ERRO AO LIBERAR O LEASE DO JOB '{job.name}': {e}")
+            with _lock:
+                job.running = False
+            done.set()
+
+    with _lock:
+        job.runs += 1
+        job.history.appendleft(record)
+    threading.Thread(target=run, name=f"job-{job.name}", daemon=True).start()
+    if not done.wait(job.timeout):
+        record["status"] = "timeout"
+        print(f"AVISO: job '{job.name}' passou do timeout de {job.timeout}s; segue rodando em background.")
+
+
+def _submit(job: Job, due: Optional[float], manual: bool = False) -> bool:
+    with _lock:
+        if job.running:
+            job.skipped += 1
+            return False
+        job.running = True
+    _executor.submit(_execute, job, due, manual)
+    return True
+
+
+def _loop():
+    while not _stop.is_set():
+        now = time.time()
+        with _lock:
+            jobs = list(_jobs.values())
+        for job in jobs:
+            if job.next_run_at is not None and job.next_run_at <= now:
+                due = job.next_due
+                job.schedule(max(now, due))
+                _submit(job, due)
+        with _lock:
+            pending = [j.next_run_at for j in _jobs.values() if j.next_run_at is not None]
+        sleep = min([MAX_SLEEP_SECONDS] + [max(0.0, t - time.time()) for t in pending])
+        _wake.wait(sleep)
+        _wake.clear()
+
+
+def start():
+    global _thread
+    if not SCHEDULER_ENABLED:
+        return
+    if _thread is not None and _thread.is_alive():
+        return
+    if not _jobs:
+        register_default_jobs()
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="scheduler", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
+    _wake.set()
+
+
+def run_now(name: str) -> bool:
+    """Dispara o job já (fora do horário). False se já estiver rodando neste worker."""
+    job = _jobs.get(name)
+    if job is None:
+        raise KeyError(name)
+    return _submit(job, None, manual=True)
+
+
+def counters() -> List[Dict[str, Any]]:
+    """Contadores locais dos jobs (sem ler o histórico compartilhado)."""
+    with _lock:
+        return [
+            {"nome": j.name, "execucoes": j.runs, "puladas": j.skipped, "executando": j.running}
+            for j in _jobs.values()
+        ]
+
+
+def status() -> List[Dict[str, Any]]:
+    leases = _leases()
+    out: List[Dict[str, Any]] = []
+    with _lock:
+        jobs = list(_jobs.values())
+    for job in jobs:
+        if job.exclusive:
+            try:
+                historico = leases.history(job.name)
+            except Exception as e:
+                print(f"AVISO: histórico do job '{job.name}' indisponível: {e}")
+                historico = list(job.history)
+        else:
+            historico = list(job.history)
+        out.append({
+            "nome": job.name,
+            "descricao": job.description,
+            "gatilho": str(job.trigger),
+            "exclusivo": job.exclusive,
+            "timeout_s": job.timeout,
+            "jitter_s": job.jitter,
+            "proxima_execucao": _iso(job.next_run_at),
+            "executando": job.running,
+            "execucoes": job.runs,
+            "puladas": job.skipped,
+            "historico": historico,
+        })
+    return out
+
+
+# =============================================================================
+# Jobs da aplicação
+# =============================================================================
+def _expirar_campanhas():
+    # Virada do dia: o conjunto de campanhas ativas/expirando muda sem
+    # nenhuma gravação.
+    cache.invalidate("campaigns")
+
+
+def _indices_incrementais():
+    from . import incremental
+    for idx in (incremental.last_sales, incremental.products, incremental.latest_pricings):
+        idx.ensure_fresh()
+
+
+def _indice_campanhas():
+    from . import interval_index
+    interval_index.get()
+
+
+def _cubo_lucro():
+    from . import rollups
+    rollups.warm()
+
+
+def register_default_jobs():
+    register(
+        "expiracao_campanhas", _expirar_campanhas, Cron("1 0 * * *"),
+        description="Recalcula campanhas ativas/expirando na virada do dia",
+        timeout=60, exclusive=shared_cache.get_backend().shared,
+    )
+    register(
+        "indices_incrementais", _indices_incrementais, Interval(300),
+        description="Carga incremental de vendas, produtos e precificações (custos desatualizados)",
+        timeout=600, jitter=60, exclusive=False,
+    )
+    register(
+        "indice_campanhas", _indice_campanhas, Interval(300),
+        description="Recarrega o índice de intervalos das campanhas",
+        timeout=300, jitter=60, exclusive=False,
+    )
+    register(
+        "cubo_lucro", _cubo_lucro, Interval(1800),
+        description="Mantém o cubo de lucro mensal atualizado",
+        timeout=900, jitter=120, exclusive=False,
+    )
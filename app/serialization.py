@@ -0,0 +1,154 @@
+# app/serialization.py
+"""
+Camada de serialização das respostas JSON.
+
+- `dumps()` usa orjson (quando instalado) com fallback para o json da stdlib.
+- `FastJSONResponse` é a response padrão da aplicação (ver main.py).
+- `json_response()` devolve bytes já prontos, pulando o `jsonable_encoder`
+  do FastAPI — use em rotas que já montaram/validaram o payload.
+- `iter_json_array()` / `iter_ndjson()` + `streaming_json_response()` servem
+  listas grandes em blocos, sem montar o corpo inteiro em memória.
+"""
+from __future__ import annotations
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Iterable, Iterator, Optional
+
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - orjson está no requirements.txt
+    orjson = None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Quantidade de itens serializados por bloco nas respostas em streaming
+STREAM_CHUNK_SIZE = 256
+
+
+# =============================================================================
+# Encoder
+# =============================================================================
+def _default(obj: Any) -> Any:
+    """Tipos que o orjson/json não conhecem (BigQuery devolve Decimal p/ NUMERIC)."""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    raise TypeError(f"Tipo não serializável em JSON: {type(obj).__name__}")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+
+else:
+
+    def dumps(content: Any) -> bytes:
+        return json.dumps(
+            content, default=_default, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+
+# =============================================================================
+# Responses
+# =============================================================================
+class FastJSONResponse(JSONResponse):
+    """JSONResponse renderizada com orjson (aceita Decimal/datetime/BaseModel)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def json_response(content: Any, status_code: int = 200, headers: Optional[dict] = None) -> FastJSONResponse:
+    """
+    Retorna a Response diretamente: o FastAPI não revalida nem passa pelo
+    `jsonable_encoder`, então só use com dados já normalizados.
+    """
+    return FastJSONResponse(content=content, status_code=status_code, headers=headers)
+
+
+def raw_json_response(body: bytes, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    """Response para corpo JSON já serializado (ex.: TypeAdapter.dump_json)."""
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+# =============================================================================
+# Streaming
+# =============================================================================
+def _chunks(items: Iterable[Any], size: int) -> Iterator[list]:
+    batch: list = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_ndjson(items: Iterable[Any], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Um objeto JSON por linha; cada bloco junta `chunk_size` linhas."""
+    for batch in _chunks(items, chunk_size):
+        yield b"".join(dumps(i) + b"\n" for i in batch)
+
+
+def iter_json_array(
+    items: Iterable[Any],
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    envelope: Optional[dict] = None,
+    key: str = "items",
+) -> Iterator[bytes]:
+    """
+    Serializa um array JSON em blocos.
+    Com `envelope`, gera `{...envelope, "<key>": [ ... ]}` — útil para manter
+    o shape das respostas paginadas (`total`, `page` etc.).
+    """
+    if envelope:
+        head = dumps(envelope)[:-1]  # remove o '}' final
+        head += (b"," if len(head) > 1 else b"") + dumps(key) + b":["
+        tail = b"]}"
+    else:
+        head, tail = b"[", b"]"
+
+    first = True
+    yield head
+    for batch in _chunks(items, chunk_size):
+        body = b",".join(dumps(i) for i in batch)
+        yield body if first else b"," + body
+        first = False
+    yield tail
+
+
+def wants_ndjson(accept: Optional[str]) -> bool:
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
+
+
+def streaming_json_response(
+    items: Iterable[Any],
+    ndjson: bool = False,
+    envelope: Optional[dict] = None,
+    headers: Optional[dict] = None,
+) -> StreamingResponse:
+    """
+    StreamingResponse para listas grandes. Geradores síncronos são iterados
+    pelo Starlette em threadpool, então podem consumir iteradores do BigQuery
+    sem bloquear o event loop.
+    """
+    if ndjson:
+        return StreamingResponse(iter_ndjson(items), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+    return StreamingResponse(
+        iter_json_array(items, envelope=envelope), media_type="application/json", headers=headers
+    )
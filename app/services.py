@@ -3,13 +3,14 @@ import uuid
 import json
 import traceback
 from datetime import datetime, date
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
 from google.cloud import bigquery, storage
-from cachetools import cached
-from .cache import cache
-from . import models
+from .cache import cached, discard, invalidate, invalidate_for_action
+from .pricing import normalize_loja_config
+from . import incremental, interval_index, metrics, models, rollups, sessions, user_directory
 
-client = bigquery.Client()
+client = metrics.instrument_bigquery(bigquery.Client())
 storage_client = storage.Client()
 PROJECT_ID = os.environ.get("GCP_PROJECT_ID", client.project)
 BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME")
@@ -40,8 +41,7 @@ def _bq_type(value):
 
 def log_action(user_email: str, action: str, details: dict = None, detalhes_alteracao: dict = None):
     try:
-        if "RULE" in action or "CAMPAIGN" in action or "STORE" in action:
-            cache.clear()
+        invalidate_for_action(action)
         log_entry = {
             "timestamp": datetime.utcnow(),
             "user_email": user_email,
@@ -72,6 +72,38 @@ def fetch_product_data(sku: str) -> Optional[dict]:
     results = [dict(row) for row in execute_query(query, params)]
     return results[0] if results else None
 
+def fetch_products_batch(skus: List[str]) -> Dict[str, dict]:
+    """Produtos de vários SKUs numa única consulta. Chave: sku em minúsculas."""
+    skus_l = sorted({str(s).lower() for s in skus if s})
+    if not skus_l:
+        return {}
+    query = (
+        f"SELECT sku, titulo, valor_de_custo as custo_update, peso as peso_kg, "
+        f"altura as altura_cm, largura as largura_cm, comprimento as comprimento_cm "
+        f"FROM `{TABLE_PRODUTOS}` WHERE LOWER(sku) IN UNNEST(@skus)"
+    )
+    params = [bigquery.ArrayQueryParameter("skus", "STRING", skus_l)]
+    return {str(row["sku"]).lower(): dict(row) for row in execute_query(query, params)}
+
+def load_precificacoes_ndjson(file_obj) -> int:
+    """Grava precificações (NDJSON) via load job — um job para o arquivo inteiro."""
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        ignore_unknown_values=True,
+    )
+    job = client.load_table_from_file(file_obj, TABLE_PRECIFICACOES_SALVAS, job_config=job_config, rewind=True)
+    job.result()
+    gravadas = job.output_rows or 0
+    file_obj.seek(0)
+    if gravadas == sum(1 for line in file_obj if line.strip()):
+        file_obj.seek(0)
+        rollups.apply(added=(json.loads(line) for line in file_obj if line.strip()))
+    else:
+        # Gravação parcial: o cubo de lucro recalcula a partir da tabela
+        invalidate("dashboard")
+    return gravadas
+
 def get_precificacao_by_id(record_id: str) -> Optional[Dict[str, Any]]:
     query = f"SELECT * FROM `{TABLE_PRECIFICACOES_SALVAS}` WHERE id = @id"
     params = [bigquery.ScalarQueryParameter("id", "STRING", record_id)]
@@ -84,8 +116,7 @@ def get_precificacao_by_id(record_id: str) -> Optional[Dict[str, Any]]:
             item[key] = value.isoformat()
     return item
 
-def get_filtered_precificacoes(filters: Dict[str, Any], page: int = 1, page_size: int = 20) -> models.PrecificacaoListResponse:
-    base_query = f"FROM `{TABLE_PRECIFICACOES_SALVAS}`"
+def _precificacao_where(filters: Dict[str, Any]):
     where_clauses, params = [], []
     filter_map = {'categoria': 'categoria_precificacao'}
     for key, value in filters.items():
@@ -102,6 +133,11 @@ def get_filtered_precificacoes(filters: Dict[str, Any], page: int = 1, page_size
             where_clauses.append(f"LOWER({column_name}) = LOWER(@{param_name})")
             params.append(bigquery.ScalarQueryParameter(param_name, "STRING", value))
     where_sql = (" WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
+    return where_sql, params
+
+def get_filtered_precificacoes(filters: Dict[str, Any], page: int = 1, page_size: int = 20) -> models.PrecificacaoListResponse:
+    base_query = f"FROM `{TABLE_PRECIFICACOES_SALVAS}`"
+    where_sql, params = _precificacao_where(filters)
     count_query = f"SELECT COUNT(*) as total {base_query}{where_sql}"
     count_result = client.query(count_query, job_config=bigquery.QueryJobConfig(query_parameters=params)).result()
     total_items = list(count_result)[0].total
@@ -118,10 +154,34 @@ def get_filtered_precificacoes(filters: Dict[str, Any], page: int = 1, page_size
         items.append(item_dict)
     return models.PrecificacaoListResponse(total_items=total_items, items=items)
 
+EXPORT_PAGE_SIZE = 5000
+
+def query_precificacoes_for_export(filters: Dict[str, Any]) -> bigquery.table.RowIterator:
+    """
+    Um único job para o resultado inteiro; o RowIterator busca as páginas sob
+    demanda (tabela de destino do job), sem LIMIT/OFFSET por página.
+    """
+    where_sql, params = _precificacao_where(filters)
+    query = f"SELECT * FROM `{TABLE_PRECIFICACOES_SALVAS}`{where_sql} ORDER BY data_calculo DESC"
+    job_config = bigquery.QueryJobConfig(query_parameters=params)
+    return client.query(query, job_config=job_config).result(page_size=EXPORT_PAGE_SIZE)
+
+def fetch_pricing_rollup_rows(ids: List[str]) -> List[Dict[str, Any]]:
+    """Só as colunas que entram no cubo de lucro (ver rollups.py)."""
+    query = (
+        f"SELECT id, data_calculo, categoria_precificacao, marketplace, id_loja, lucro_classico, lucro_premium "
+        f"FROM `{TABLE_PRECIFICACOES_SALVAS}` WHERE id IN UNNEST(@ids)"
+    )
+    return [dict(row) for row in execute_query(query, [bigquery.ArrayQueryParameter("ids", "STRING", ids)])]
+
 def delete_precificacao_and_campaigns(record_id: str):
     params = [bigquery.ScalarQueryParameter("id", "STRING", record_id)]
+    removed = fetch_pricing_rollup_rows([record_id])
     execute_query(f"DELETE FROM `{TABLE_PRECIFICACOES_CAMPANHA}` WHERE precificacao_base_id = @id", params)
     execute_query(f"DELETE FROM `{TABLE_PRECIFICACOES_SALVAS}` WHERE id = @id", params)
+    rollups.apply(removed=removed)
+    incremental.latest_pricings.forget([record_id])
+    invalidate("campaigns")
 
 def bulk_update_prices(payload: models.BulkUpdatePayload, user_email: str):
     if not payload.ids: return 0
@@ -142,24 +202,80 @@ def bulk_update_prices(payload: models.BulkUpdatePayload, user_email: str):
         bigquery.ArrayQueryParameter("ids", "STRING", payload.ids)
     ]
     job_config = bigquery.QueryJobConfig(query_parameters=params)
+    before = fetch_pricing_rollup_rows(payload.ids)
     query_job = client.query(query, job_config=job_config); query_job.result()
     log_action(user_email, "BULK_UPDATE_PRICING", details={"action": payload.action.value, "value": payload.value, "item_count": len(payload.ids), "ids_afetados": payload.ids})
+    agora = datetime.utcnow()
+    after = [{**r, "data_calculo": agora} for r in before]
+    if field_to_update == "categoria_precificacao":
+        after = [{**r, "categoria_precificacao": payload.value} for r in after]
+    rollups.apply(added=after, removed=before)
     return query_job.num_dml_affected_rows
 
 def get_linked_campaigns(base_id: str) -> List[Dict[str, Any]]:
+    return get_linked_campaigns_batch([base_id]).get(str(base_id), [])
+
+def get_linked_campaigns_batch(base_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Campanhas vinculadas de várias precificações base numa consulta, agrupadas por base_id."""
+    ids = sorted({str(i) for i in base_ids if i})
+    if not ids:
+        return {}
     query = (
         f"SELECT pc.*, c.nome as nome_campanha "
         f"FROM `{TABLE_PRECIFICACOES_CAMPANHA}` pc "
         f"JOIN `{TABLE_CAMPANHAS_ML}` c ON pc.campanha_id = c.id "
-        f"WHERE pc.precificacao_base_id = @base_id"
+        f"WHERE pc.precificacao_base_id IN UNNEST(@base_ids)"
     )
-    params = [bigquery.ScalarQueryParameter("base_id", "STRING", base_id)]
-    results = [dict(row) for row in execute_query(query, params)]
-    for item in results:
+    params = [bigquery.ArrayQueryParameter("base_ids", "STRING", ids)]
+    grouped: Dict[str, List[Dict[str, Any]]] = {i: [] for i in ids}
+    for row in execute_query(query, params):
+        item = dict(row)
         for k, v in item.items():
             if hasattr(v, "isoformat"):
                 item[k] = v.isoformat()
-    return results
+        grouped.setdefault(str(item.get("precificacao_base_id")), []).append(item)
+    return grouped
+
+CAMPAIGN_BATCH_COLUMNS = (
+    "id", "marketplace", "id_loja", "sku", "titulo", "categoria_precificacao", "quantidade",
+    "custo_unitario", "custo_total", "aliquota", "parcelamento", "outros", "regra_comissao",
+    "fulfillment", "venda_classico", "venda_premium", "lucro_classico", "lucro_premium",
+)
+
+def fetch_pricings_for_campaign(filters: Dict[str, Any], ids: Optional[List[str]] = None, limit: int = 10000) -> List[Dict[str, Any]]:
+    """
+    Precificações base que entram numa campanha em lote (mesmos filtros da
+    lista; `ids` restringe a essas), com as colunas do recálculo e os ids das
+    campanhas a que cada uma já está vinculada. Uma consulta para o lote.
+    """
+    where_sql, params = _precificacao_where(filters)
+    if ids:
+        where_sql += (" AND " if where_sql else " WHERE ") + "pb.id IN UNNEST(@ids)"
+        params.append(bigquery.ArrayQueryParameter("ids", "STRING", ids))
+    query = (
+        f"SELECT {', '.join(f'pb.{c}' for c in CAMPAIGN_BATCH_COLUMNS)}, "
+        f"       ARRAY(SELECT pc.campanha_id FROM `{TABLE_PRECIFICACOES_CAMPANHA}` pc "
+        f"             WHERE pc.precificacao_base_id = pb.id) AS campanhas_vinculadas "
+        f"FROM `{TABLE_PRECIFICACOES_SALVAS}` pb{where_sql} ORDER BY pb.sku LIMIT @limit"
+    )
+    params.append(bigquery.ScalarQueryParameter("limit", "INT64", limit))
+    return [dict(row) for row in execute_query(query, params)]
+
+def load_precificacoes_campanha(rows: List[Dict[str, Any]]) -> int:
+    """
+    Grava vínculos campanha × precificação num único load job (colunas que
+    a tabela não tiver são ignoradas).
+    """
+    if not rows:
+        return 0
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        ignore_unknown_values=True,
+    )
+    job = client.load_table_from_json(rows, TABLE_PRECIFICACOES_CAMPANHA, job_config=job_config)
+    job.result()
+    return job.output_rows or len(rows)
 
 def get_campaign_pricing_details(item_id: str) -> Optional[Dict[str, Any]]:
     query = (
@@ -222,14 +338,47 @@ def update_user_properties(email: str, updates: Dict[str, Any]):
 
 def delete_user_by_email(email: str):
     execute_query(f"DELETE FROM `{TABLE_USUARIOS}` WHERE email = @email", [bigquery.ScalarQueryParameter("email", "STRING", email)])
-
-@cached(cache)
+    invalidate("users")
+    sessions.revoke_user(email)
+
+def set_user_authorized(email: str, autorizado: bool) -> bool:
+    update_user_properties(email, {"autorizado": bool(autorizado)})
+    user_directory.push_update(email, autorizado=bool(autorizado))
+    if not autorizado:
+        sessions.revoke_user(email)
+    return True
+
+def set_admin(email: str, is_admin: bool) -> bool:
+    funcao = "admin" if is_admin else "usuario"
+    update_user_properties(email, {"funcao": funcao})
+    user_directory.push_update(email, funcao=funcao)
+    return True
+
+@cached("campaigns")
 def get_all_campaigns() -> List[Dict[str, Any]]:
     return [dict(row) for row in execute_query(f"SELECT * FROM `{TABLE_CAMPANHAS_ML}` ORDER BY data_fim DESC, nome")]
 
-@cached(cache)
 def get_active_campaigns() -> List[Dict[str, Any]]:
-    return [dict(row) for row in execute_query(f"SELECT * FROM `{TABLE_CAMPANHAS_ML}` WHERE data_fim >= CURRENT_DATE() OR data_fim IS NULL ORDER BY nome")]
+    """Campanhas não encerradas (data_fim >= hoje ou sem fim), do índice de intervalos."""
+    return interval_index.get().current()
+
+CAMPAIGN_LINK_DATE_COLUMNS = ("inicio", "fim")
+
+def fetch_campaign_links() -> List[Dict[str, Any]]:
+    """Vínculos campanha × precificação (com o SKU da base) para o índice de intervalos."""
+    try:
+        available = get_table_columns(TABLE_PRECIFICACOES_CAMPANHA)
+        extras = [c for c in CAMPAIGN_LINK_DATE_COLUMNS if c in available]
+    except Exception as e:
+        print(f"AVISO: não foi possível ler o schema de {TABLE_PRECIFICACOES_CAMPANHA}: {e}")
+        extras = []
+    query = (
+        f"SELECT pc.id, pc.precificacao_base_id, pc.campanha_id, pb.sku"
+        f"{''.join(f', pc.{c}' for c in extras)} "
+        f"FROM `{TABLE_PRECIFICACOES_CAMPANHA}` pc "
+        f"LEFT JOIN `{TABLE_PRECIFICACOES_SALVAS}` pb ON pb.id = pc.precificacao_base_id"
+    )
+    return [dict(row) for row in execute_query(query)]
 
 def save_all_campaigns(campaigns_list: List[Dict[str, Any]]):
     from decimal import Decimal
@@ -260,13 +409,16 @@ def save_all_campaigns(campaigns_list: List[Dict[str, Any]]):
             return "STRING"
         params = [bigquery.ScalarQueryParameter(k, _ptype(v), v) for k, v in campaign.items()]
         execute_query(merge_query, params)
-    cache.clear()
+    invalidate("campaigns")
 
-@cached(cache)
+@cached("lojas")
 def get_lojas_config() -> List[Dict[str, Any]]:
     return [dict(row) for row in execute_query(f"SELECT * FROM `{TABLE_LOJAS_CONFIG}` ORDER BY marketplace, id_loja")]
 
 async def get_loja_details(loja_id: str) -> Dict[str, Any]:
+    return fetch_loja_details(loja_id)
+
+def fetch_loja_details(loja_id: str) -> Dict[str, Any]:
     params = [bigquery.ScalarQueryParameter("loja_id", "STRING", loja_id)]
     results = [dict(row) for row in execute_query(f"SELECT configuracoes FROM `{TABLE_LOJA_CONFIG_DETALHES}` WHERE loja_id = @loja_id", params)]
     if not results or not results[0].get('configuracoes'):
@@ -279,6 +431,20 @@ async def get_loja_details(loja_id: str) -> Dict[str, Any]:
             return {}
     return config_data if isinstance(config_data, dict) else {}
 
+@cached("loja_details")
+def get_store_details(loja_id: str) -> Dict[str, Any]:
+    """
+    Configuração da loja já normalizada (shape de LojaDetalhes), em cache até
+    o próximo save_loja_details. Trate o dict retornado como somente leitura.
+    """
+    loja = next((l for l in get_lojas_config() if str(l.get("id")) == str(loja_id)), {})
+    return {
+        "id": loja_id,
+        "marketplace": loja.get("marketplace"),
+        "id_loja": loja.get("id_loja"),
+        **normalize_loja_config(fetch_loja_details(loja_id)),
+    }
+
 def get_loja_id_by_marketplace_and_loja(marketplace: str, id_loja: str) -> Optional[str]:
     params = [bigquery.ScalarQueryParameter("marketplace", "STRING", marketplace), bigquery.ScalarQueryParameter("id_loja", "STRING", id_loja)]
     results = [dict(row) for row in execute_query(f"SELECT id FROM `{TABLE_LOJAS_CONFIG}` WHERE marketplace = @marketplace AND id_loja = @id_loja", params)]
@@ -292,53 +458,88 @@ def save_loja_details(loja_id: str, detalhes_json: str):
         f"WHEN NOT MATCHED THEN INSERT (loja_id, configuracoes) VALUES (S.loja_id, S.configuracoes)"
     )
     params = [bigquery.ScalarQueryParameter("loja_id", "STRING", loja_id), bigquery.ScalarQueryParameter("config_json", "JSON", detalhes_json)]
-    execute_query(query, params); cache.clear()
+    execute_query(query, params)
+    discard("loja_details", get_store_details.cache_key(loja_id))
 
 def delete_loja_and_details(loja_id: str):
     params = [bigquery.ScalarQueryParameter("loja_id", "STRING", loja_id)]
     execute_query(f"DELETE FROM `{TABLE_LOJAS_CONFIG}` WHERE id = @loja_id", params)
     execute_query(f"DELETE FROM `{TABLE_LOJA_CONFIG_DETALHES}` WHERE loja_id = @loja_id", params)
-    cache.clear()
-
-def get_dashboard_alert_data() -> Dict[str, List]:
-    query_campanhas = (
-        f"SELECT * FROM `{TABLE_CAMPANHAS_ML}` "
-        f"WHERE data_fim BETWEEN CURRENT_DATE() AND DATE_ADD(CURRENT_DATE(), INTERVAL 7 DAY) "
-        f"ORDER BY data_fim ASC"
-    )
-    campanhas = [dict(row) for row in execute_query(query_campanhas)]
-    query_custos = (
-        f"WITH LatestPricing AS ("
-        f"  SELECT id, sku, titulo, custo_unitario, ROW_NUMBER() OVER(PARTITION BY sku ORDER BY data_calculo DESC) as rn "
-        f"  FROM `{TABLE_PRECIFICACOES_SALVAS}`)"
-        f"SELECT lp.id as id_precificacao, lp.sku, lp.titulo, lp.custo_unitario as custo_precificado, "
-        f"       p.valor_de_custo as custo_atual "
-        f"FROM LatestPricing lp JOIN `{TABLE_PRODUTOS}` p ON lp.sku = p.sku "
-        f"WHERE lp.rn = 1 AND lp.custo_unitario != p.valor_de_custo AND p.valor_de_custo IS NOT NULL LIMIT 50"
-    )
-    custos = [dict(row) for row in execute_query(query_custos)]
-    query_estagnados = f"""
-        WITH LastSale AS (
-            SELECT sku, MAX(data_do_pedido) as ultima_venda
-            FROM `{TABLE_VENDAS}`
-            GROUP BY sku
-        )
-        SELECT 
-            p.sku, p.titulo,
-            DATE_DIFF(CURRENT_DATE(), COALESCE(DATE(ls.ultima_venda), DATE(p.data_cadastro)), DAY) as dias_sem_vender
-        FROM `{TABLE_PRODUTOS}` p
-        LEFT JOIN LastSale ls ON p.sku = ls.sku
-        WHERE COALESCE(DATE(ls.ultima_venda), DATE(p.data_cadastro)) <= DATE_SUB(CURRENT_DATE(), INTERVAL 90 DAY)
-          AND p.status = 'ATIVO'
-        ORDER BY dias_sem_vender DESC
-        LIMIT 50
+    invalidate("lojas")
+    discard("loja_details", get_store_details.cache_key(loja_id))
+
+def get_campaigns_expiring(dias: int = 7) -> List[Dict[str, Any]]:
+    """Campanhas com data_fim entre hoje e hoje + `dias`, da que termina antes para a depois."""
+    return interval_index.get().expiring(dias)
+
+def get_outdated_costs(limit: int = 50) -> List[Dict[str, Any]]:
+    """Custos desatualizados de maior impacto — cruzamento dos índices de produtos e precificações."""
+    return incremental.cost_drift(page=1, page_size=limit)["items"]
+
+def get_stagnant_products(dias: int = 90, limit: Optional[int] = 50) -> List[Dict[str, Any]]:
+    """Produtos ativos sem venda há `dias` dias ou mais — filtro sobre o índice de última venda."""
+    return incremental.stagnant_products(dias, limit)
+
+@lru_cache(maxsize=32)
+def get_table_columns(table_id: str) -> frozenset:
+    return frozenset(field.name for field in client.get_table(table_id).schema)
+
+def fetch_last_sales(desde: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Data da última venda por SKU; com `desde`, só olha pedidos a partir dessa data."""
+    where, params = "WHERE sku IS NOT NULL", None
+    if desde is not None:
+        where += " AND DATE(data_do_pedido) >= @desde"
+        params = [bigquery.ScalarQueryParameter("desde", "DATE", desde)]
+    query = f"SELECT sku, DATE(MAX(data_do_pedido)) AS ultima_venda FROM `{TABLE_VENDAS}` {where} GROUP BY sku"
+    return [dict(row) for row in execute_query(query, params)]
+
+PRODUCT_INDEX_COLUMNS = ("sku", "titulo", "status", "data_cadastro", "valor_de_custo")
+# Colunas de data de atualização aceitas (a primeira existente vira `atualizado_em`)
+PRODUCT_UPDATED_AT_COLUMNS = ("data_atualizacao", "data_ultima_atualizacao", "ultima_atualizacao", "updated_at")
+
+def fetch_products_for_index(desde: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    Cadastro enxuto dos produtos; colunas opcionais ausentes na tabela são
+    omitidas. Com coluna de atualização, ela vem como `atualizado_em` e
+    `desde` limita a consulta aos produtos alterados a partir dessa data.
     """
     try:
-        estagnados = [dict(row) for row in execute_query(query_estagnados)]
+        available = get_table_columns(TABLE_PRODUTOS)
+        columns = [c for c in PRODUCT_INDEX_COLUMNS if c in available]
+        updated_at = next((c for c in PRODUCT_UPDATED_AT_COLUMNS if c in available), None)
     except Exception as e:
-        print(f"AVISO: Não foi possível buscar produtos estagnados. Erro: {e}")
-        estagnados = []
-    return {"campanhas_expirando": campanhas, "custos_desatualizados": custos, "produtos_estagnados": estagnados}
+        print(f"AVISO: não foi possível ler o schema de {TABLE_PRODUTOS}: {e}")
+        columns, updated_at = list(PRODUCT_INDEX_COLUMNS), None
+    where, params = "WHERE sku IS NOT NULL", None
+    if updated_at:
+        columns.append(f"CAST({updated_at} AS TIMESTAMP) AS atualizado_em")
+        if desde is not None:
+            where += f" AND CAST({updated_at} AS TIMESTAMP) >= @desde"
+            params = [bigquery.ScalarQueryParameter("desde", "TIMESTAMP", desde)]
+    query = f"SELECT {', '.join(columns)} FROM `{TABLE_PRODUTOS}` {where}"
+    return [dict(row) for row in execute_query(query, params)]
+
+def fetch_latest_pricings(desde: Optional[datetime] = None, skus: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Precificação mais recente por SKU (só as colunas do cálculo de impacto).
+    `desde` restringe às calculadas a partir dessa data (carga incremental);
+    `skus`, a esses SKUs.
+    """
+    where, params = ["sku IS NOT NULL", "data_calculo IS NOT NULL"], []
+    if desde is not None:
+        where.append("data_calculo >= @desde")
+        params.append(bigquery.ScalarQueryParameter("desde", "TIMESTAMP", desde))
+    if skus is not None:
+        where.append("sku IN UNNEST(@skus)")
+        params.append(bigquery.ArrayQueryParameter("skus", "STRING", list(skus)))
+    query = (
+        f"SELECT ultima.* FROM ("
+        f"  SELECT ARRAY_AGG(STRUCT(id, sku, titulo, custo_unitario, quantidade, venda_classico, venda_premium, "
+        f"         lucro_classico, lucro_premium, marketplace, id_loja, data_calculo) "
+        f"         ORDER BY data_calculo DESC LIMIT 1)[OFFSET(0)] AS ultima "
+        f"  FROM `{TABLE_PRECIFICACOES_SALVAS}` WHERE {' AND '.join(where)} GROUP BY sku)"
+    )
+    return [dict(row) for row in execute_query(query, params or None)]
 
 def get_history_logs() -> List[Dict[str, Any]]:
     results = [dict(row) for row in execute_query(f"SELECT * FROM `{TABLE_LOGS}` ORDER BY timestamp DESC LIMIT 200")]
@@ -347,20 +548,14 @@ def get_history_logs() -> List[Dict[str, Any]]:
             if hasattr(v, "isoformat"): r[k] = v.isoformat()
     return results
 
-def get_profitability_by_category() -> List[Dict[str, Any]]:
+def fetch_profit_rollup() -> List[Dict[str, Any]]:
+    """Carga completa do cubo de lucro: um GROUP BY por mês × categoria × marketplace × loja."""
     query = (
-        f"SELECT categoria_precificacao as label, SUM(lucro_classico + lucro_premium) as value "
-        f"FROM `{TABLE_PRECIFICACOES_SALVAS}` WHERE categoria_precificacao IS NOT NULL "
-        f"GROUP BY categoria_precificacao ORDER BY value DESC"
-    )
-    return [dict(row) for row in execute_query(query)]
-
-def get_profit_evolution() -> List[Dict[str, Any]]:
-    query = (
-        f"SELECT FORMAT_TIMESTAMP('%Y-%m', data_calculo) as label, SUM(lucro_classico + lucro_premium) as value "
-        f"FROM `{TABLE_PRECIFICACOES_SALVAS}` "
-        f"WHERE data_calculo >= TIMESTAMP(DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH)) "
-        f"GROUP BY label ORDER BY label"
+        f"SELECT FORMAT_TIMESTAMP('%Y-%m', data_calculo) as mes, categoria_precificacao as categoria, "
+        f"       marketplace, id_loja, "
+        f"       SUM(COALESCE(lucro_classico, 0) + COALESCE(lucro_premium, 0)) as lucro, COUNT(*) as registros "
+        f"FROM `{TABLE_PRECIFICACOES_SALVAS}` WHERE data_calculo IS NOT NULL "
+        f"GROUP BY mes, categoria, marketplace, id_loja"
     )
     return [dict(row) for row in execute_query(query)]
 
@@ -380,6 +575,7 @@ async def get_all_business_rules() -> Dict[str, List]:
         traceback.print_exc()
         raise e
 
+@cached("categories")
 def get_all_precificacao_categories() -> List[Dict[str, Any]]:
     return [dict(row) for row in execute_query(f"SELECT * FROM `{TABLE_CATEGORIAS_PRECIFICACAO}` ORDER BY nome")]
 
@@ -412,6 +608,9 @@ async def run_simulation(payload: models.SimulacaoPayload) -> models.SimulacaoRe
     depois = calculate_totals(precificacoes_depois)
     return models.SimulacaoResultado(antes=antes, depois=depois)
 
+def _rules_namespace(table_id: str) -> str:
+    return "categories" if table_id == TABLE_CATEGORIAS_PRECIFICACAO else "rules"
+
 def process_rules_with_merge(table_id: str, rules: List[models.BaseModel], p_keys: List[str]):
     from decimal import Decimal
     for rule in rules:
@@ -421,7 +620,7 @@ def process_rules_with_merge(table_id: str, rules: List[models.BaseModel], p_key
     if ids_to_keep:
         execute_query(f"DELETE FROM `{table_id}` WHERE id NOT IN UNNEST(@ids)", [bigquery.ArrayQueryParameter("ids", "STRING", ids_to_keep)])
     elif not rules:
-        execute_query(f"DELETE FROM `{table_id}` WHERE true"); return
+        execute_query(f"DELETE FROM `{table_id}` WHERE true"); invalidate(_rules_namespace(table_id)); return
     if not rules: return
     model_fields = rules[0].model_fields.keys()
     source_columns = ", ".join(f"`{col}`" for col in model_fields)
@@ -449,4 +648,4 @@ def process_rules_with_merge(table_id: str, rules: List[models.BaseModel], p_key
     WHEN MATCHED THEN UPDATE SET {update_clause}
     WHEN NOT MATCHED BY TARGET THEN INSERT ({source_columns}) VALUES ({source_columns})
     """
-    execute_query(merge_query, all_params); cache.clear()
+    execute_query(merge_query, all_params); invalidate(_rules_namespace(table_id))
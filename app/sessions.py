@@ -0,0 +1,344 @@
+# app/sessions.py
+"""
+Sessões no servidor (substitui o SessionMiddleware de cookie assinado).
+
+Com o cache compartilhado (Redis, `CACHE_REDIS_URL`; ver shared_cache.py),
+o cookie carrega só um ID opaco e assinado e os dados da sessão (usuário,
+oauth_state, redirect pós-login...) ficam no Redis. Sem ele, o backend é a
+memória de cada processo — que não é vista pelos outros workers/instâncias
+nem sobrevive a um restart —, então a sessão inteira vai no próprio cookie,
+assinado, como no SessionMiddleware antigo (com os mesmos limites de
+inatividade e idade máxima, mas sem revogação imediata).
+
+- `request.session` continua sendo um dict — nada muda nas rotas;
+- a sessão só é gravada quando o conteúdo muda; sem mudança, a requisição
+  apenas marca o "último acesso", e essas marcas são aplicadas em lote (um
+  EXPIRE por sessão a cada TOUCH_FLUSH_SECONDS) — expiração deslizante sem
+  escrita por requisição;
+- além da inatividade (IDLE_TIMEOUT_SECONDS) há um teto absoluto
+  (MAX_AGE_SECONDS) contado a partir do login;
+- o ID é trocado quando o usuário da sessão muda (login), contra fixação de
+  sessão;
+- `revoke_user(email)` derruba na hora todas as sessões de um usuário.
+"""
+from __future__ import annotations
+
+import base64
+import json
+import os
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import anyio
+import itsdangerous
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import shared_cache
+from .serialization import dumps
+
+COOKIE_NAME = "session"
+# Teto absoluto da sessão, contado do login (padrão: 14 dias, como antes)
+MAX_AGE_SECONDS = int(os.environ.get("SESSION_MAX_AGE_SECONDS", str(14 * 24 * 3600)))
+# Sessão sem nenhuma requisição por esse tempo expira
+IDLE_TIMEOUT_SECONDS = int(os.environ.get("SESSION_IDLE_TIMEOUT_SECONDS", str(12 * 3600)))
+# Intervalo (s) entre as aplicações em lote dos "últimos acessos"
+TOUCH_FLUSH_SECONDS = 60
+
+
+def _session_key(sid: str) -> str:
+    return f"{shared_cache.KEY_PREFIX}:session:{sid}"
+
+
+def _user_key(email: str) -> str:
+    return f"{shared_cache.KEY_PREFIX}:session-user:{email}"
+
+
+class Session(dict):
+    """Dados da sessão; `modified` é aceito por compatibilidade."""
+
+    modified = False
+
+
+# =============================================================================
+# Store
+# =============================================================================
+class SessionStore:
+    def __init__(self, idle_timeout: int = IDLE_TIMEOUT_SECONDS, max_age: int = MAX_AGE_SECONDS):
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self._touches: Dict[str, float] = {}
+        self._flushed_at = time.monotonic()
+        self._touch_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return shared_cache.get_backend()
+
+    def _ttl(self, created: float) -> int:
+        remaining = created + self.max_age - time.time()
+        return max(1, int(min(self.idle_timeout, remaining)))
+
+    def load(self, sid: str) -> Optional[Dict[str, Any]]:
+        """Registro {"data", "created", "email"} ou None (inexistente/vencido)."""
+        raw = self.backend.get(_session_key(sid))
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        if record.get("created", 0) + self.max_age <= time.time():
+            self.delete(sid, record.get("email"))
+            return None
+        record["raw"] = raw
+        return record
+
+    def save(self, sid: str, data: Dict[str, Any], created: float) -> bytes:
+        email = _email_of(data)
+        raw = dumps({"data": data, "created": created, "email": email})
+        self.backend.set(_session_key(sid), raw, self._ttl(created))
+        with self._touch_lock:
+            self._touches.pop(sid, None)
+        return raw
+
+    def delete(self, sid: str, email: Optional[str] = None):
+        self.backend.delete(_session_key(sid))
+        with self._touch_lock:
+            self._touches.pop(sid, None)
+        if email:
+            self._unlink_user(email, sid)
+
+    def touch(self, sid: str, created: float):
+        with self._touch_lock:
+            self._touches[sid] = created
+
+    def flush_due(self) -> bool:
+        return bool(self._touches) and time.monotonic() - self._flushed_at >= TOUCH_FLUSH_SECONDS
+
+    def flush_touches(self):
+        """Estende a expiração de todas as sessões usadas desde o último lote."""
+        with self._touch_lock:
+            touches, self._touches = self._touches, {}
+            self._flushed_at = time.monotonic()
+        backend = self.backend
+        for sid, created in touches.items():
+            try:
+                backend.expire(_session_key(sid), self._ttl(created))
+            except Exception as e:
+                print(f"ERRO AO RENOVAR SESSÃO: {e}")
+
+    # ---- sessões por usuário (para revogação) ----
+    def _user_sids(self, email: str) -> List[str]:
+        raw = self.backend.get(_user_key(email))
+        return json.loads(raw) if raw else []
+
+    def link_user(self, email: str, sid: str):
+        sids = [s for s in self._user_sids(email) if s != sid] + [sid]
+        self.backend.set(_user_key(email), dumps(sids), self.max_age)
+
+    def _unlink_user(self, email: str, sid: str):
+        sids = [s for s in self._user_sids(email) if s != sid]
+        if sids:
+            self.backend.set(_user_key(email), dumps(sids), self.max_age)
+        else:
+            self.backend.delete(_user_key(email))
+
+    def revoke_user(self, email: str) -> int:
+        sids = self._user_sids(email)
+        for sid in sids:
+            self.backend.delete(_session_key(sid))
+            with self._touch_lock:
+                self._touches.pop(sid, None)
+        self.backend.delete(_user_key(email))
+        return len(sids)
+
+
+def _email_of(data: Dict[str, Any]) -> Optional[str]:
+    user = data.get("user")
+    email = user.get("email") if isinstance(user, dict) else None
+    return str(email).strip().lower() if email else None
+
+
+store = SessionStore()
+
+
+def revoke_user(email: str) -> int:
+    """
+    Encerra todas as sessões do usuário; devolve quantas foram removidas.
+    Com as sessões no cookie (sem backend compartilhado) não há o que
+    remover: valem só o bloqueio/rebaixamento pelo diretório de usuários.
+    """
+    email = (email or "").strip().lower()
+    if not email:
+        return 0
+    try:
+        return store.revoke_user(email)
+    except Exception as e:
+        print(f"ERRO AO REVOGAR SESSÕES DE {email}: {e}")
+        return 0
+
+
+# =============================================================================
+# Fallback sem backend compartilhado: sessão no cookie
+# =============================================================================
+class CookieSessionCodec:
+    """
+    Sessão inteira no cookie, assinada com timestamp. A assinatura é
+    renovada a cada TOUCH_FLUSH_SECONDS de uso (expiração deslizante por
+    IDLE_TIMEOUT_SECONDS); `created` no payload aplica o MAX_AGE_SECONDS.
+    """
+
+    def __init__(self, secret_key: str, idle_timeout: int = IDLE_TIMEOUT_SECONDS, max_age: int = MAX_AGE_SECONDS):
+        self.signer = itsdangerous.TimestampSigner(str(secret_key), salt="session-data")
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+
+    def encode(self, data: Dict[str, Any], created: float) -> str:
+        payload = base64.urlsafe_b64encode(dumps({"data": data, "created": created}))
+        return self.signer.sign(payload).decode("utf-8")
+
+    def decode(self, value: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Registro {"data", "created", "signed_at"} ou None (inválido/vencido)."""
+        if not value:
+            return None
+        try:
+            payload, signed_at = self.signer.unsign(
+                value.encode("utf-8"), max_age=self.idle_timeout, return_timestamp=True
+            )
+            record = json.loads(base64.urlsafe_b64decode(payload))
+        except (itsdangerous.BadSignature, ValueError):
+            return None
+        if record.get("created", 0) + self.max_age <= time.time():
+            return None
+        record["signed_at"] = signed_at.timestamp()
+        return record
+
+
+# =============================================================================
+# Middleware
+# =============================================================================
+class ServerSessionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        secret_key: str,
+        session_cookie: str = COOKIE_NAME,
+        same_site: str = "lax",
+        https_only: bool = False,
+        session_store: Optional[SessionStore] = None,
+    ):
+        self.app = app
+        self.signer = itsdangerous.Signer(str(secret_key), salt="session-id")
+        self.session_cookie = session_cookie
+        self.store = session_store or store
+        self.codec = CookieSessionCodec(secret_key, self.store.idle_timeout, self.store.max_age)
+        self.security_flags = f"httponly; samesite={same_site}"
+        if https_only:
+            self.security_flags += "; secure"
+
+    async def _call_store(self, fn, *args):
+        # Redis bloqueia: roda fora do event loop; o backend local é só um dict
+        if self.store.backend.shared:
+            return await anyio.to_thread.run_sync(fn, *args)
+        return fn(*args)
+
+    def _unsign(self, value: Optional[str]) -> Optional[str]:
+        if not value:
+            return None
+        try:
+            return self.signer.unsign(value.encode("utf-8")).decode("utf-8")
+        except itsdangerous.BadSignature:
+            return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        if not self.store.backend.shared:
+            await self._call_with_cookie_payload(scope, receive, send)
+            return
+
+        cookie = HTTPConnection(scope).cookies.get(self.session_cookie)
+        sid = self._unsign(cookie)
+        record = None
+        if sid:
+            try:
+                record = await self._call_store(self.store.load, sid)
+            except Exception as e:
+                print(f"ERRO AO LER SESSÃO: {e}")
+        if record is None:
+            # ID desconhecido, vencido ou revogado: começa uma sessão vazia
+            sid = None
+        initial_raw = record["raw"] if record else None
+        initial_email = record.get("email") if record else None
+        created = record.get("created") if record else None
+        scope["session"] = Session(record["data"] if record else {})
+
+        async def send_wrapper(message: Message):
+            nonlocal sid, created
+            if message["type"] != "http.response.start":
+                await send(message)
+                return
+            session: Dict[str, Any] = scope["session"]
+            headers = MutableHeaders(scope=message)
+            try:
+                if session:
+                    email = _email_of(session)
+                    raw = dumps({"data": session, "created": created, "email": email}) if sid else None
+                    if sid is None or email != initial_email:
+                        # Sessão nova ou troca de usuário (login): novo ID
+                        if sid is not None:
+                            await self._call_store(self.store.delete, sid, initial_email)
+                        sid = secrets.token_urlsafe(32)
+                        created = time.time()
+                        await self._call_store(self.store.save, sid, dict(session), created)
+                        if email:
+                            await self._call_store(self.store.link_user, email, sid)
+                        headers.append("Set-Cookie", self._cookie(self.signer.sign(sid).decode("utf-8")))
+                    elif raw != initial_raw:
+                        await self._call_store(self.store.save, sid, dict(session), created)
+                    else:
+                        self.store.touch(sid, created)
+                elif sid is not None or cookie:
+                    if sid is not None:
+                        await self._call_store(self.store.delete, sid, initial_email)
+                    headers.append("Set-Cookie", self._cookie("null", expired=True))
+            except Exception as e:
+                print(f"ERRO AO GRAVAR SESSÃO: {e}")
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+        if self.store.flush_due():
+            await self._call_store(self.store.flush_touches)
+
+    async def _call_with_cookie_payload(self, scope: Scope, receive: Receive, send: Send):
+        cookie = HTTPConnection(scope).cookies.get(self.session_cookie)
+        record = self.codec.decode(cookie)
+        initial_raw = dumps(record["data"]) if record else None
+        initial_email = _email_of(record["data"]) if record else None
+        scope["session"] = Session(record["data"] if record else {})
+
+        async def send_wrapper(message: Message):
+            if message["type"] != "http.response.start":
+                await send(message)
+                return
+            session: Dict[str, Any] = scope["session"]
+            headers = MutableHeaders(scope=message)
+            if session:
+                email = _email_of(session)
+                created = record["created"] if record and email == initial_email else time.time()
+                renew = record is None or time.time() - record["signed_at"] >= TOUCH_FLUSH_SECONDS
+                if renew or email != initial_email or dumps(dict(session)) != initial_raw:
+                    headers.append("Set-Cookie", self._cookie(self.codec.encode(dict(session), created)))
+            elif cookie:
+                headers.append("Set-Cookie", self._cookie("null", expired=True))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _cookie(self, value: str, expired: bool = False) -> str:
+        if expired:
+            return f"{self.session_cookie}={value}; path=/; expires=Thu, 01 Jan 1970 00:00:00 GMT; {self.security_flags}"
+        return f"{self.session_cookie}={value}; path=/; Max-Age={self.store.max_age}; {self.security_flags}"
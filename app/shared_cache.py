@@ -0,0 +1,216 @@
+# app/shared_cache.py
+"""
+Camada compartilhada (L2) do cache entre os workers do gunicorn.
+
+Com `CACHE_REDIS_URL` definido, usa um servidor que fale o protocolo Redis
+(Redis, Valkey, KeyDB, Dragonfly...), de preferência local à máquina. Sem
+ele, `LocalBackend` cumpre o mesmo contrato dentro do processo — é o
+substituto usado em dev e com um único worker.
+
+O backend guarda:
+- valores serializados (pickle) com TTL, sob chaves que incluem a época do
+  namespace — invalidar = incrementar a época, e as chaves antigas morrem;
+- a época de cada namespace (INCR), lida na subida de cada worker;
+- um canal pub/sub por onde as invalidações chegam aos outros workers.
+
+Falhas no servidor nunca derrubam a requisição: o cache cai para o L1 local.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    import redis  # type: ignore
+except ImportError:  # pragma: no cover - só é necessário com CACHE_REDIS_URL
+    redis = None
+
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+KEY_PREFIX = os.environ.get("CACHE_KEY_PREFIX", "precificacao:cache")
+INVALIDATION_CHANNEL = f"{KEY_PREFIX}:invalidate"
+
+# Espera (s) antes de reconectar o listener de invalidações
+RECONNECT_DELAY_SECONDS = 1.0
+# Tamanho a partir do qual o LocalBackend varre as chaves vencidas
+PRUNE_MIN_KEYS = 1024
+
+MessageHandler = Callable[[bytes], None]
+
+
+def epoch_key(name: str) -> str:
+    return f"{KEY_PREFIX}:epoch:{name}"
+
+
+def value_key(name: str, epoch: int, digest: str) -> str:
+    return f"{KEY_PREFIX}:{name}:{epoch}:{digest}"
+
+
+# =============================================================================
+# Backend local (substituto em processo)
+# =============================================================================
+class LocalBackend:
+    shared = False
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[bytes, float]] = {}
+        self._counters: Dict[str, int] = {}
+        self._prune_at = PRUNE_MIN_KEYS
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return None
+            if item[1] <= time.monotonic():
+                del self._values[key]
+                return None
+            return item[0]
+
+    def set(self, key: str, value: bytes, ttl: int):
+        with self._lock:
+            now = time.monotonic()
+            self._values[key] = (value, now + ttl)
+            if len(self._values) >= self._prune_at:
+                # Chaves vencidas que nunca mais foram lidas (ex.: sessões abandonadas)
+                self._values = {k: v for k, v in self._values.items() if v[1] > now}
+                self._prune_at = max(PRUNE_MIN_KEYS, 2 * len(self._values))
+
+    def set_nx(self, key: str, value: bytes, ttl: int) -> bool:
+        """Grava só se a chave não existir (ou já tiver vencido)."""
+        with self._lock:
+            item = self._values.get(key)
+            now = time.monotonic()
+            if item is not None and item[1] > now:
+                return False
+            self._values[key] = (value, now + ttl)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def expire(self, key: str, ttl: int):
+        with self._lock:
+            item = self._values.get(key)
+            if item is not None:
+                self._values[key] = (item[0], time.monotonic() + ttl)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def get_int(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def publish(self, message: bytes):
+        # Um único processo: não há outros workers para avisar
+        pass
+
+    def subscribe(self, on_message: MessageHandler, on_reconnect: Callable[[], None]):
+        pass
+
+
+# =============================================================================
+# Backend Redis
+# =============================================================================
+class RedisBackend:
+    shared = True
+
+    def __init__(self, url: str):
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        # Sem timeout de leitura: o listen() fica bloqueado esperando mensagens
+        self._sub_client = redis.Redis.from_url(url, socket_connect_timeout=0.5)
+        self._listener: Optional[threading.Thread] = None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self._client.set(key, value, ex=ttl)
+
+    def set_nx(self, key: str, value: bytes, ttl: int) -> bool:
+        return bool(self._client.set(key, value, ex=ttl, nx=True))
+
+    def delete(self, key: str):
+        self._client.delete(key)
+
+    def expire(self, key: str, ttl: int):
+        self._client.expire(key, ttl)
+
+    def incr(self, key: str) -> int:
+        return int(self._client.incr(key))
+
+    def get_int(self, key: str) -> int:
+        return int(self._client.get(key) or 0)
+
+    def publish(self, message: bytes):
+        self._client.publish(INVALIDATION_CHANNEL, message)
+
+    def subscribe(self, on_message: MessageHandler, on_reconnect: Callable[[], None]):
+        if self._listener is not None:
+            return
+        self._listener = threading.Thread(
+            target=self._listen, args=(on_message, on_reconnect), name="cache-invalidation", daemon=True
+        )
+        self._listener.start()
+
+    def _listen(self, on_message: MessageHandler, on_reconnect: Callable[[], None]):
+        first = True
+        while True:
+            try:
+                pubsub = self._sub_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                if not first:
+                    # Mensagens perdidas durante a queda: ressincroniza as épocas
+                    on_reconnect()
+                first = False
+                for msg in pubsub.listen():
+                    if msg.get("type") == "message":
+                        on_message(msg["data"])
+            except Exception as e:
+                print(f"ERRO NO LISTENER DE INVALIDAÇÃO DO CACHE: {e}")
+                time.sleep(RECONNECT_DELAY_SECONDS)
+
+
+# =============================================================================
+# Seleção do backend (por processo)
+# =============================================================================
+_backend = None
+_backend_pid: Optional[int] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Backend do processo atual. É recriado após um fork (gunicorn --preload),
+    já que conexões e threads não sobrevivem ao fork.
+    """
+    global _backend, _backend_pid
+    pid = os.getpid()
+    if _backend is not None and _backend_pid == pid:
+        return _backend
+    with _backend_lock:
+        if _backend is None or _backend_pid != pid:
+            _backend = _create_backend()
+            _backend_pid = pid
+    return _backend
+
+
+def _create_backend():
+    if not CACHE_REDIS_URL:
+        return LocalBackend()
+    if redis is None:
+        print("AVISO: CACHE_REDIS_URL definido, mas o pacote 'redis' não está instalado; usando cache local.")
+        return LocalBackend()
+    try:
+        backend = RedisBackend(CACHE_REDIS_URL)
+        backend._client.ping()
+        return backend
+    except Exception as e:
+        print(f"AVISO: cache compartilhado indisponível ({e}); usando cache local.")
+        return LocalBackend()
@@ -0,0 +1,232 @@
+# app/user_directory.py
+"""
+Diretório de usuários em memória (autorização e papéis).
+
+- Índice compacto email -> UserEntry de toda a tabela `usuarios`, carregado
+  numa única consulta e revalidado em background a cada INDEX_TTL_SECONDS;
+- o login carrega só o registro do usuário (`load_user`) e decide as flags
+  a partir dele (`is_admin` / `is_authorized`);
+- edições feitas pelo admin (`push_update`) alteram o índice local na hora
+  e invalidam o namespace "users" do cache — os outros workers recarregam o
+  índice na próxima checagem;
+- `get_current_user` consulta o índice a cada requisição (lookup em dict),
+  então revogações e rebaixamentos valem sem esperar um novo login. A
+  requisição nunca espera o BigQuery: carga inicial e recargas (idade ou
+  alteração vinda de outro worker) rodam em background, single-flight,
+  enquanto o índice atual segue valendo — antes da primeira carga, valem
+  as flags decididas no login (sessão).
+
+Se o BigQuery estiver indisponível, o índice antigo (ou a sessão) continua
+valendo — nunca bloqueia todos os usuários por falha de infraestrutura.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Optional
+
+from . import cache
+
+# Domínios permitidos (CSV) para conceder "autorizado" por domínio
+ALLOWED_DOMAINS = [d.strip().lower() for d in os.getenv("AUTH_ALLOWED_DOMAINS", "").split(",") if d.strip()]
+# Lista de e-mails admin (CSV)
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+
+# Idade (s) a partir da qual o índice é recarregado
+INDEX_TTL_SECONDS = 120
+
+_TRUE = {"1", "true", "t", "yes", "y", "sim"}
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-directory")
+
+
+@dataclass(frozen=True)
+class UserEntry:
+    email: str
+    nome: Optional[str] = None
+    foto_url: Optional[str] = None
+    autorizado: bool = False
+    funcao: str = "usuario"
+    pode_ver_historico: bool = False
+
+    @property
+    def is_admin(self) -> bool:
+        return self.funcao == "admin"
+
+
+def _bool(v: Any) -> bool:
+    if isinstance(v, str):
+        return v.strip().lower() in _TRUE
+    return bool(v)
+
+
+def _entry(row: Dict[str, Any]) -> Optional[UserEntry]:
+    email = str(row.get("email") or "").strip().lower()
+    if not email:
+        return None
+    return UserEntry(
+        email=email,
+        nome=row.get("nome") or row.get("name"),
+        foto_url=row.get("foto_url") or row.get("picture"),
+        autorizado=_bool(row.get("autorizado") if row.get("autorizado") is not None else row.get("authorized")),
+        funcao=str(row.get("funcao") or row.get("role") or "usuario"),
+        pode_ver_historico=_bool(row.get("pode_ver_historico")),
+    )
+
+
+def _services():
+    from . import services
+    return services
+
+
+# =============================================================================
+# Índice
+# =============================================================================
+class _Index:
+    def __init__(self):
+        self.users: Optional[Dict[str, UserEntry]] = None
+        self.loaded_at = 0.0
+        self.version = -1
+        self.refreshing = False
+        self.failed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _namespace_version(self) -> int:
+        return cache.namespace("users").version
+
+    def load(self):
+        with self._load_lock:
+            version = self._namespace_version()
+            if self.users is not None and version == self.version and not self._expired():
+                return
+            rows = _services().get_all_users() or []
+            users = {e.email: e for e in (_entry(r) for r in rows if isinstance(r, dict)) if e}
+            with self._lock:
+                self.users = users
+                self.version = version
+                self.loaded_at = time.monotonic()
+
+    def _expired(self) -> bool:
+        return time.monotonic() - self.loaded_at >= INDEX_TTL_SECONDS
+
+    def _backoff(self) -> bool:
+        return self.failed_at is not None and time.monotonic() - self.failed_at < cache.ERROR_BACKOFF_SECONDS
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self.refreshing or self._backoff():
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.load()
+                self.failed_at = None
+            except Exception as e:
+                self.failed_at = time.monotonic()
+                print(f"ERRO AO ATUALIZAR DIRETÓRIO DE USUÁRIOS: {e}")
+            finally:
+                with self._lock:
+                    self.refreshing = False
+
+        _executor.submit(run)
+
+    def get(self, email: str) -> Optional[UserEntry]:
+        # Chamado do event loop (get_current_user): nunca carrega aqui
+        if self.users is None or self.version != self._namespace_version() or self._expired():
+            self._refresh_in_background()
+        users = self.users
+        return users.get(email) if users is not None else None
+
+    def put(self, entry: UserEntry):
+        with self._lock:
+            if self.users is not None:
+                self.users = {**self.users, entry.email: entry}
+
+
+_index = _Index()
+
+
+# =============================================================================
+# API
+# =============================================================================
+def warm():
+    """Dispara a carga do índice em background (lifespan da aplicação)."""
+    _index._refresh_in_background()
+
+
+def lookup(email: str) -> Optional[UserEntry]:
+    """Registro do usuário pelo índice em memória (None se não cadastrado)."""
+    email = (email or "").strip().lower()
+    return _index.get(email) if email else None
+
+
+def load_user(email: str) -> Optional[UserEntry]:
+    """Carrega só o registro do usuário (login) e atualiza o índice."""
+    email = (email or "").strip().lower()
+    if not email:
+        return None
+    try:
+        row = _services().get_user_by_email(email)
+    except Exception as e:
+        print(f"ERRO AO BUSCAR USUÁRIO {email}: {e}")
+        return None
+    entry = _entry(row) if isinstance(row, dict) else None
+    if entry:
+        _index.put(entry)
+    return entry
+
+
+def is_admin(email: str, entry: Optional[UserEntry]) -> bool:
+    """Cadastro manda; sem cadastro, vale ADMIN_EMAILS."""
+    if entry is not None:
+        return entry.is_admin
+    return (email or "").strip().lower() in ADMIN_EMAILS
+
+
+def is_authorized(email: str, entry: Optional[UserEntry]) -> bool:
+    """Cadastro manda (admins sempre autorizados); sem cadastro, vale domínio permitido ou admin."""
+    if entry is not None:
+        return entry.autorizado or entry.is_admin
+    email_l = (email or "").strip().lower()
+    if not email_l:
+        return False
+    if ALLOWED_DOMAINS and email_l.split("@")[-1] in ALLOWED_DOMAINS:
+        return True
+    return is_admin(email_l, None)
+
+
+def push_update(email: str, **changes: Any):
+    """
+    Aplica uma alteração feita pelo admin: atualiza o índice local e avisa os
+    demais workers (invalidação do namespace "users").
+    """
+    email = (email or "").strip().lower()
+    cache.invalidate("users")
+    with _index._lock:
+        current = (_index.users or {}).get(email)
+        _index.version = _index._namespace_version()
+    if current is not None:
+        _index.put(replace(current, **changes))
+
+
+def session_overrides(user: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Flags atuais do usuário da sessão segundo o diretório, ou None se ele não
+    estiver cadastrado (vale o que foi decidido no login).
+    """
+    entry = lookup(user.get("email") or "")
+    if entry is None:
+        return None
+    autorizado = is_authorized(entry.email, entry)
+    return {
+        "autorizado": autorizado,
+        "authorized": autorizado,
+        "funcao": entry.funcao,
+        "role": entry.funcao,
+        "is_admin": entry.is_admin,
+        "pode_ver_historico": entry.pode_ver_historico,
+    }